@@ -0,0 +1,639 @@
+"""headless batch calculation of the empirical parameters. Alloy compositions are streamed from a '.csv' or '.xlsx'
+file in the format of 'test_dataset.xlsx', evaluated chunk by chunk with the vectorized engine and written to a '.csv'
+file or a typed columnar file ('.npy', '.parquet' or '.arrow'), so that arbitrarily large files can be processed with
+bounded memory and without a display."""
+
+import collections
+import csv
+import itertools
+import json
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import empirical_parameter_calculator as calculator
+import instrumentation
+
+# the parameters of the '.csv' batch output unless others are selected, in column order
+OUTPUT_NAMES = ('mix_enthalpy', 'std_enthalpy', 'delta', 'omega', 'mix_entropy', 'Tm', 'std_Tm', 'x', 'std_x', 'vec',
+                'vec_std', 'density', 'price')
+
+
+def output_header(names=OUTPUT_NAMES):
+    """function to return the header of a '.csv' batch output of the named parameters, labelled as in the registry"""
+    return ['Elements', 'Molar_ratios'] + [calculator.parameter_registry[name].label for name in names]
+
+
+# the columns of the default '.csv' batch output
+OUTPUT_HEADER = output_header()
+
+# the number of alloys evaluated and written at a time
+default_chunk_size = 10000
+
+# element symbol -> table position, and the pattern of formula strings such as 'AlCoCrFeNi2.1' or 'Al0.5CoCrFeNi'
+_symbol_index = calculator.element_data.index
+_formula_pattern = re.compile(r'(?:[A-Z][a-z]?(?:\d+\.?\d*|\.\d+)?)+')
+_formula_token = re.compile(r'([A-Z][a-z]?)(\d+\.?\d*|\.\d+)?')
+
+
+def read_rows(file_path):
+    """generator that yields the rows of the first sheet of a '.csv' or '.xlsx' file one at a time"""
+    extension = file_path.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        with open(file_path, newline='') as csvfile:
+            for row in csv.reader(csvfile, delimiter=','):
+                yield row
+    elif extension == 'xlsx':
+        import openpyxl
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for row in wb.worksheets[0].iter_rows(values_only=True):
+                yield ['' if cell is None else str(cell) for cell in row]
+        finally:
+            wb.close()
+    else:
+        raise ValueError('unsupported input file type: {}'.format(file_path))
+
+
+def read_byte_range(file_path, start, end):
+    """generator that yields the rows of a '.csv' file whose lines start at a byte offset in [start, end), so that
+    consecutive ranges of a file split at arbitrary offsets yield each row exactly once"""
+    with open(file_path, 'rb') as infile:
+        if start > 0:
+            # the line running into the range belongs to the previous range
+            infile.seek(start - 1)
+            infile.readline()
+        position = infile.tell()
+
+        def lines():
+            nonlocal position
+            while position < end:
+                line = infile.readline()
+                if len(line) == 0:
+                    return
+                position += len(line)
+                yield line.decode()
+        for row in csv.reader(lines(), delimiter=','):
+            yield row
+
+
+def read_shard(file_path, shard):
+    """generator that yields the rows of a shard of an input file, given as a (method, start, end) triple: the rows
+    start to end (exclusive) for 'rows', or the lines starting at a byte offset in [start, end) for 'bytes'"""
+    method, start, end = shard
+    if method == 'bytes':
+        return read_byte_range(file_path, start, end)
+    if method == 'rows':
+        return itertools.islice(read_rows(file_path), start, end)
+    raise ValueError('unknown shard method {}'.format(method))
+
+
+def count_rows(file_path):
+    """function to return the number of rows of a '.csv' or '.xlsx' input file without parsing them, used for progress
+    reporting. Returns None when the number of rows of an '.xlsx' file is not recorded in the file"""
+    if file_path.rsplit('.', 1)[-1].lower() == 'xlsx':
+        import openpyxl
+        wb = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            return wb.worksheets[0].max_row
+        finally:
+            wb.close()
+
+    count = 0
+    last = b'\n'
+    with open(file_path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            count += block.count(b'\n')
+            last = block[-1:]
+    return count + (last != b'\n')
+
+
+def parse_composition(elements, ratios=''):
+    """function to parse a composition into a list of table positions and a list of mole ratios. The composition is
+    either a comma separated list of element symbols with a matching comma separated list of ratios, or a formula
+    string such as 'AlCoCrFeNi2.1' (an element without a number has a ratio of 1)"""
+    elements = elements.strip()
+    if ',' in elements or len(ratios.strip()) > 0:
+        index = list(map(_symbol_index.__getitem__, filter(None, elements.replace(' ', '').split(','))))
+        mol_ratio = list(map(float, filter(None, ratios.replace(' ', '').split(','))))
+        if len(index) != len(mol_ratio):
+            raise ValueError('{} elements but {} molar ratios'.format(len(index), len(mol_ratio)))
+        return index, mol_ratio
+
+    if _formula_pattern.fullmatch(elements) is None:
+        raise ValueError('{} is not an alloy formula'.format(elements))
+    index = []
+    mol_ratio = []
+    for symbol, ratio in _formula_token.findall(elements):
+        index.append(_symbol_index[symbol])
+        mol_ratio.append(float(ratio) if ratio else 1.0)
+    return index, mol_ratio
+
+
+def parse_rows(rows, start=1):
+    """generator that turns input rows into (element_list, mol_ratio) pairs of table positions and mole ratios,
+    skipping empty and header rows. start is the line number of the first row, used in error messages"""
+    for line, row in enumerate(rows, start):
+        if len(row) == 0 or row[0] == 'Element' or len(row[0].strip()) == 0:
+            continue
+        try:
+            yield parse_composition(row[0], row[1] if len(row) > 1 else '')
+        except (KeyError, ValueError) as error:
+            raise ValueError('row {} is not a valid alloy composition ({}): {}'.format(line, error, row))
+
+
+def chunked(iterable, chunk_size):
+    """generator that groups an iterable into lists of at most chunk_size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def format_rows(compositions, parameters, names=None):
+    """function to return the output file rows for a chunk of compositions, given as lists of table positions and
+    mole ratios, and their parameters. The parameter columns are those of names (OUTPUT_NAMES if None), scaled or
+    formatted as registered"""
+    columns = []
+    for name in OUTPUT_NAMES if names is None else names:
+        parameter = calculator.parameter_registry[name]
+        if parameter.text is not None:
+            columns.append(parameter.text(parameters[name]))
+        else:
+            columns.append((parameters[name] * parameter.scale).tolist())
+    symbols = calculator.element_data.symbols
+    rows = []
+    for i, (elements, ratios) in enumerate(compositions):
+        element_str = ''.join([symbols[element] + '-' for element in elements])
+        ratio_str = calculator.ratio_text(ratios, '-')
+        rows.append([element_str, ratio_str] + [column[i] for column in columns])
+    return rows
+
+
+# the parameter caches opened by this process, by path
+_caches = {}
+
+
+def get_cache(path):
+    """function to return the parameter cache of this process backed by the SQLite file at path"""
+    if path not in _caches:
+        import parameter_cache
+        _caches[path] = parameter_cache.ParameterCache(path=path)
+    return _caches[path]
+
+
+def columnar_chunk(compositions, parameters, names=None):
+    """function to return the (elements, ratios, parameters) columns of a chunk for the columnar writers, where the
+    compositions are formatted as in the '.csv' output and the parameters are left as the compute_batch array (only
+    the fields of names, if given)"""
+    symbols = calculator.element_data.symbols
+    elements = ['-'.join([symbols[element] for element in element_list]) for element_list, _ in compositions]
+    ratios = [calculator.ratio_text(mol_ratio) for _, mol_ratio in compositions]
+    if names is not None:
+        parameters = parameters[list(names)]
+    return elements, ratios, parameters
+
+
+def _truncate(path, size):
+    """function to cut a file back to its first size bytes"""
+    with open(path, 'r+b') as out:
+        out.truncate(size)
+
+
+class CsvWriter(object):
+    """writer of the batch results as a '.csv' file in the format of the user interface, with the parameter columns
+    of names (OUTPUT_NAMES if None). resume is the state returned by commit, the file is then cut back to that state
+    and appended to without a second header"""
+
+    def __init__(self, path, resume=None, names=None):
+        if resume is None:
+            self.count = 0
+            self.file = open(path, 'w', newline='')
+            self.csv_write = csv.writer(self.file, dialect='excel')
+            self.csv_write.writerow(output_header(OUTPUT_NAMES if names is None else names))
+        else:
+            self.count = resume['alloys']
+            _truncate(path, resume['bytes'])
+            self.file = open(path, 'a', newline='')
+            self.csv_write = csv.writer(self.file, dialect='excel')
+
+    prepare = staticmethod(format_rows)
+
+    def write(self, rows):
+        self.csv_write.writerows(rows)
+        self.count += len(rows)
+        return len(rows)
+
+    def commit(self):
+        """function to flush the rows written so far to disk, returns the state a later run can resume from"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {'alloys': self.count, 'bytes': os.fstat(self.file.fileno()).st_size}
+
+    def close(self):
+        self.file.close()
+
+
+# the default number of characters of the compositions in '.npy' outputs, see NpyWriter
+default_npy_width = 96
+
+
+def _npy_header(dtype, count, size=0):
+    """function to return the version 1.0 '.npy' header of a 1D array of count records, padded with spaces to size
+    bytes"""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (count,)})
+    header = header.ljust(size - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class NpyWriter(object):
+    """writer of the batch results as a '.npy' structured array that can be loaded with np.load(path, mmap_mode='r').
+    The compositions are stored as fixed width byte strings of at most width characters (default_npy_width if None),
+    the parameters of names (PARAMETER_NAMES if None) as float64 in the units of EmpiricalParams. The header reserves
+    room for the final shape and is rewritten on commit and close. resume is the state returned by commit, the file is
+    then cut back to that state and appended to with the width it was started with"""
+
+    def __init__(self, path, width=None, resume=None, names=None):
+        if resume is not None:
+            width = resume.get('width', width)
+        self.path = path
+        self.width = default_npy_width if width is None else width
+        if self.width < 1:
+            raise ValueError('the .npy width must be positive, not {}'.format(self.width))
+        self.names = calculator.PARAMETER_NAMES if names is None else tuple(names)
+        self.dtype = np.dtype([('elements', 'S{}'.format(self.width)), ('ratios', 'S{}'.format(self.width))] +
+                              calculator.parameter_dtype(self.names).descr)
+        # room for the header of the largest possible shape, rounded up to the 64 byte alignment of the format
+        self.header_size = 64 * ((len(_npy_header(self.dtype, 2 ** 62)) + 63) // 64)
+        if resume is None:
+            self.count = 0
+            self.file = open(path, 'wb')
+            self.file.write(_npy_header(self.dtype, 0, self.header_size))
+        else:
+            self.count = resume['alloys']
+            _truncate(path, self.header_size + self.count * self.dtype.itemsize)
+            self.file = open(path, 'r+b')
+            self.file.seek(0, os.SEEK_END)
+
+    prepare = staticmethod(columnar_chunk)
+
+    def write(self, chunk):
+        elements, ratios, parameters = chunk
+        longest = max([len(text) for text in elements + ratios], default=0)
+        if longest > self.width:
+            raise ValueError('compositions of {} characters do not fit the .npy width of {}, use a width of at least '
+                             '{} (--npy-width) or a .parquet/.arrow output'.format(longest, self.width, longest))
+        records = np.empty(len(parameters), dtype=self.dtype)
+        records['elements'] = elements
+        records['ratios'] = ratios
+        for name in self.names:
+            records[name] = parameters[name]
+        records.tofile(self.file)
+        self.count += len(records)
+        return len(records)
+
+    def _write_header(self):
+        """function to write the header of the records written so far"""
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, self.count, self.header_size))
+        self.file.seek(0, os.SEEK_END)
+
+    def commit(self):
+        """function to flush the records written so far to disk, returns the state a later run can resume from"""
+        self._write_header()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {'alloys': self.count, 'bytes': self.file.tell(), 'width': self.width}
+
+    def close(self):
+        if not self.file.closed:
+            self._write_header()
+            self.file.close()
+
+
+class ArrowWriter(object):
+    """writer of the batch results as an Arrow IPC ('.arrow'/'.feather') or a Parquet ('.parquet') file with one
+    record batch/row group per chunk, requires pyarrow. Columns are 'elements', 'ratios' and the parameters of names
+    (PARAMETER_NAMES if None) as float64 in the units of EmpiricalParams, an unknown price is nan"""
+
+    def __init__(self, path, parquet=False, names=None):
+        import pyarrow
+
+        self.pyarrow = pyarrow
+        self.names = calculator.PARAMETER_NAMES if names is None else tuple(names)
+        self.schema = pyarrow.schema([('elements', pyarrow.string()), ('ratios', pyarrow.string())] +
+                                     [(name, pyarrow.float64()) for name in self.names])
+        if parquet:
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    prepare = staticmethod(columnar_chunk)
+
+    def write(self, chunk):
+        elements, ratios, parameters = chunk
+        pyarrow = self.pyarrow
+        columns = [pyarrow.array(elements, pyarrow.string()), pyarrow.array(ratios, pyarrow.string())]
+        columns += [pyarrow.array(parameters[name]) for name in self.names]
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+        return len(parameters)
+
+    def close(self):
+        self.writer.close()
+
+
+# the output formats by file extension
+output_formats = {'csv': CsvWriter, 'npy': NpyWriter, 'parquet': ArrowWriter, 'arrow': ArrowWriter,
+                  'feather': ArrowWriter}
+
+
+# the output formats whose writers can commit and resume, see run_batch
+resumable_formats = ('csv', 'npy')
+
+
+def open_writer(path, output_format=None, resume=None, names=None, npy_width=None):
+    """function to open the writer of the output format, which defaults to the extension of path. resume is the
+    commit state of an earlier run to continue from, only the resumable_formats can be resumed. names are the
+    parameters written, the default ones of the format if None. npy_width is the width of the compositions of a
+    '.npy' output, see NpyWriter"""
+    if output_format is None:
+        output_format = path.rsplit('.', 1)[-1].lower()
+    if output_format not in output_formats:
+        raise ValueError('unsupported output format: {}'.format(output_format))
+    if output_format == 'parquet':
+        return ArrowWriter(path, parquet=True, names=names)
+    if output_format == 'npy':
+        return NpyWriter(path, width=npy_width, resume=resume, names=names)
+    if output_format in resumable_formats:
+        return output_formats[output_format](path, resume=resume, names=names)
+    return output_formats[output_format](path, names=names)
+
+
+def checkpoint_path(out_path):
+    """function to return the path of the checkpoint file of a batch output"""
+    return out_path + '.checkpoint'
+
+
+def _input_state(in_path):
+    """function to return the identity of an input file recorded in checkpoints, so that a run is only resumed on the
+    input it was started on"""
+    stat = os.stat(in_path)
+    return {'input': os.path.abspath(in_path), 'input_size': stat.st_size, 'input_mtime_ns': stat.st_mtime_ns}
+
+
+def read_checkpoint(out_path):
+    """function to return the checkpoint of a batch output as a dictionary, None if there is none"""
+    try:
+        with open(checkpoint_path(out_path)) as checkpoint:
+            return json.load(checkpoint)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path, state):
+    """function to replace a JSON file atomically: it is written to a temporary file first, so that an interrupted
+    run leaves either the previous or the new content"""
+    with open(path + '.tmp', 'w') as out:
+        json.dump(state, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def write_checkpoint(out_path, state):
+    """function to replace the checkpoint of a batch output atomically, see write_json"""
+    write_json(checkpoint_path(out_path), state)
+
+
+def _checkpoint_matches(state, in_path, out_path, output_format, names=None, shard=None):
+    """function to return whether a checkpoint was written by a run of in_path into out_path in output_format, with
+    the parameters of names (the default ones if None) and over the same shard of the input"""
+    return (state['format'] == output_format and os.path.exists(out_path)
+            and state.get('parameters') == (None if names is None else list(names))
+            and state.get('shard') == (None if shard is None else list(shard))
+            and all(state[key] == value for key, value in _input_state(in_path).items()))
+
+
+def resumable(in_path, out_path, output_format=None, names=None, shard=None):
+    """function to return whether an unfinished run of in_path into out_path can be resumed"""
+    if output_format is None:
+        output_format = out_path.rsplit('.', 1)[-1].lower()
+    state = read_checkpoint(out_path)
+    return (state is not None and not state['complete']
+            and _checkpoint_matches(state, in_path, out_path, output_format, names, shard))
+
+
+def process_chunk(rows, start=1, cache_path=None, output_format='csv', columns=False, names=None):
+    """function to parse a chunk of input rows, calculate their empirical parameters and return them prepared for
+    the writer of output_format (the output rows for 'csv'). names are the parameters calculated, PARAMETER_NAMES if
+    None. With a cache_path, compositions already in the persistent parameter cache are not recomputed. With columns,
+    a pair of the prepared chunk and its columnar_chunk is returned"""
+    with instrumentation.stage('batch.parse'):
+        compositions = list(parse_rows(rows, start))
+    with instrumentation.stage('batch.compute'):
+        if len(compositions) == 0:
+            parameters = np.empty(0, dtype=calculator.parameter_dtype(names or calculator.PARAMETER_NAMES))
+        elif cache_path is not None:
+            parameters = get_cache(cache_path).compute_batch(compositions, names or calculator.PARAMETER_NAMES)
+        else:
+            parameters = calculator.compute_batch(compositions, names or calculator.PARAMETER_NAMES)
+    if instrumentation.active is not None and instrumentation.active.sample_rate > 0:
+        with instrumentation.stage('batch.sample_rows'):
+            instrumentation.active.sample_rows(compositions, start)
+    with instrumentation.stage('batch.format'):
+        prepared = output_formats[output_format].prepare(compositions, parameters, names)
+        if not columns:
+            return prepared
+        if output_formats[output_format].prepare is not columnar_chunk:
+            return prepared, columnar_chunk(compositions, parameters, names)
+        return prepared, prepared
+
+
+# the lookup counters of ParameterCache.stats added up over the processes of a run
+cache_counters = ('hits', 'disk_hits', 'misses')
+
+
+def _cached_chunk(*job):
+    """function run for every chunk of a run with a parameter cache: process_chunk of job, returned together with
+    the lookups it made in the cache of the process, so that those of the worker processes can be added up"""
+    cache = get_cache(job[2])
+    before = cache.stats()
+    prepared = process_chunk(*job)
+    after = cache.stats()
+    return prepared, {counter: after[counter] - before[counter] for counter in cache_counters}
+
+
+def _profiled_chunk(options, function, *job):
+    """function run in the worker processes while instrumentation is on: function (process_chunk or _cached_chunk)
+    of job, recorded by the profiler of the worker (created with options) and returned together with the recorded
+    data"""
+    profiler = instrumentation.active or instrumentation.enable(**options)
+    profiler.reset()
+    prepared = function(*job)
+    return prepared, profiler.export()
+
+
+def _init_worker():
+    """initializer of the batch worker processes, the element data is built (or inherited) once per worker when the
+    calculator is imported rather than once per chunk"""
+    return calculator.element_data
+
+
+def map_chunks(function, jobs, workers=1):
+    """generator that yields function(*job) for every job in input order. With more than one worker the jobs are run
+    in a process pool, keeping at most two jobs per worker in flight so that memory stays bounded"""
+    if workers <= 1:
+        for job in jobs:
+            yield function(*job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(executor.submit(function, *job))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch(in_path, out_path, chunk_size=default_chunk_size, workers=1, cache_path=None, output_format=None,
+              resume=False, progress=None, cancel=None, index_path=None, names=None, shard=None, cache_stats=None,
+              npy_width=None):
+    """function to calculate the empirical parameters of every alloy in in_path and write them to out_path, returns
+    the number of alloys written. The output format ('csv', 'npy', 'parquet', 'arrow' or 'feather') defaults to the
+    extension of out_path. workers is the number of processes the chunks are distributed over, 0 or None uses every
+    available core. cache_path is an optional SQLite parameter cache shared by the workers and kept across runs, the
+    lookups its caches in all the processes make are added to the dictionary cache_stats (see cache_counters).
+    names selects the parameters of the output (see calculator.parameter_registry), only those are calculated. By
+    default the '.csv' output has the columns of OUTPUT_NAMES and the other formats all of PARAMETER_NAMES.
+    npy_width is the number of characters the compositions of a '.npy' output and of the index library can have
+    (default_npy_width if None), a run with longer compositions raises ValueError and removes what it wrote.
+
+    For the resumable_formats, every chunk is flushed to disk and then recorded in the checkpoint file next to the
+    output (see checkpoint_path), which is marked complete at the end. With resume, a run that was interrupted (or
+    cancelled) continues after the last recorded chunk: the input rows already done are skipped and whatever was
+    written after the checkpoint is cut off, so the output is the same as that of an uninterrupted run. progress is
+    called with the number of input rows done after every chunk, and setting the cancel event stops the run after the
+    current chunk.
+
+    With an index_path, the alloys and their parameters are also collected into a similarity index directory (see
+    similarity_index.build_index), which is built once the run is complete. With a shard, a (method, start, end)
+    triple of read_shard, only that part of in_path is processed (see sharding)"""
+    if not workers:
+        workers = os.cpu_count()
+    if output_format is None:
+        output_format = out_path.rsplit('.', 1)[-1].lower()
+    if names is not None:
+        names = tuple(names)
+        calculator.parameter_dtype(names)
+    checkpointed = output_format in resumable_formats
+    state = None
+    if resume:
+        if not checkpointed:
+            raise ValueError('only {} outputs can be resumed'.format(' and '.join(resumable_formats)))
+        state = read_checkpoint(out_path)
+        if state is not None and not _checkpoint_matches(state, in_path, out_path, output_format, names, shard):
+            raise ValueError('the checkpoint of {} was not written by a run of {} in the {} format with the same '
+                             'parameters'.format(out_path, in_path, output_format))
+        if state is not None and state['complete']:
+            return state['alloys']
+    resume = state is not None
+
+    skipped = state['rows'] if resume else 0
+    library = None
+    if index_path is not None:
+        if resume and 'index' not in state:
+            raise ValueError('the run of {} was started without a similarity index'.format(out_path))
+        os.makedirs(index_path, exist_ok=True)
+        library = NpyWriter(os.path.join(index_path, 'library.npy'), width=npy_width,
+                            resume=state['index'] if resume else None, names=names)
+    writer = open_writer(out_path, output_format, resume=state, names=names, npy_width=npy_width)
+    if checkpointed and not resume:
+        state = dict(_input_state(in_path), format=output_format, rows=0, complete=False, **writer.commit())
+        if names is not None:
+            state['parameters'] = list(names)
+        if shard is not None:
+            state['shard'] = list(shard)
+        if library is not None:
+            state['index'] = library.commit()
+        write_checkpoint(out_path, state)
+
+    sizes = collections.deque()
+
+    profiler = instrumentation.active
+    function = process_chunk if cache_path is None else _cached_chunk
+    options = ()
+    if profiler is not None and workers > 1:
+        # worker processes record into profilers of their own, merged here chunk by chunk
+        options = ({'sample_rate': profiler.sample_rate, 'slowest': profiler.slowest}, function)
+        function = _profiled_chunk
+
+    # the line number of the first row, in the shard for byte ranges whose line numbers are not known
+    first_line = 1 + shard[1] if shard is not None and shard[0] == 'rows' else 1
+
+    def jobs():
+        rows = read_rows(in_path) if shard is None else read_shard(in_path, shard)
+        rows = itertools.islice(rows, skipped, None)
+        for i, chunk in enumerate(instrumentation.iterate('batch.read', chunked(rows, chunk_size))):
+            sizes.append(len(chunk))
+            yield options + (chunk, first_line + skipped + i * chunk_size, cache_path, output_format,
+                             library is not None, names)
+
+    done = skipped
+    count = state['alloys'] if resume else 0
+    discard = False
+    try:
+        for prepared in map_chunks(function, jobs(), workers):
+            if options:
+                prepared, data = prepared
+                profiler.merge(data)
+            if cache_path is not None:
+                prepared, lookups = prepared
+                if cache_stats is not None:
+                    for counter in cache_counters:
+                        cache_stats[counter] = cache_stats.get(counter, 0) + lookups[counter]
+            with instrumentation.stage('batch.write'):
+                try:
+                    if library is not None:
+                        prepared, columns = prepared
+                        library.write(columns)
+                    count += writer.write(prepared)
+                except ValueError:
+                    # a chunk that does not fit the output (see NpyWriter.write), resuming could not complete it either
+                    discard = True
+                    raise
+            done += sizes.popleft()
+            if checkpointed:
+                with instrumentation.stage('batch.checkpoint'):
+                    state.update(writer.commit(), rows=done)
+                    if library is not None:
+                        state['index'] = library.commit()
+                    write_checkpoint(out_path, state)
+            if progress is not None:
+                progress(done)
+            if cancel is not None and cancel.is_set():
+                break
+        else:
+            if library is not None:
+                import similarity_index
+
+                library.close()
+                with instrumentation.stage('batch.index'):
+                    similarity_index.build_index(index_path, names=library.names)
+            if checkpointed:
+                state['complete'] = True
+                write_checkpoint(out_path, state)
+    finally:
+        writer.close()
+        if library is not None:
+            library.close()
+        if discard:
+            for path in (out_path, checkpoint_path(out_path)) + ((library.path,) if library is not None else ()):
+                if os.path.exists(path):
+                    os.remove(path)
+    return count
@@ -0,0 +1,201 @@
+"""benchmarks of the empirical parameter calculator, runs offline on synthetic alloys generated from a fixed seed and
+reports single alloy latency, per-parameter cost, batch throughput of the csv and xlsx readers and peak memory as JSON.
+e.g. 'python benchmark.py --output benchmark.json' or 'python benchmark.py --sizes 1000 100000'"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import empirical_parameter_calculator as calculator
+
+# the elements the synthetic alloys are drawn from, all with complete elemental data
+palette = ['Al', 'Co', 'Cr', 'Fe', 'Ni', 'Ti', 'V', 'Nb', 'Mo', 'Ta', 'W', 'Zr', 'Hf', 'Cu', 'Mn', 'Si', 'Mg', 'Zn',
+           'Ag', 'Pd', 'Y', 'Sc', 'Sn', 'Li']
+
+# the EmpiricalParams method behind every parameter, timed with all of its inputs already cached
+parameter_methods = {'a': 'mean_atomic_radius', 'delta': 'atomic_size_difference', 'Tm': 'average_melting_point',
+                     'std_Tm': 'std_melting_point', 'mix_entropy': 'entropy_mixing',
+                     'mix_enthalpy': 'enthalpy_mixing', 'std_enthalpy': 'std_enthalpy_mixing',
+                     'omega': 'calc_omega', 'x': 'mean_electronegativity', 'std_x': 'std_electronegativity',
+                     'vec': 'average_vec', 'vec_std': 'std_vec', 'density': 'calc_density', 'price': 'calc_price'}
+
+
+def synthetic_alloys(count, num_elements, seed=0):
+    """function to return count random (element_list, mol_ratio) pairs of num_elements elements each"""
+    rng = random.Random(seed)
+    return [(rng.sample(palette, num_elements), [rng.randint(1, 20) / 4 for _ in range(num_elements)])
+            for _ in range(count)]
+
+
+def write_input(path, count, seed=0):
+    """function to write count random alloys of 2 to 10 elements to a '.csv' or '.xlsx' batch input file"""
+    rng = random.Random(seed)
+    sizes = (rng.randint(2, 10) for _ in range(count))
+    rows = ((','.join(rng.sample(palette, size)), ','.join('%g' % (rng.randint(1, 20) / 4) for _ in range(size)))
+            for size in sizes)
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as out:
+            csv_write = csv.writer(out, dialect='excel')
+            csv_write.writerow(['Element', 'Ratio'])
+            csv_write.writerows(rows)
+    else:
+        import openpyxl
+        wb = openpyxl.Workbook(write_only=True)
+        sheet = wb.create_sheet()
+        sheet.append(['Element', 'Ratio'])
+        for row in rows:
+            sheet.append(row)
+        wb.save(path)
+
+
+def _timings(function, repeat):
+    """function to return the min and median wall time of repeat calls to function, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def bench_import():
+    """function to return the time taken to import the calculator (element data included) in a fresh interpreter"""
+    code = ('import time; start = time.perf_counter(); import empirical_parameter_calculator; '
+            'print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return float(output)
+
+
+def bench_latency(repeat=200):
+    """function to return the latency of constructing an EmpiricalParams object and reading all 14 parameters, for
+    alloys of 2 to 10 elements"""
+    results = {}
+    for num_elements in range(2, 11):
+        alloys = synthetic_alloys(repeat, num_elements, seed=num_elements)
+        times = []
+        for element_list, mol_ratio in alloys:
+            start = time.perf_counter()
+            alloy = calculator.EmpiricalParams(element_list, mol_ratio)
+            for name in calculator.PARAMETER_NAMES:
+                getattr(alloy, name)
+            times.append(time.perf_counter() - start)
+        results[str(num_elements)] = {'min': min(times), 'median': statistics.median(times)}
+    return results
+
+
+def bench_parameters(num_elements=5, repeat=2000):
+    """function to return the cost of every EmpiricalParams parameter method on its own, with its inputs cached"""
+    element_list, mol_ratio = synthetic_alloys(1, num_elements, seed=1)[0]
+    alloy = calculator.EmpiricalParams(element_list, mol_ratio)
+    for name in calculator.PARAMETER_NAMES:
+        getattr(alloy, name)
+    results = {}
+    for name, method in parameter_methods.items():
+        function = getattr(alloy, method)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        results[name] = (time.perf_counter() - start) / repeat
+    return results
+
+
+def bench_compute_batch(count=100000):
+    """function to return the throughput of the vectorized engine alone, in alloys per second"""
+    fractions, index = calculator.composition_matrix(synthetic_alloys(count, 5))
+    timing = _timings(lambda: calculator.compute_batch_matrix(fractions, index), 3)
+    return {'rows': count, 'rows_per_second': count / timing['min'], 'seconds': timing}
+
+
+def _memory_status():
+    """function to return the resident memory (VmRSS) and its peak (VmHWM) of this process in bytes, read from
+    /proc/self/status, or None where there is no /proc (e.g. on macOS and Windows). Unlike ru_maxrss, which a process
+    inherits from its parent across fork and exec on Linux, both belong to this process alone"""
+    try:
+        with open('/proc/self/status') as status:
+            fields = dict(line.split(':', 1) for line in status)
+        return tuple(int(fields[name].split()[0]) * 1024 for name in ('VmRSS', 'VmHWM'))
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _run_batch(in_path, out_path):
+    """function run in a fresh process: a timed batch run, the resident memory of the process before the run (the
+    imports) and the peak resident memory of the run, both None where they cannot be measured (see _memory_status)"""
+    import batch_calculator
+
+    memory = _memory_status()
+    if memory is not None:
+        try:
+            # resets the peak to the current resident memory, so that the peak of the imports is not counted
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+    start = time.perf_counter()
+    count = batch_calculator.run_batch(in_path, out_path)
+    seconds = time.perf_counter() - start
+    if memory is None:
+        return count, seconds, None, None
+    return count, seconds, memory[0], _memory_status()[1]
+
+
+def bench_throughput(sizes, formats, directory):
+    """function to return the end to end batch throughput and peak memory of every input format and size, every run
+    in a fresh process so that the peak memory of the runs is not mixed up"""
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for input_format in formats:
+        for size in sizes:
+            in_path = os.path.join(directory, 'input_{}.{}'.format(size, input_format))
+            write_input(in_path, size)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                count, seconds, baseline, peak = executor.submit(_run_batch, in_path,
+                                                                 os.path.join(directory, 'output.csv')).result()
+            results['{}_{}'.format(input_format, size)] = {'rows': count, 'seconds': seconds,
+                                                           'rows_per_second': count / seconds,
+                                                           'baseline_memory_bytes': baseline,
+                                                           'peak_memory_bytes': peak}
+            os.remove(in_path)
+    return results
+
+
+def main(argv=None):
+    """command line entry point of the benchmarks"""
+    parser = argparse.ArgumentParser(description='benchmarks of the empirical parameter calculator')
+    parser.add_argument('--output', help='JSON file the results are written to, printed if omitted')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='numbers of synthetic rows of the batch throughput benchmarks')
+    parser.add_argument('--formats', nargs='+', default=['csv', 'xlsx'], choices=['csv', 'xlsx'],
+                        help='input formats of the batch throughput benchmarks')
+    args = parser.parse_args(argv)
+
+    results = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    results['import_seconds'] = bench_import()
+    results['latency_seconds'] = bench_latency()
+    results['parameter_seconds'] = bench_parameters()
+    results['compute_batch'] = bench_compute_batch()
+    with tempfile.TemporaryDirectory() as directory:
+        results['throughput'] = bench_throughput(args.sizes, args.formats, directory)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""local JSON over HTTP calculation service. A long-running asyncio server keeps the element data loaded, accepts single
+or bulk alloy compositions and coalesces the alloys of concurrent requests into micro-batches for the vectorized
+engine. e.g. 'python -m empirical_parameter_calculator serve --port 8000', then
+    POST /parameters  {"elements": ["Al", "Co", "Cr"], "ratios": [0.5, 1, 1]} or {"formula": "AlCoCrFeNi2.1"}
+    POST /parameters  {"alloys": [{"formula": "AlCoCrFeNi"}, {"elements": "Ti,V", "ratios": "1,2"}]}
+    GET  /metrics     request, batch, throughput and latency statistics
+    GET  /health"""
+
+import asyncio
+import collections
+import json
+import time
+import numpy as np
+import empirical_parameter_calculator as calculator
+import batch_calculator
+
+# the largest request body accepted, in bytes
+max_body_size = 64 << 20
+
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def parse_alloy(alloy):
+    """function to turn an alloy of a request into a list of table positions and a list of mole ratios. An alloy is
+    a formula string, {"formula": ...} or {"elements": ..., "ratios": ...} where both are lists or comma separated
+    strings and the ratios default to equal amounts"""
+    if isinstance(alloy, str):
+        return batch_calculator.parse_composition(alloy)
+    if not isinstance(alloy, dict):
+        raise ValueError('an alloy must be a formula string or an object, not {!r}'.format(alloy))
+    if 'formula' in alloy:
+        return batch_calculator.parse_composition(str(alloy['formula']))
+    if 'elements' not in alloy:
+        raise ValueError('an alloy needs a "formula" or "elements"')
+
+    elements = alloy['elements']
+    if isinstance(elements, str):
+        elements = [element for element in elements.replace(' ', '').split(',') if len(element) > 0]
+    index = [calculator.element_data.index[str(element).strip()] for element in elements]
+    ratios = alloy.get('ratios')
+    if ratios is None:
+        mol_ratio = [1.0] * len(index)
+    else:
+        if isinstance(ratios, str):
+            ratios = [ratio for ratio in ratios.replace(' ', '').split(',') if len(ratio) > 0]
+        mol_ratio = [float(ratio) for ratio in ratios]
+    if len(index) == 0 or len(index) != len(mol_ratio):
+        raise ValueError('{} elements but {} molar ratios'.format(len(index), len(mol_ratio)))
+    return index, mol_ratio
+
+
+def parameter_dicts(parameters):
+    """function to return the parameters of compute_batch as a list of dictionaries, missing values (nan) become None
+    since JSON has no nan"""
+    return [{name: None if value != value else value for name, value in zip(calculator.PARAMETER_NAMES, row)}
+            for row in parameters.tolist()]
+
+
+class ServerMetrics(object):
+    """counters of the served requests and evaluated micro-batches, with the latencies and batch sizes of the most
+    recent window requests and batches kept for percentiles"""
+
+    def __init__(self, window=10000):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.alloys = 0
+        self.batches = 0
+        self.batched_alloys = 0
+        self.compute_seconds = 0.0
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+
+    def record_request(self, num_alloys, seconds):
+        """function to count a served calculation request of num_alloys alloys"""
+        self.requests += 1
+        self.alloys += num_alloys
+        self.latencies.append(seconds)
+
+    def record_batch(self, num_alloys, seconds):
+        """function to count a micro-batch of num_alloys alloys evaluated in seconds"""
+        self.batches += 1
+        self.batched_alloys += num_alloys
+        self.compute_seconds += seconds
+        self.batch_sizes.append(num_alloys)
+
+    def summary(self):
+        """function to return the metrics as a dictionary"""
+        uptime = time.monotonic() - self.started
+        result = {'uptime_seconds': uptime, 'requests': self.requests, 'errors': self.errors, 'alloys': self.alloys,
+                  'alloys_per_second': self.alloys / uptime if uptime > 0 else 0.0, 'batches': self.batches,
+                  'mean_batch_size': self.batched_alloys / self.batches if self.batches > 0 else 0.0,
+                  'max_batch_size': max(self.batch_sizes, default=0),
+                  'compute_seconds_per_alloy': (self.compute_seconds / self.batched_alloys
+                                                if self.batched_alloys > 0 else 0.0)}
+        if len(self.latencies) > 0:
+            p50, p90, p99 = np.percentile(self.latencies, [50, 90, 99]).tolist()
+            result['latency_seconds'] = {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(self.latencies)}
+        return result
+
+
+class MicroBatcher(object):
+    """queue that collects the compositions of concurrent requests and evaluates them together. A batch is started as
+    soon as the previous one is done, with every request queued by then (up to about max_batch alloys), after
+    waiting at most max_delay seconds for more requests when the queue holds fewer alloys"""
+
+    def __init__(self, max_batch=4096, max_delay=0.0005, metrics=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.metrics = metrics or ServerMetrics()
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        """function to start the batching task on the running event loop"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """function to cancel the batching task"""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, compositions):
+        """function to return the parameters of a list of compositions once the micro-batch holding them is done"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((compositions, future))
+        return await future
+
+    def _drain(self, pending, size):
+        """function to move queued requests to pending until about max_batch alloys are pending, returns the size"""
+        while size < self.max_batch and not self._queue.empty():
+            item = self._queue.get_nowait()
+            pending.append(item)
+            size += len(item[0])
+        return size
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            size = self._drain(pending, len(pending[0][0]))
+            if size < self.max_batch and self.max_delay > 0:
+                await asyncio.sleep(self.max_delay)
+                size = self._drain(pending, size)
+
+            compositions = [composition for items, _ in pending for composition in items]
+            start = time.perf_counter()
+            try:
+                # evaluated off the event loop so that requests keep being read (and queued) meanwhile
+                parameters = await loop.run_in_executor(None, calculator.compute_batch, compositions)
+            except Exception as error:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.metrics.record_batch(len(compositions), time.perf_counter() - start)
+
+            offset = 0
+            for items, future in pending:
+                if not future.done():
+                    future.set_result(parameters[offset:offset + len(items)])
+                offset += len(items)
+
+
+class CalculationServer(object):
+    """HTTP/1.1 server (with keep-alive) of the empirical parameters, see the module docstring for the endpoints"""
+
+    def __init__(self, max_batch=4096, max_delay=0.0005):
+        self.metrics = ServerMetrics()
+        self.batcher = MicroBatcher(max_batch, max_delay, self.metrics)
+
+    async def calculate(self, body):
+        """function to return the status and response of a calculation request body"""
+        try:
+            request = json.loads(body.decode('utf-8'))
+            bulk = isinstance(request, dict) and 'alloys' in request
+            alloys = request['alloys'] if bulk else [request]
+            if not isinstance(alloys, list):
+                raise ValueError('"alloys" must be a list')
+            compositions = [parse_alloy(alloy) for alloy in alloys]
+        except KeyError as error:
+            return 400, {'error': 'unknown element {}'.format(error)}
+        except (TypeError, ValueError) as error:
+            return 400, {'error': str(error)}
+
+        results = parameter_dicts(await self.batcher.submit(compositions)) if len(compositions) > 0 else []
+        if bulk:
+            return 200, {'results': results}
+        return 200, {'parameters': results[0]}
+
+    async def respond(self, method, path, body):
+        """function to return the status and JSON response of a request"""
+        path = path.split('?', 1)[0].rstrip('/')
+        if path == '/parameters':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            start = time.perf_counter()
+            status, response = await self.calculate(body)
+            if status == 200:
+                num_alloys = len(response['results']) if 'results' in response else 1
+                self.metrics.record_request(num_alloys, time.perf_counter() - start)
+            return status, response
+        if path in ('/metrics', '/health'):
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, self.metrics.summary() if path == '/metrics' else {'status': 'ok'}
+        return 404, {'error': 'no such endpoint {}'.format(path)}
+
+    async def handle_connection(self, reader, writer):
+        """function serving the requests of a client connection until it is closed"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if len(request_line) == 0:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = False
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    status, response = 400, {'error': 'malformed request'}
+                else:
+                    if 'transfer-encoding' in headers:
+                        status, response = 411, {'error': 'a Content-Length is required'}
+                    elif length > max_body_size:
+                        status, response = 413, {'error': 'request body larger than {} bytes'.format(max_body_size)}
+                    else:
+                        body = await reader.readexactly(length) if length > 0 else b''
+                        connection = headers.get('connection', '').lower()
+                        keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                        try:
+                            status, response = await self.respond(method, path, body)
+                        except Exception as error:
+                            status, response = 500, {'error': str(error)}
+
+                if status != 200:
+                    self.metrics.errors += 1
+                payload = json.dumps(response, allow_nan=False).encode('utf-8')
+                writer.write(('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                              'Connection: {}\r\n\r\n').format(status, _reasons[status], len(payload),
+                                                               'keep-alive' if keep_alive else 'close')
+                             .encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """function to start the batcher and listen on host and port, returns the asyncio server"""
+        self.batcher.start()
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+def serve(host='127.0.0.1', port=8000, max_batch=4096, max_delay=0.0005):
+    """function to run a calculation server until interrupted"""
+    async def run():
+        server = await CalculationServer(max_batch, max_delay).start(host, port)
+        print('serving empirical parameters on http://{}:{}'.format(host, port), flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -1,12 +1,14 @@
 """This script provides the user interface of the empirical parameter calculator.
 written by Zhipeng Li
 version 2.1.1"""
-import csv
-import xlrd
+import queue
+import threading
+import time
 from tkinter import *
 from tkinter import filedialog
-from pymatgen.core.periodic_table import Element
+from tkinter import ttk
 import empirical_parameter_calculator as calculator
+import batch_calculator
 
 
 # the maximum number of elements can be included in the individual calculation process
@@ -41,7 +43,7 @@ def open_calculation_window():
     # set the title, size, position of the batch calculation window.
     window.title('Batch Calculation')
     w = 450
-    h = 250
+    h = 280
     ws = window.winfo_screenwidth()
     hs = window.winfo_screenheight()
     x = (ws / 2) - (w / 2) + 500
@@ -67,14 +69,108 @@ def open_calculation_window():
     out_btn = Button(window, text='Select', command=output_path_select)
     out_btn.place(x=350, y=120)
 
+    # the calculation runs in a worker thread that reports through this queue, the window polls it with root.after
+    messages = queue.Queue()
+    cancel = threading.Event()
+    # the id of the pending poll of report_progress, None when the window is not polling
+    window.poll = None
+
+    def report_progress():
+        # update the progress bar and the status from the worker messages, the widgets are only touched here
+        while True:
+            try:
+                kind, count = messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'total':
+                # the rate is measured from the end of the row count
+                window.total_rows = count
+                window.start_time = time.perf_counter()
+                continue
+            if kind == 'start':
+                # a resumed calculation skips the rows done before, the rate and the ETA only count the rows after
+                window.start_rows = count
+                window.start_time = time.perf_counter()
+                if window.total_rows:
+                    progress['value'] = min(100, 100 * count / window.total_rows)
+                continue
+            elapsed = time.perf_counter() - window.start_time
+            rate = (count - window.start_rows) / elapsed if elapsed > 0 else 0
+            if kind == 'progress':
+                if window.total_rows:
+                    progress['value'] = min(100, 100 * count / window.total_rows)
+                    eta = (window.total_rows - count) / rate if rate > 0 else 0
+                    status.config(text='{} rows, {:.0f} rows/s, ETA {:.0f} s'.format(count, rate, eta))
+                else:
+                    status.config(text='{} rows, {:.0f} rows/s'.format(count, rate))
+            elif kind == 'done':
+                window.poll = None
+                window.destroy()
+                return
+            elif kind == 'cancelled':
+                window.poll = None
+                status.config(text='Cancelled after {} rows, partial results written'.format(count))
+                calculate_btn.config(state=NORMAL)
+                cancel_btn.config(state=DISABLED)
+                return
+            elif kind == 'error':
+                window.poll = None
+                status.config(text='Error: {}'.format(count))
+                calculate_btn.config(state=NORMAL)
+                cancel_btn.config(state=DISABLED)
+                return
+        window.poll = window.after(100, report_progress)
+
+    def run_calculation():
+        # worker thread, counts the input rows (which reads the whole file) and runs the batch calculation, posting
+        # the total and the progress
+        try:
+            messages.put(('total', batch_calculator.count_rows(root.file_path)))
+            count = generate_empirical_properties(lambda rows: messages.put(('progress', rows)), cancel,
+                                                  lambda rows: messages.put(('start', rows)))
+        except Exception as error:
+            messages.put(('error', error))
+            return
+        messages.put(('cancelled' if cancel.is_set() else 'done', count))
+
     def start_calculation():
-        # start batch calculation
-        generate_empirical_properties()
+        # start batch calculation in the background, keeping the window responsive
+        cancel.clear()
+        calculate_btn.config(state=DISABLED)
+        cancel_btn.config(state=NORMAL)
+        progress['value'] = 0
+        status.config(text='Starting...')
+        window.total_rows = None
+        window.start_rows = 0
+        window.start_time = time.perf_counter()
+        threading.Thread(target=run_calculation, daemon=True).start()
+        window.poll = window.after(100, report_progress)
+
+    def cancel_calculation():
+        # stop the batch calculation after the current chunk
+        cancel.set()
+        status.config(text='Cancelling...')
+
+    def close_window():
+        # closing the window cancels a running calculation, which still flushes its partial results, and stops the
+        # polling of its messages, which would otherwise run on the destroyed widgets
+        cancel.set()
+        if window.poll is not None:
+            window.after_cancel(window.poll)
+            window.poll = None
         window.destroy()
 
-    # set the batch calculation button
+    window.protocol('WM_DELETE_WINDOW', close_window)
+
+    # set the batch calculation and cancel buttons, the progress bar and the status
     calculate_btn = Button(window, text='Start Calculation', command=start_calculation)
-    calculate_btn.place(x=170, y=160)
+    calculate_btn.place(x=120, y=160)
+    cancel_btn = Button(window, text='Cancel', command=cancel_calculation, state=DISABLED)
+    cancel_btn.place(x=260, y=160)
+    progress = ttk.Progressbar(window, orient=HORIZONTAL, length=370, mode='determinate')
+    progress.place(x=40, y=205)
+    status = Label(window, text='')
+    status.place(x=40, y=235)
 
     # set the labels and entries for the batch calculation window
 
@@ -91,62 +187,28 @@ def open_calculation_window():
     window.winfo_toplevel()
 
 
-def generate_empirical_properties():
-    """This is the function that generates all the empirical parameters for the selected source file"""
-    out = open(root.output_path + '/batch_calculation_results.csv', 'a', newline='')
-    csv_write = csv.writer(out, dialect='excel')
-    csv_write.writerow(['Elements', 'Molar_ratios', 'Enthalpy(kJ/mol)', 'std_enthalpy(kJ/mol)', 'Delta(%)', 'Omega', 'Entropy(J/K*mol)', 'Tm(K)',
-                        'std_Tm (%)', 'X', 'std_X(%)', 'VEC', 'std_VEC', 'Density(g/com^3)', 'Price(USD/kg)'])
-    if root.file_path.split('.')[1] == 'csv':
-        with open(root.file_path) as csvfile:
-            read_csv = csv.reader(csvfile, delimiter=',')
-            for row in read_csv:
-                print(row)
-                if len(row) > 0 and row[0] != 'Element':
-                    alloy = row[0].split(',')
-                    ratio = row[1].split(',')
-
-                    alloy_elements = []
-                    mol_ratio = []
-                    element_str = ""
-                    ratio_str = ""
-                    for j in range(len(alloy)):
-                        if len(alloy[j]) > 0:
-                            alloy_elements.append(Element(alloy[j].strip()))
-                            mol_ratio.append(float(ratio[j]))
-                            element_str += (alloy[j] + '-')
-                            ratio_str += (ratio[j] + '-')
-                    alloy = calculator.EmpiricalParams(alloy_elements, mol_ratio)
-                    csv_write.writerow(
-                        [element_str, ratio_str, alloy.mix_enthalpy, alloy.std_enthalpy, 100 * alloy.delta, alloy.omega,
-                         alloy.mix_entropy, 100 * alloy.Tm, alloy.std_Tm, alloy.x, 100 * alloy.std_x, alloy.vec,
-                         alloy.vec_std, alloy.density, alloy.price])
-
-    if root.file_path.split('.')[1] == 'xlsx':
-        wb = xlrd.open_workbook(root.file_path)
-        sheet = wb.sheet_by_index(0)
-        for i in range(sheet.nrows):
-            row = sheet.row_values(i)
-            if len(row) > 0 and row[0] != 'Element':
-                alloy = row[0].split(',')
-                ratio = row[1].split(',')
-
-                alloy_elements = []
-                mol_ratio = []
-                element_str = ""
-                ratio_str = ""
-                for j in range(len(alloy)):
-                    if len(alloy[j]) > 0:
-                        alloy_elements.append(Element(alloy[j].strip()))
-                        mol_ratio.append(float(ratio[j]))
-                        element_str += (alloy[j] + '-')
-                        ratio_str += (ratio[j] + '-')
-                alloy = calculator.EmpiricalParams(alloy_elements, mol_ratio)
-                csv_write.writerow(
-                        [element_str, ratio_str, alloy.mix_enthalpy, alloy.std_enthalpy, 100 * alloy.delta, alloy.omega,
-                         alloy.mix_entropy, 100 * alloy.Tm, alloy.std_Tm, alloy.x, 100 * alloy.std_x, alloy.vec,
-                         alloy.vec_std, alloy.density, alloy.price])
-    out.close()
+def generate_empirical_properties(progress=None, cancel=None, start=None):
+    """This is the function that generates all the empirical parameters for the selected source file. progress is
+    called with the number of input rows processed after every chunk, and setting the cancel event stops the
+    calculation after the current chunk. The results are checkpointed after every chunk, so a cancelled or interrupted
+    calculation of the same source file continues where it stopped instead of starting over; start is called with the
+    number of input rows it continues after (0 for a new calculation) before the first chunk. Returns the number of
+    input rows processed"""
+    out_path = root.output_path + '/batch_calculation_results.csv'
+    resume = batch_calculator.resumable(root.file_path, out_path, 'csv')
+    done = [batch_calculator.read_checkpoint(out_path)['rows'] if resume else 0]
+    if start is not None:
+        start(done[0])
+
+    def report(rows):
+        done[0] = rows
+        if progress is not None:
+            progress(rows)
+
+    # csv and xlsx files share the streaming reader and the composition parser of the batch calculator
+    batch_calculator.run_batch(root.file_path, out_path, chunk_size=1000, output_format='csv',
+                               resume=resume, progress=report, cancel=cancel)
+    return done[0]
 
 
 center_window(520, 500)
@@ -246,7 +308,7 @@ def calculate(event):
     mol_ratio = []
     for i in range(num_elements):
         if len(element_entries[i].get().strip()) > 0:
-            alloy_elements.append(Element(element_entries[i].get().strip()))
+            alloy_elements.append(element_entries[i].get().strip())
         if len(ratio_entries[i].get().strip()) > 0:
             mol_ratio.append(float(ratio_entries[i].get().strip()))
 
@@ -0,0 +1,116 @@
+"""composition space enumeration for alloy screening. Element combinations and simplex lattices of molar fractions are
+generated lazily and evaluated block by block with the vectorized engine, so that only the compositions passing the
+screening thresholds are ever kept or written."""
+
+import csv
+import functools
+import itertools
+import math
+import numpy as np
+import empirical_parameter_calculator as calculator
+
+
+@functools.lru_cache(maxsize=4096)
+def _integer_compositions(total, lower, upper):
+    """function to return every integer vector v with lower <= v <= upper (elementwise) and sum(v) == total, as the
+    rows of a read-only 2D array in lexicographic order. lower and upper are tuples, the results are cached because
+    the same sub-lattices recur for every element combination"""
+    if len(lower) == 1:
+        if lower[0] <= total <= upper[0]:
+            block = np.array([[total]], dtype=np.intp)
+        else:
+            block = np.empty((0, 1), dtype=np.intp)
+        block.flags.writeable = False
+        return block
+
+    rest_lower = sum(lower[1:])
+    rest_upper = sum(upper[1:])
+    blocks = []
+    for first in range(max(lower[0], total - rest_upper), min(upper[0], total - rest_lower) + 1):
+        tail = _integer_compositions(total - first, lower[1:], upper[1:])
+        blocks.append(np.column_stack([np.full(len(tail), first, dtype=np.intp), tail]))
+    if len(blocks) == 0:
+        block = np.empty((0, len(lower)), dtype=np.intp)
+    else:
+        block = np.concatenate(blocks)
+    block.flags.writeable = False
+    return block
+
+
+def simplex_lattice(num_elements, step, lower=0, upper=1):
+    """generator that yields blocks (2D arrays) of molar fraction vectors on the simplex lattice with the given step,
+    one block per value of the first fraction. lower and upper bound every fraction and are either single values or
+    one value per element"""
+    if not 0 < step <= 1:
+        raise ValueError('the step {} is not between 0 and 1'.format(step))
+    units = int(round(1 / step))
+    if not math.isclose(units * step, 1):
+        raise ValueError('the step {} does not divide 1 into whole units'.format(step))
+    lower = np.broadcast_to(lower, num_elements)
+    upper = np.broadcast_to(upper, num_elements)
+    # bounds are snapped inwards onto the lattice, with a little slack for values such as 0.15 / 0.05
+    lower_units = tuple(max(0, math.ceil(value * units - 1e-9)) for value in lower)
+    upper_units = tuple(min(units, math.floor(value * units + 1e-9)) for value in upper)
+
+    rest_lower = sum(lower_units[1:])
+    rest_upper = sum(upper_units[1:])
+    for first in range(max(lower_units[0], units - rest_upper), min(upper_units[0], units - rest_lower) + 1):
+        tail = _integer_compositions(units - first, lower_units[1:], upper_units[1:])
+        if len(tail) > 0:
+            block = np.column_stack([np.full(len(tail), first, dtype=np.intp), tail])
+            yield block / units
+
+
+def passes_thresholds(parameters, thresholds):
+    """function to return the boolean mask of the alloys whose parameters lie within the thresholds, a dictionary
+    mapping a parameter name of compute_batch to a (minimum, maximum) pair where None means unbounded. Alloys with a
+    missing (nan) thresholded parameter are rejected"""
+    mask = np.ones(len(parameters), dtype=bool)
+    for name, (minimum, maximum) in thresholds.items():
+        values = parameters[name]
+        with np.errstate(invalid='ignore'):
+            if minimum is not None:
+                mask &= values >= minimum
+            if maximum is not None:
+                mask &= values <= maximum
+        mask &= ~np.isnan(values)
+    return mask
+
+
+def screen_compositions(elements, num_elements, step, bounds=None, thresholds=None, names=calculator.PARAMETER_NAMES):
+    """generator that enumerates every num_elements combination of elements and every molar fraction vector on the
+    simplex lattice with the given step, and yields (index, fractions, parameters), index being the table positions
+    of the elements, for each evaluated block
+    that has alloys passing the thresholds (see passes_thresholds). bounds maps an element symbol to its (minimum,
+    maximum) molar fraction, elements without bounds range from one step to 1 so that every element is present.
+    Only the thresholded parameters are computed for every alloy, the named parameters yielded only for those passing"""
+    bounds = bounds or {}
+    thresholds = thresholds or {}
+    calculator.parameter_dtype(tuple(set(thresholds) | set(names)))
+    for combination in itertools.combinations(elements, num_elements):
+        index = calculator.element_data.indices(combination)
+        lower = [bounds.get(element, (step, 1))[0] for element in combination]
+        upper = [bounds.get(element, (step, 1))[1] for element in combination]
+        for fractions in simplex_lattice(num_elements, step, lower, upper):
+            if len(thresholds) > 0:
+                fractions = fractions[passes_thresholds(
+                    calculator.compute_batch_matrix(fractions, index, tuple(thresholds)), thresholds)]
+            if len(fractions) > 0:
+                yield index.tolist(), fractions, calculator.compute_batch_matrix(fractions, index, names)
+
+
+def screen_to_csv(out_path, elements, num_elements, step, bounds=None, thresholds=None):
+    """function to write the compositions passing the thresholds to a '.csv' file in the batch output format,
+    returns the number of alloys written"""
+    import batch_calculator
+
+    count = 0
+    with open(out_path, 'w', newline='') as out:
+        csv_write = csv.writer(out, dialect='excel')
+        csv_write.writerow(batch_calculator.OUTPUT_HEADER)
+        for index, fractions, parameters in screen_compositions(elements, num_elements, step, bounds, thresholds,
+                                                                batch_calculator.OUTPUT_NAMES):
+            compositions = [(index, ratios) for ratios in fractions.tolist()]
+            csv_write.writerows(batch_calculator.format_rows(compositions, parameters))
+            count += len(compositions)
+    return count
@@ -0,0 +1,240 @@
+"""composition optimization over an element palette. Instead of enumerating a lattice, a population of compositions is
+moved across the simplex of molar fractions by projected gradient descent, using the analytic derivatives of the
+empirical parameters, towards randomly weighted combinations of the objectives while the parameter constraints are
+enforced by a growing penalty. The feasible compositions met on the way are kept as a Pareto front."""
+
+import csv
+import numpy as np
+import empirical_parameter_calculator as calculator
+import composition_generator
+
+# the gas constant of EmpiricalParams.entropy_mixing, J/(K*mol)
+_gas_constant = 8.31446261815324
+
+# the parameters parameter_gradients differentiates, the only ones that can be objectives or constraints
+gradient_names = calculator.PARAMETER_NAMES
+
+
+def _relative_std_gradient(values, mean, std):
+    """function to return the gradient of sqrt(sum c_i * (1 - v_i / mean)^2), with mean = sum c_i * v_i"""
+    relative = 1 - values / mean[:, np.newaxis]
+    variance_gradient = np.square(relative) - 2 * (std ** 2 / mean)[:, np.newaxis] * values
+    return variance_gradient / (2 * std[:, np.newaxis])
+
+
+def _std_gradient(values, mean, std):
+    """function to return the gradient of sqrt(sum c_i * (v_i - mean)^2), with mean = sum c_i * v_i"""
+    return np.square(values - mean[:, np.newaxis]) / (2 * std[:, np.newaxis])
+
+
+def parameter_gradients(fractions, index, names=gradient_names):
+    """function to return the analytic gradients of the named parameters of compute_batch_matrix with respect to the
+    molar fractions, as a dictionary of N x E arrays, for N alloys given as rows of molar fractions that sum to 1.
+    Directions along the simplex are the gradients minus their row means. Gradients that are undefined (e.g. of a
+    standard deviation that is zero, or of the entropy at a zero fraction) are limited or set to zero"""
+    fractions = np.asarray(fractions, dtype=np.float64)
+    index = np.asarray(index, dtype=np.intp)
+    parameters = calculator.compute_batch_matrix(fractions, index)
+    data = calculator.element_data
+    radii = data.radius[index]
+    melting_points = data.melting_point[index]
+    electronegativity = data.electronegativity[index]
+    valence_electrons = data.valence_electrons[index]
+    atomic_mass = data.atomic_mass[index]
+    molar_volume = data.molar_volume[index]
+    H = data.mixing_enthalpy[np.ix_(index, index)]
+
+    def broadcast(values):
+        return np.broadcast_to(values, fractions.shape)
+
+    gradients = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gradients['a'] = broadcast(radii)
+        gradients['delta'] = _relative_std_gradient(radii, parameters['a'], parameters['delta'])
+        gradients['Tm'] = broadcast(melting_points)
+        gradients['std_Tm'] = _relative_std_gradient(melting_points, parameters['Tm'], parameters['std_Tm'])
+        # -R * (ln c + 1) diverges at zero fractions, the logarithm is limited to that of 1e-12
+        gradients['mix_entropy'] = -_gas_constant * (np.log(np.maximum(fractions, 1e-12)) + 1)
+
+        pair_sum = np.sum(np.dot(fractions, H) * fractions, axis=1)
+        gradients['mix_enthalpy'] = 4 * np.dot(fractions, H)
+        # sigma_h^2 = (Q - 4 P^2 + 4 P^2 C) / 2 with P = c^T H c, Q = c^T H^2 c and C = (sum c)^2 - sum c^2
+        cross_sum = 1 - np.sum(np.square(fractions), axis=1)
+        pair_gradient = 2 * np.dot(fractions, H)
+        square_gradient = 2 * np.dot(fractions, np.square(H))
+        cross_gradient = 2 - 2 * fractions
+        variance_gradient = (square_gradient - 8 * (pair_sum * (1 - cross_sum))[:, np.newaxis] * pair_gradient
+                             + 4 * np.square(pair_sum)[:, np.newaxis] * cross_gradient) / 2
+        gradients['std_enthalpy'] = variance_gradient / (2 * parameters['std_enthalpy'][:, np.newaxis])
+
+        # omega = Tm * S / (|H| * 1000), its relative gradient is the sum of those of Tm, S and 1 / |H|
+        gradients['omega'] = parameters['omega'][:, np.newaxis] * (
+            gradients['Tm'] / parameters['Tm'][:, np.newaxis]
+            + gradients['mix_entropy'] / parameters['mix_entropy'][:, np.newaxis]
+            - gradients['mix_enthalpy'] / parameters['mix_enthalpy'][:, np.newaxis])
+
+        gradients['x'] = broadcast(electronegativity)
+        # std_x is relative to x: d(s / x) = ds / x - s * dx / x^2
+        absolute_std_x = parameters['std_x'] * parameters['x']
+        gradients['std_x'] = (_std_gradient(electronegativity, parameters['x'], absolute_std_x)
+                              / parameters['x'][:, np.newaxis]
+                              - (parameters['std_x'] / parameters['x'])[:, np.newaxis] * electronegativity)
+        gradients['vec'] = broadcast(valence_electrons)
+        gradients['vec_std'] = _std_gradient(valence_electrons, parameters['vec'], parameters['vec_std'])
+
+        total_mass = np.dot(fractions, atomic_mass)
+        total_volume = np.dot(fractions, molar_volume)
+        gradients['density'] = ((atomic_mass - parameters['density'][:, np.newaxis] * molar_volume)
+                                / total_volume[:, np.newaxis])
+        gradients['price'] = (atomic_mass * (data.price[index] - parameters['price'][:, np.newaxis])
+                              / total_mass[:, np.newaxis])
+
+    return {name: np.nan_to_num(gradients[name], nan=0.0, posinf=0.0, neginf=0.0) for name in names}
+
+
+def project_simplex(points, lower, upper, iterations=60):
+    """function to return the closest points (rows) with lower <= x <= upper elementwise and a sum of 1, found by
+    bisection on the shift that is subtracted from every coordinate"""
+    low = (points - upper).min(axis=1)
+    high = (points - lower).max(axis=1)
+    for _ in range(iterations):
+        shift = (low + high) / 2
+        too_large = np.clip(points - shift[:, np.newaxis], lower, upper).sum(axis=1) > 1
+        low = np.where(too_large, shift, low)
+        high = np.where(too_large, high, shift)
+    projected = np.clip(points - ((low + high) / 2)[:, np.newaxis], lower, upper)
+    return projected / projected.sum(axis=1, keepdims=True)
+
+
+def pareto_mask(objectives):
+    """function to return the boolean mask of the rows of an N x K objective matrix (all minimized) that no other row
+    dominates, i.e. is no worse in every objective and better in one"""
+    mask = np.ones(len(objectives), dtype=bool)
+    for start in range(0, len(objectives), 256):
+        block = objectives[start:start + 256, np.newaxis, :]
+        # row i of the block is dominated if some row of the whole matrix dominates it
+        dominates = np.all(objectives <= block, axis=2) & np.any(objectives < block, axis=2)
+        mask[start:start + 256] = ~np.any(dominates, axis=1)
+    return mask
+
+
+def _objective_matrix(parameters, objectives):
+    """function to return the N x K matrix of the objectives of parameters, negated where maximized"""
+    return np.column_stack([parameters[name] * (-1 if sense == 'max' else 1) for name, sense in objectives])
+
+
+def optimize_compositions(elements, objectives, constraints=None, bounds=None, starts=256, iterations=200,
+                          decimals=3, seed=0):
+    """function to search the molar fractions of a palette of elements for compositions satisfying the constraints
+    (a dictionary mapping a parameter name of gradient_names to a (minimum, maximum) pair, None meaning unbounded, see
+    composition_generator.passes_thresholds) with Pareto-optimal objectives (a dictionary mapping a parameter name to
+    'min' or 'max'). bounds maps an element symbol to its (minimum, maximum) molar fraction, 0 to 1 by default, so
+    that elements may be left out. starts compositions are moved for the given number of iterations, and the
+    fractions of the results are rounded to decimals. Returns (index, fractions, parameters), index being the table
+    positions of the elements, sorted by the first objective"""
+    constraints = constraints or {}
+    bounds = bounds or {}
+    objectives = list(objectives.items())
+    for name, sense in objectives:
+        if sense not in ('min', 'max'):
+            raise ValueError("objective {} must be 'min' or 'max', not {!r}".format(name, sense))
+    for name in [name for name, _ in objectives] + list(constraints):
+        if name not in gradient_names:
+            raise ValueError('{} cannot be optimized, only {} can'.format(name, ', '.join(gradient_names)))
+
+    index = calculator.element_data.indices(elements)
+    used = sorted(set(name for name, _ in objectives) | set(constraints))
+    pure = calculator.compute_batch_matrix(np.eye(len(index)), index)
+    for name in used:
+        missing = [elements[i] for i in np.flatnonzero(np.isnan(pure[name]))]
+        if len(missing) > 0:
+            raise ValueError('{} cannot be calculated for alloys containing {}'.format(name, ', '.join(missing)))
+    lower = np.array([bounds.get(element, (0, 1))[0] for element in elements], dtype=np.float64)
+    upper = np.array([bounds.get(element, (0, 1))[1] for element in elements], dtype=np.float64)
+    if lower.sum() > 1 or upper.sum() < 1 or np.any(lower > upper):
+        raise ValueError('no molar fractions satisfy the element bounds')
+
+    rng = np.random.default_rng(seed)
+    points = project_simplex(rng.dirichlet(np.ones(len(index)), starts), lower, upper)
+    # every start minimizes its own random weighting of the objectives, so that the starts spread over the front
+    weights = rng.dirichlet(np.ones(len(objectives)), starts)
+    senses = np.array([-1.0 if sense == 'max' else 1.0 for _, sense in objectives])
+
+    # objectives and constraint violations are measured in units of their spread over the starting compositions
+    parameters = calculator.compute_batch_matrix(points, index)
+
+    def spread(name):
+        values = parameters[name]
+        scale = np.nanstd(values) if np.any(np.isfinite(values)) else 0
+        return scale if scale > 1e-12 else max(np.nanmax(np.abs(values), initial=0), 1.0)
+
+    objective_scales = np.array([spread(name) for name, _ in objectives])
+    constraint_scales = {name: spread(name) for name in constraints}
+
+    archive = np.empty((0, len(index)))
+    for iteration in range(iterations + 1):
+        parameters = calculator.compute_batch_matrix(points, index)
+        feasible = points[composition_generator.passes_thresholds(parameters, constraints)]
+        if len(feasible) > 0:
+            archive = _pareto_front(np.concatenate([archive, feasible]), index, objectives)[0]
+        if iteration == iterations:
+            break
+
+        gradients = parameter_gradients(points, index, used)
+        direction = np.zeros_like(points)
+        for k, (name, _) in enumerate(objectives):
+            direction += (weights[:, k] * senses[k] / objective_scales[k])[:, np.newaxis] * gradients[name]
+        # the penalty weight grows from 10 to 1000 so that the starts first explore and then settle inside the limits
+        penalty = 10 * 100 ** (iteration / iterations)
+        for name, (minimum, maximum) in constraints.items():
+            values = np.nan_to_num(parameters[name])
+            violation = np.zeros(len(points))
+            if minimum is not None:
+                violation -= np.maximum(minimum - values, 0)
+            if maximum is not None:
+                violation += np.maximum(values - maximum, 0)
+            direction += (2 * penalty * violation / constraint_scales[name] ** 2)[:, np.newaxis] * gradients[name]
+
+        # steps of decreasing length along the simplex, against the gradient of the penalized objective
+        direction -= direction.mean(axis=1, keepdims=True)
+        norm = np.linalg.norm(direction, axis=1, keepdims=True)
+        step = 0.1 * (1 - iteration / iterations) + 0.002
+        points = project_simplex(points - step * np.divide(direction, norm, out=np.zeros_like(direction),
+                                                                  where=norm > 0), lower, upper)
+
+    fractions, parameters = _pareto_front(archive, index, objectives, decimals, constraints)
+    order = np.argsort(_objective_matrix(parameters, objectives)[:, 0], kind='stable')
+    return index.tolist(), fractions[order], parameters[order]
+
+
+def _pareto_front(fractions, index, objectives, decimals=None, constraints=None):
+    """function to return the fractions and parameters of the unique, Pareto-optimal rows of fractions, rounding them
+    to decimals first (and then dropping the rows violating the constraints) if decimals is given"""
+    if decimals is not None:
+        fractions = np.round(fractions, decimals)
+        fractions = fractions[fractions.sum(axis=1) > 0]
+    fractions = np.unique(fractions, axis=0)
+    parameters = calculator.compute_batch_matrix(fractions, index)
+    if constraints is not None:
+        feasible = composition_generator.passes_thresholds(parameters, constraints)
+        fractions = fractions[feasible]
+        parameters = parameters[feasible]
+    mask = pareto_mask(_objective_matrix(parameters, objectives))
+    return fractions[mask], parameters[mask]
+
+
+def optimize_to_csv(out_path, elements, objectives, constraints=None, bounds=None, **options):
+    """function to write the Pareto-optimal compositions of optimize_compositions to a '.csv' file in the batch output
+    format, leaving out the elements absent from every alloy, returns the number of alloys written"""
+    import batch_calculator
+
+    index, fractions, parameters = optimize_compositions(elements, objectives, constraints, bounds, **options)
+    compositions = []
+    for row in fractions.tolist():
+        compositions.append(([element for element, ratio in zip(index, row) if ratio > 0],
+                             [ratio for ratio in row if ratio > 0]))
+    with open(out_path, 'w', newline='') as out:
+        csv_write = csv.writer(out, dialect='excel')
+        csv_write.writerow(batch_calculator.OUTPUT_HEADER)
+        csv_write.writerows(batch_calculator.format_rows(compositions, parameters))
+    return len(compositions)
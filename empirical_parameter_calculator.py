@@ -4,13 +4,55 @@
 written by Will Nash and Zhipeng Li
 version 2.1.1"""
 
+import collections.abc
 import itertools
+import os
+import warnings
 import numpy as np
-import matminer.utils.data as mm_data
+import instrumentation
+
+class _PriceTable(collections.abc.MutableMapping):
+    """the prices (USD/kg) of the elements by symbol, used like a dictionary. The price array of element_data is
+    built from it at load time and kept in step with every change, so that setting price_dic['Fe'] takes effect
+    in EmpiricalParams and the vectorized engine alike"""
+
+    def __init__(self, prices):
+        self._prices = dict(prices)
+
+    def __getitem__(self, symbol):
+        return self._prices[symbol]
+
+    def __setitem__(self, symbol, price):
+        self._prices[symbol] = price
+        self._apply(symbol)
+
+    def __delitem__(self, symbol):
+        del self._prices[symbol]
+        self._apply(symbol)
+
+    def __iter__(self):
+        return iter(self._prices)
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __repr__(self):
+        return repr(self._prices)
+
+    def _apply(self, symbol):
+        # changes made before element_data is loaded are picked up by load_element_data
+        table = globals().get('element_data')
+        if table is not None and symbol in table.index:
+            table.price[table.index[symbol]] = self._prices.get(symbol, np.nan)
+
+    def array(self, symbols):
+        """function to return the prices of the elements symbols as an array, nan for the elements without a price"""
+        return np.array([self._prices.get(symbol, np.nan) for symbol in symbols], dtype=np.float64)
+
 
 # the market price for most chemical elements, these data are retrieved from
 # http://www.leonland.de/elements_by_price/en/list
-price_dic = {
+price_dic = _PriceTable({
     "Ag": 462, "Al": 1.91, "Au": 38189, "B": 2386, "Be": 831.6, "Bi": 10.34, "C": 24, "Ca": 5.93, "Cd": 1.98, "Ce": 7,
     "Co": 59.5, "Cr": 7.64, "Cu": 5.9, "Dy": 350, "Er": 95, "Fe": 0.08, "Gd": 55, "Ge": 1833, "Hf": 1414, "Ho": 1400,
     "In": 341.6, "Ir": 31186, "La": 7, "Li": 115.7, "Lu": 6269, "Mg": 2.26, "Mn": 2.06, "Mo": 16, "Nb": 42, "Nd": 60,
@@ -20,72 +62,247 @@ price_dic = {
     "He": 40.39, "N": 2.77, "O": 0.64, "F": 1900, "Ne": 629.9, "Na": 3.04, "S": 0.1, "Cl": 1.5, "Ar": 2.56, "K": 13.02,
     "Ga": 278.2, "As": 1.74, "Se": 30.37, "Br": 4.4, "Kr": 1.4, "Rb": 14720, "Te": 55.68, "I": 28.00,
     "Xe": 9.2, "Cs": 73400, "Ba": 550, "Eu": 258, "Hg": 38.44, "Tl": 7400, "Th": 176, "U": 57.76,
-}
+})
+
+
+def _float_or_nan(value):
+    """function to convert a (possibly missing) pymatgen property into a float, missing values become nan"""
+    if value is None:
+        return np.nan
+    return float(value)
+
+
+def _count_valence_electrons(element):
+    """function to return the number of valence electron of a pymatgen Element, nan if the electronic structure of
+    the element is unknown. Transition metals count their group number, as not all of them have an outer s shell
+    (e.g. Pd is [Kr]4d10)"""
+    try:
+        e_structure = element.full_electronic_structure
+    except (KeyError, ValueError):
+        return np.nan
+    if element.block == 'd':
+        return float(element.group)
+    # the outer shell is the highest principal quantum number, pymatgen lists the orbitals in filling order
+    outer = max(t[0] for t in e_structure)
+    num_e = 0
+    for t in e_structure:
+        if t[0] == outer - 1 and t[1] == 'd':
+            num_e += t[2]
+        if t[0] == outer:
+            num_e += t[2]
+    return num_e
+
+
+# the element data snapshot shipped next to this module, loaded instead of querying pymatgen and matminer at import
+default_snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'element_data.npz')
+# bumped whenever the content or meaning of the snapshot arrays changes, older snapshots are then rebuilt
+snapshot_version = 3
+# the per-element arrays (and the mixing enthalpy matrix) of ElementPropertyTable stored in a snapshot
+snapshot_arrays = ('radius', 'melting_point', 'electronegativity', 'molar_volume', 'atomic_mass', 'valence_electrons',
+                   'price', 'bulk_modulus', 'mixing_enthalpy')
+
+
+class ElementPropertyTable(object):
+    """array-backed table of the elemental properties used by EmpiricalParams. Every per-element array and both axes
+    of the binary mixing enthalpy matrix are indexed by atomic number - 1, missing data are stored as nan. Tables are
+    built from pymatgen and matminer with from_pymatgen or loaded from a snapshot file with from_snapshot"""
+
+    num_elements = 118
+
+    def __init__(self, symbols, arrays):
+        self.symbols = [str(symbol) for symbol in symbols]
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        for name in snapshot_arrays:
+            setattr(self, name, np.array(arrays[name], dtype=np.float64))
+
+    @classmethod
+    def from_pymatgen(cls):
+        """function to return a table built from the pymatgen element data, matminer mixing enthalpies and price_dic,
+        the two libraries are only imported here"""
+        import matminer.utils.data as mm_data
+        from pymatgen.core.periodic_table import Element
+
+        n = cls.num_elements
+        elements = [Element.from_Z(z) for z in range(1, n + 1)]
+        arrays = {name: np.full(n, np.nan) for name in snapshot_arrays if name != 'mixing_enthalpy'}
+        with warnings.catch_warnings():
+            # pymatgen warns about every element without a tabulated value (e.g. electronegativity of noble gases)
+            warnings.simplefilter('ignore')
+            for i, element in enumerate(elements):
+                arrays['radius'][i] = _float_or_nan(element.atomic_radius)
+                arrays['melting_point'][i] = _float_or_nan(element.melting_point)
+                arrays['electronegativity'][i] = _float_or_nan(element.X)
+                arrays['molar_volume'][i] = _float_or_nan(element.molar_volume)
+                arrays['atomic_mass'][i] = _float_or_nan(element.atomic_mass)
+                arrays['valence_electrons'][i] = _count_valence_electrons(element)
+                arrays['bulk_modulus'][i] = _float_or_nan(element.bulk_modulus)
+        arrays['price'] = price_dic.array([element.symbol for element in elements])
+
+        # the diagonal is left as zero, an element does not mix with itself
+        arrays['mixing_enthalpy'] = np.zeros((n, n))
+        mixing_data = mm_data.MixingEnthalpy()
+        for i, j in itertools.combinations(range(n), 2):
+            h = mixing_data.get_mixing_enthalpy(elements[i], elements[j])
+            arrays['mixing_enthalpy'][i, j] = h
+            arrays['mixing_enthalpy'][j, i] = h
+        return cls([element.symbol for element in elements], arrays)
+
+    @classmethod
+    def from_snapshot(cls, path=default_snapshot_path):
+        """function to return a table loaded from a snapshot written by save_snapshot, raises ValueError if the
+        snapshot was written by an incompatible version"""
+        with np.load(path) as snapshot:
+            version = int(snapshot['version'])
+            if version != snapshot_version:
+                raise ValueError('element data snapshot {} has version {}, version {} is required'.format(
+                    path, version, snapshot_version))
+            return cls(snapshot['symbols'].tolist(), {name: snapshot[name] for name in snapshot_arrays})
+
+    def save_snapshot(self, path=default_snapshot_path):
+        """function to write the table to a compressed '.npz' snapshot, together with its version and the versions of
+        the libraries the data came from"""
+        from importlib import metadata
+
+        sources = []
+        for package in ('pymatgen', 'matminer'):
+            try:
+                sources.append('{}=={}'.format(package, metadata.version(package)))
+            except metadata.PackageNotFoundError:
+                pass
+        arrays = {name: getattr(self, name) for name in snapshot_arrays}
+        np.savez_compressed(path, version=np.array(snapshot_version), symbols=np.array(self.symbols),
+                            sources=np.array(sources), **arrays)
+
+    def fingerprint(self):
+        """function to return a text identifying the data of the table, the snapshot version and a hash of the arrays,
+        to tell whether results computed earlier are still valid"""
+        import hashlib
+
+        digest = hashlib.sha256()
+        for name in snapshot_arrays:
+            digest.update(np.ascontiguousarray(getattr(self, name)).tobytes())
+        return '{}:{}'.format(snapshot_version, digest.hexdigest())
+
+    def index_of(self, element):
+        """function to return the table position of a pymatgen Element or an element symbol, integers are taken to be
+        table positions already"""
+        if isinstance(element, str):
+            return self.index[element.strip()]
+        if isinstance(element, (int, np.integer)):
+            return int(element)
+        return element.Z - 1
+
+    def indices(self, element_list):
+        """function to return the table positions of a list of pymatgen Elements, element symbols or table positions"""
+        return np.array([self.index_of(element) for element in element_list], dtype=np.intp)
+
+    def symbol_of(self, element):
+        """function to return the symbol of a pymatgen Element, an element symbol or a table position"""
+        if isinstance(element, (int, np.integer)):
+            return self.symbols[element]
+        return str(element).strip()
+
+
+def load_element_data(path=default_snapshot_path):
+    """function to return the element property table from the snapshot at path, rebuilding it from pymatgen and
+    matminer (with a warning) if the snapshot is missing or out of date. The prices are always those of price_dic"""
+    try:
+        table = ElementPropertyTable.from_snapshot(path)
+    except (OSError, ValueError) as error:
+        warnings.warn('{}, building the element data from pymatgen and matminer instead. Run '
+                      "'python -m empirical_parameter_calculator snapshot' to rebuild the snapshot".format(error))
+        table = ElementPropertyTable.from_pymatgen()
+    table.price = price_dic.array(table.symbols)
+    return table
+
+
+# the process-wide property store, loaded once at import and shared by all EmpiricalParams instances
+element_data = load_element_data()
+
+
+class _cached_property(object):
+    """descriptor that evaluates a method on first access and stores the result on the instance, later accesses are
+    plain attribute lookups"""
+
+    def __init__(self, method):
+        self.method = method
+        self.name = method.__name__
+        self.__doc__ = method.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.method(instance)
+        instance.__dict__[self.name] = value
+        return value
 
 
 class EmpiricalParams(object):
     """functions for returning the empirical parameters of alloy compositions where element list is a list of pymatgen
-    Elements that are in the alloy, and mol_ratio is their respective mole ratios """
+    Elements that are in the alloy, and mol_ratio is their respective mole ratios. The parameters (a, delta, Tm,
+    std_Tm, mix_entropy, mix_enthalpy, std_enthalpy, omega, x, std_x, vec, vec_std, density, price, k and std_k) are
+    evaluated on first access and cached, so callers only pay for the parameters they read. Other parameters of
+    parameter_registry are read the same way"""
 
     def __init__(self, element_list, mol_ratio=None):
         self.element_list = element_list
         if mol_ratio is None:  # assume that mol_ratio is evenly distributed amongst elements
             mol_ratio = [1 / len(element_list)] * len(element_list)
         self.mol_ratio = np.divide(mol_ratio, np.sum(mol_ratio))
-        self.a = self.mean_atomic_radius()
-        self.delta = self.atomic_size_difference()
-        self.Tm = self.average_melting_point()
-        self.mix_entropy = self.entropy_mixing()
-        self.mix_enthalpy = self.enthalpy_mixing()
-        self.omega = self.calc_omega()
-        self.x = self.mean_electronegativity()
-        self.std_x = self.std_electronegativity()
-        self.vec = self.average_vec()
-        self.density = self.calc_density()
-        self.price = self.calc_price()
-
-        # self.k = self.mean_bulk_modulus()
-        # self.std_k = self.std_bulk_modulus()
-        self.std_enthalpy = self.std_enthalpy_mixing()
-        self.std_Tm = self.std_melting_point()
-        self.vec_std = self.std_vec()
+        self._index = element_data.indices(element_list)
+
+    @_cached_property
+    def _radii(self):
+        """the atomic radii of the alloy elements"""
+        return element_data.radius[self._index]
+
+    @_cached_property
+    def _melting_points(self):
+        """the melting points of the alloy elements"""
+        return element_data.melting_point[self._index]
+
+    @_cached_property
+    def _electronegativities(self):
+        """the electronegativities of the alloy elements"""
+        return element_data.electronegativity[self._index]
+
+    @_cached_property
+    def _valence_electrons(self):
+        """the numbers of valence electron of the alloy elements"""
+        return element_data.valence_electrons[self._index]
+
+    @_cached_property
+    def _bulk_moduli(self):
+        """the bulk moduli (GPa) of the alloy elements"""
+        return element_data.bulk_modulus[self._index]
+
+    def __getattr__(self, name):
+        # registered parameters without a method of their own are evaluated by the vectorized engine, and cached
+        if name.startswith('_') or name not in parameter_registry:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        value = ParameterBatch(self.mol_ratio, self._index)[name][0]
+        self.__dict__[name] = value
+        return value
 
     def mean_atomic_radius(self):
         """function to return the mean atomic size radius (a) of the alloy"""
-        radii = []
-        for i in range(len(self.element_list)):
-            radii.append(self.element_list[i].atomic_radius)
-        avg_radii = np.dot(radii, self.mol_ratio)
-        return avg_radii
+        return np.dot(self._radii, self.mol_ratio)
 
     def atomic_size_difference(self):
         """function to return the atomic size difference (delta) of the alloy"""
-        delta = 0
-        radii = []
-        for i in range(len(self.element_list)):
-            radii.append(self.element_list[i].atomic_radius)
-
-        for j in range(len(self.element_list)):
-            delta += self.mol_ratio[j] * np.square((1 - np.divide(radii[j], self.a)))
-
+        delta = np.dot(self.mol_ratio, np.square(1 - np.divide(self._radii, self.a)))
         return np.sqrt(delta)
 
     def average_melting_point(self):
         """function to return the average melting point (Tm) of the alloy"""
-        Tm = 0
-        for i in range(len(self.element_list)):
-            Tm += self.mol_ratio[i] * self.element_list[i].melting_point
-        return Tm
+        return np.dot(self._melting_points, self.mol_ratio)
 
     def std_melting_point(self):
         """function to return the standard deviation (in percentage) of melting points (sigma_t) of the alloy"""
-        sigma_t = 0
-        T = []
-        for i in range(len(self.element_list)):
-            T.append(self.element_list[i].melting_point)
-
-        for j in range(len(self.element_list)):
-            sigma_t += self.mol_ratio[j] * np.square((1 - np.divide(T[j], self.Tm)))
+        sigma_t = np.dot(self.mol_ratio, np.square(1 - np.divide(self._melting_points, self.Tm)))
         return np.sqrt(sigma_t)
 
     def entropy_mixing(self):
@@ -96,133 +313,752 @@ class EmpiricalParams(object):
                 entropy += self.mol_ratio[i] * np.log(self.mol_ratio[i])
         return -8.31446261815324 * entropy
 
+    def pair_enthalpies(self):
+        """function to return the matrix of binary mixing enthalpies between the alloy elements"""
+        return element_data.mixing_enthalpy[np.ix_(self._index, self._index)]
+
     def enthalpy_mixing(self):
         """function to return the sum enthalpy of mixing of an alloy system based on binary mixtures and the molar
         ratio """
-        enthalpies = []
-        mol_coefficients = []
-
-        for pair in itertools.combinations(self.element_list, 2):
-            enthalpies.append(mm_data.MixingEnthalpy().get_mixing_enthalpy(*pair))
-
-        for molies in itertools.combinations(self.mol_ratio, 2):
-            mol_coefficients.append(4 * np.product(molies))
-
-        enthalpy = np.dot(enthalpies, mol_coefficients)
-        return enthalpy
+        # sum of 4 * c_i * c_j * H_ij over all pairs i < j, the matrix is symmetric with a zero diagonal
+        return 2 * np.dot(self.mol_ratio, np.dot(self._pair_enthalpies, self.mol_ratio))
 
     def std_enthalpy_mixing(self):
         """function to return the standard deviation of enthalpy of mixing (sigma_h) of the alloy"""
-        sigma_h = 0
-        H = np.zeros((len(self.element_list), len(self.element_list)))
-        for i in range(len(self.element_list)):
-            for j in range(len(self.element_list)):
-                if i != j:
-                    H[i][j] = mm_data.MixingEnthalpy().get_mixing_enthalpy(self.element_list[i], self.element_list[j])
-
-        for i in range(len(self.element_list)):
-            for j in range(len(self.element_list)):
-                if i != j:
-                    sigma_h += self.mol_ratio[i] * self.mol_ratio[j] * np.square(H[i][j] - self.enthalpy_mixing())
-        sigma_h = sigma_h / 2
+        deviation = np.square(self._pair_enthalpies - self._enthalpy)
+        np.fill_diagonal(deviation, 0)
+        sigma_h = np.dot(self.mol_ratio, np.dot(deviation, self.mol_ratio)) / 2
         return np.sqrt(sigma_h)
 
+    def omega_enthalpy(self):
+        """function to return the enthalpy of mixing used for omega, where a vanishing value is replaced by 1e-6"""
+        if np.abs(self._enthalpy) < 1e-6:
+            return 1e-6
+        return self._enthalpy
+
     def calc_omega(self):
         """function to return the omega value of the alloy"""
-        if np.abs(self.mix_enthalpy) < 1e-6:
-            self.mix_enthalpy = 1e-6
         return self.Tm * self.mix_entropy / (np.abs(self.mix_enthalpy) * 1000)
 
     def mean_electronegativity(self):
         """function to return the mean electronegativity (x) of the alloy"""
-        x_list = []
-        for i in range(len(self.element_list)):
-            x_list.append(self.element_list[i].X)
-        x_avg = np.dot(x_list, self.mol_ratio)
-        return x_avg
+        return np.dot(self._electronegativities, self.mol_ratio)
 
     def std_electronegativity(self):
         """function to return the standard deviation (in percentage) of electronegativity (sigma_x) of the alloy"""
-        sigma_x = 0
-        x_list = []
-        for i in range(len(self.element_list)):
-            x_list.append(self.element_list[i].X)
-
-        for j in range(len(self.element_list)):
-            sigma_x += self.mol_ratio[j] * np.square(x_list[j] - self.x)
+        sigma_x = np.dot(self.mol_ratio, np.square(self._electronegativities - self.x))
         return np.sqrt(sigma_x) / self.x
 
     def num_ve(self, element):
         """function to return the number of valence electron of the element"""
-        e_structure = element.full_electronic_structure
-        outer = element.full_electronic_structure[-1][0]
-        num_e = 0
-        for t in e_structure:
-            if t[0] == outer - 1 and t[1] == 'd':
-                num_e += t[2]
-            if t[0] == outer:
-                num_e += t[2]
-        return num_e
+        return element_data.valence_electrons[element_data.index_of(element)]
 
     def average_vec(self):
         """function to return the average of valence electron concentration (vec) of the alloy"""
-        vec = 0
-        for i in range(len(self.element_list)):
-            vec += self.mol_ratio[i] * self.num_ve(self.element_list[i])
-        return vec
+        return np.dot(self._valence_electrons, self.mol_ratio)
 
     def std_vec(self):
         """function to return the standard deviation of valence electron concentration (sigma_vec) of the alloy"""
-        sigma_vec = 0
-        vec_list = []
-        for i in range(len(self.element_list)):
-            vec_list.append(self.num_ve(self.element_list[i]))
-
-        for j in range(len(self.element_list)):
-            sigma_vec += self.mol_ratio[j] * np.square(vec_list[j] - self.vec)
+        sigma_vec = np.dot(self.mol_ratio, np.square(self._valence_electrons - self.vec))
         return np.sqrt(sigma_vec)
 
     def mean_bulk_modulus(self):
-        """function to return the average of bulk modulus (k) of the alloy"""
-        k = 0
-        for i in range(len(self.element_list)):
-            if self.element_list[i].bulk_modulus is None:
-                print(self.element_list[i])
-            else:
-                k += self.mol_ratio[i] * self.element_list[i].bulk_modulus
-        return k
+        """function to return the average of bulk modulus (k) of the alloy, nan if the bulk modulus of an element is
+        unknown"""
+        return np.dot(self._bulk_moduli, self.mol_ratio)
 
     def std_bulk_modulus(self):
-        """function to return the standard deviation of bulk modulus (k) of the alloy"""
-        sigma_k = 0
-        k_list = []
-        for i in range(len(self.element_list)):
-            k_list.append(self.element_list[i].bulk_modulus)
-
-        for j in range(len(self.element_list)):
-            if self.element_list[i].bulk_modulus is None:
-                print(self.element_list[i])
-            else:
-                sigma_k += self.mol_ratio[j] * np.square(k_list[j] - self.k)
+        """function to return the standard deviation of bulk modulus (sigma_k) of the alloy"""
+        sigma_k = np.dot(self.mol_ratio, np.square(self._bulk_moduli - self.k))
         return np.sqrt(sigma_k)
 
     def calc_density(self):
         """function to return the density (g/cm^3) of the alloy"""
-        mass = 0
-        volume = 0
-        for i in range(len(self.element_list)):
-            mass += float(self.element_list[i].atomic_mass) * self.mol_ratio[i]
-            volume += self.mol_ratio[i] * self.element_list[i].molar_volume
+        mass = np.dot(element_data.atomic_mass[self._index], self.mol_ratio)
+        volume = np.dot(element_data.molar_volume[self._index], self.mol_ratio)
         return mass / volume
 
     def calc_price(self):
         """function to return the price (USD/kg) of the alloy"""
-        total_mass = 0
-        total_price = 0
-        for i in range(len(self.element_list)):
-            if not str(self.element_list[i]) in price_dic:
-                return 'unknown'
-            mass = float(self.element_list[i].atomic_mass) * self.mol_ratio[i]
-            total_mass += mass
-            total_price += mass * price_dic[str(self.element_list[i])]
-        return format(total_price / total_mass, '.2f')
+        prices = element_data.price[self._index]
+        if np.isnan(prices).any():
+            return 'unknown'
+        masses = element_data.atomic_mass[self._index] * self.mol_ratio
+        return format(np.dot(masses, prices) / np.sum(masses), '.2f')
+
+    # shared intermediates and the empirical parameters, each evaluated once on first access
+    _pair_enthalpies = _cached_property(pair_enthalpies)
+    _enthalpy = _cached_property(enthalpy_mixing)
+    a = _cached_property(mean_atomic_radius)
+    delta = _cached_property(atomic_size_difference)
+    Tm = _cached_property(average_melting_point)
+    std_Tm = _cached_property(std_melting_point)
+    mix_entropy = _cached_property(entropy_mixing)
+    mix_enthalpy = _cached_property(omega_enthalpy)
+    std_enthalpy = _cached_property(std_enthalpy_mixing)
+    omega = _cached_property(calc_omega)
+    x = _cached_property(mean_electronegativity)
+    std_x = _cached_property(std_electronegativity)
+    vec = _cached_property(average_vec)
+    vec_std = _cached_property(std_vec)
+    density = _cached_property(calc_density)
+    price = _cached_property(calc_price)
+    k = _cached_property(mean_bulk_modulus)
+    std_k = _cached_property(std_bulk_modulus)
+
+
+def composition_arrays(compositions):
+    """function to flatten an iterable of (element_list, mol_ratio) pairs into the arrays (indices, ratios, counts):
+    the table positions and mole ratios of all alloys concatenated, and the number of elements of every alloy. Element
+    lists of integers are taken to be table positions already and used as they are"""
+    indices = []
+    ratios = []
+    counts = []
+    for element_list, mol_ratio in compositions:
+        if len(element_list) > 0 and isinstance(element_list[0], (int, np.integer)):
+            indices.extend(element_list)
+        else:
+            indices.extend([element_data.index_of(element) for element in element_list])
+        if mol_ratio is None:
+            mol_ratio = [1] * len(element_list)
+        ratios.extend(mol_ratio)
+        counts.append(len(element_list))
+    return (np.array(indices, dtype=np.intp), np.array(ratios, dtype=np.float64),
+            np.array(counts, dtype=np.intp))
+
+
+def ratio_text(mol_ratio, end=''):
+    """function to return the mole ratios of an alloy as text separated by '-' (followed by end), e.g. '0.5-1-1.15'.
+    Every ratio is written as the shortest text that reads back as the same float, whole numbers without a decimal
+    point and never in scientific notation, whose exponent sign would be read as a separator"""
+    return '-'.join([_ratio_token(ratio) for ratio in mol_ratio]) + end
+
+
+def _ratio_token(ratio):
+    """function to return the text of one mole ratio for ratio_text"""
+    ratio = float(ratio)
+    if ratio.is_integer() and abs(ratio) < 1e15:
+        return str(int(ratio))
+    text = repr(ratio)
+    if 'e' in text:
+        return np.format_float_positional(ratio, trim='-')
+    return text
+
+
+def fraction_matrix(indices, ratios, counts):
+    """function to build the N x E mole ratio matrix of N alloys given as flat arrays (see composition_arrays) over
+    the E distinct elements of the batch. Returns the matrix and the table positions of its columns in ascending
+    order, repeated elements of an alloy are summed"""
+    columns, inverse = np.unique(indices, return_inverse=True)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    cells = np.bincount(rows * len(columns) + inverse.ravel(), weights=ratios, minlength=len(counts) * len(columns))
+    return cells.reshape(len(counts), len(columns)), columns
+
+
+def slot_matrix(indices, ratios, counts):
+    """function to build N x K matrices of the mole ratios and of the table positions of N alloys given as flat arrays
+    (see composition_arrays), K being the largest number of distinct elements in an alloy. Repeated elements of an
+    alloy are summed, the unused slots of alloys with fewer elements have a ratio of 0"""
+    n = element_data.num_elements
+    rows = np.repeat(np.arange(len(counts)), counts)
+    keys, inverse = np.unique(rows * n + indices, return_inverse=True)
+    merged = np.bincount(inverse.ravel(), weights=ratios, minlength=len(keys))
+    key_rows = keys // n
+    per_row = np.bincount(key_rows, minlength=len(counts))
+    width = int(per_row.max()) if len(keys) > 0 else 0
+    slots = np.arange(len(keys)) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    fractions = np.zeros((len(counts), width))
+    index = np.zeros((len(counts), width), dtype=np.intp)
+    fractions[key_rows, slots] = merged
+    index[key_rows, slots] = keys % n
+    return fractions, index
+
+
+def composition_matrix(compositions):
+    """function to encode an iterable of (element_list, mol_ratio) pairs as an N x E matrix of mole ratios over
+    the E distinct elements of the batch. Returns the matrix and the table positions (atomic number - 1) of its
+    columns"""
+    return fraction_matrix(*composition_arrays(compositions))
+
+
+def _row_sum(values):
+    """function to return the row sums of a matrix, adding its columns from left to right. The sum of a row then does
+    not depend on the number of columns, such as the zero padding of the slots of slot_matrix, which keeps the
+    parameters of an alloy independent of the batch it is evaluated in"""
+    if values.shape[1] == 0:
+        return np.zeros(len(values))
+    total = values[:, 0].copy()
+    for column in range(1, values.shape[1]):
+        total += values[:, column]
+    return total
+
+
+def _weighted_sum(fractions, terms):
+    """function to return the row sums of fractions * terms, where elements absent from an alloy do not contribute
+    even if their elemental data is missing"""
+    with np.errstate(invalid='ignore'):
+        return _row_sum(np.where(fractions != 0, fractions * terms, 0))
+
+
+def _pair_matrix(matrix, index):
+    """function to return the entries of a pair matrix of the table (e.g. the mixing enthalpies) between the elements
+    at index, shared table positions (1D, giving an E x E matrix) or table positions of every row (2D, giving an
+    N x E x E array)"""
+    if index.ndim == 1:
+        return matrix[np.ix_(index, index)]
+    return matrix[index[:, :, np.newaxis], index[:, np.newaxis, :]]
+
+
+def _pair_products(fractions, pairs):
+    """function to return the rows of fractions multiplied by the pair matrix of their elements (see _pair_matrix),
+    shared by all rows (2D) or given for every row (3D)"""
+    if pairs.ndim == 2:
+        return np.dot(fractions, pairs)
+    # summed slot by slot rather than with einsum, whose order of summation depends on the number of slots
+    products = np.zeros(fractions.shape)
+    for slot in range(fractions.shape[1]):
+        products += fractions[:, slot, np.newaxis] * pairs[:, slot]
+    return products
+
+
+class Parameter(object):
+    """an empirical parameter of the vectorized engine. kind is the formula of the parameter over the elemental
+    property source (the name of an ElementPropertyTable array), weighted by the mole ratios c_i of the alloy:
+        'mean'            sum_i c_i * p_i
+        'std'             sqrt(sum_i c_i * (p_i - mean)^2)
+        'relative_std'    sqrt(sum_i c_i * (1 - p_i / mean)^2)
+        'pairwise_mean'   sum_{i < j} 4 * c_i * c_j * P_ij, for a symmetric pair matrix P with a zero diagonal
+        'pairwise_std'    sqrt(1/2 * sum_{i != j} c_i * c_j * (P_ij - pairwise mean)^2)
+        'derived'         function(batch) of a ParameterBatch, for formulas of other parameters or of the ratios
+    Alloys with an element whose source data is missing get nan. label and scale are the column name and the factor
+    of the parameter in the '.csv' batch output, where text (if given) formats the values instead"""
+
+    kinds = ('mean', 'std', 'relative_std', 'pairwise_mean', 'pairwise_std', 'derived')
+
+    def __init__(self, name, kind, source=None, function=None, label=None, scale=1, text=None):
+        if kind not in self.kinds:
+            raise ValueError('unknown kind {} of parameter {}, choose from {}'.format(kind, name,
+                                                                                      ', '.join(self.kinds)))
+        if kind == 'derived' and function is None:
+            raise ValueError('the derived parameter {} needs a function'.format(name))
+        if kind != 'derived' and source not in snapshot_arrays:
+            raise ValueError('unknown elemental property {} of parameter {}, choose from {}'.format(
+                source, name, ', '.join(snapshot_arrays)))
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.function = function
+        self.label = label or name
+        self.scale = scale
+        self.text = text
+
+    def evaluate(self, batch):
+        """function to return the values of the parameter for the alloys of a ParameterBatch"""
+        if self.kind == 'mean':
+            return batch.mean(self.source)
+        if self.kind == 'std':
+            deviation = batch.values(self.source) - batch.mean(self.source)[:, np.newaxis]
+            return np.sqrt(_weighted_sum(batch.fractions, np.square(deviation)))
+        if self.kind == 'relative_std':
+            deviation = 1 - batch.values(self.source) / batch.mean(self.source)[:, np.newaxis]
+            return np.sqrt(_weighted_sum(batch.fractions, np.square(deviation)))
+        if self.kind == 'pairwise_mean':
+            return batch.pairwise_mean(self.source)
+        if self.kind == 'pairwise_std':
+            # sigma^2 = 1/2 * sum_{i != j} c_i * c_j * (P_ij - P_mix)^2, expanded into matrix products
+            fractions = batch.fractions
+            mean = batch.pairwise_mean(self.source)
+            square_sum = batch.pair_sum(self.source, squared=True)
+            cross_sum = np.square(_row_sum(fractions)) - _row_sum(np.square(fractions))
+            sigma = (square_sum - 2 * mean * batch.pair_sum(self.source) + np.square(mean) * cross_sum) / 2
+            return np.sqrt(np.maximum(sigma, 0))
+        return self.function(batch)
+
+
+# the parameters the vectorized engine can evaluate by name, in the order they were registered
+parameter_registry = {}
+
+
+def register_parameter(name, kind, source=None, function=None, label=None, scale=1, text=None):
+    """function to add a parameter to the registry (replacing one of the same name), see Parameter for the arguments.
+    The parameter can then be selected by name in compute_batch, the batch outputs and EmpiricalParams, e.g.
+        register_parameter('k', 'mean', 'bulk_modulus', label='K(GPa)')"""
+    parameter = Parameter(name, kind, source, function, label, scale, text)
+    parameter_registry[name] = parameter
+    return parameter
+
+
+class ParameterBatch(object):
+    """the mole ratios of N alloys over the elements at the table positions index (see compute_batch_matrix), with
+    the registered parameters evaluated on demand: batch[name] computes a parameter (and whatever it uses) on first
+    access and keeps it, as do the elemental data and weighted means shared by several parameters"""
+
+    def __init__(self, fractions, index):
+        fractions = np.asarray(fractions, dtype=np.float64)
+        if fractions.ndim == 1:
+            fractions = fractions[np.newaxis, :]
+        # alloys whose ratios do not add up to a positive finite amount have no fractions, and get nan for every
+        # parameter
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            totals = _row_sum(fractions)[:, np.newaxis]
+            self.fractions = np.where((totals > 0) & np.isfinite(totals), fractions / totals, np.nan)
+        self.index = np.asarray(index, dtype=np.intp)
+        self._parameters = {}
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.fractions)
+
+    def __getitem__(self, name):
+        if name not in self._parameters:
+            if name not in parameter_registry:
+                raise ValueError('unknown parameter {}'.format(name))
+            with instrumentation.stage('compute_batch_matrix.' + name):
+                self._parameters[name] = parameter_registry[name].evaluate(self)
+        return self._parameters[name]
+
+    def _cached(self, key, function):
+        if key not in self._cache:
+            self._cache[key] = function()
+        return self._cache[key]
+
+    def values(self, source):
+        """function to return the elemental property source of the elements of the alloys, as an N x E matrix"""
+        return self._cached(('values', source), lambda: getattr(element_data, source)[self.index])
+
+    def mean(self, source):
+        """function to return the mole ratio weighted mean of the elemental property source for every alloy"""
+        return self._cached(('mean', source), lambda: _weighted_sum(self.fractions, self.values(source)))
+
+    def pairs(self, source):
+        """function to return the pair matrix source between the elements of the alloys, see _pair_matrix"""
+        return self._cached(('pairs', source), lambda: _pair_matrix(getattr(element_data, source), self.index))
+
+    def pair_sum(self, source, squared=False):
+        """function to return c^T P c for every alloy, P being the pair matrix source (or its elementwise square)"""
+        def compute():
+            pairs = np.square(self.pairs(source)) if squared else self.pairs(source)
+            return _row_sum(_pair_products(self.fractions, pairs) * self.fractions)
+        return self._cached(('pair_sum', source, squared), compute)
+
+    def pairwise_mean(self, source):
+        """function to return sum_{i < j} 4 * c_i * c_j * P_ij for every alloy, which equals 2 * c^T P c for the
+        symmetric, zero diagonal pair matrix P"""
+        return 2 * self.pair_sum(source)
+
+
+def _mixing_entropy(batch):
+    """function to return the entropy of mixing -R * sum_i c_i * ln(c_i) of the alloys of a batch"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_fractions = np.log(np.where(batch.fractions != 0, batch.fractions, 1))
+    return -8.31446261815324 * _weighted_sum(batch.fractions, log_fractions)
+
+
+def _omega_enthalpy(batch):
+    """function to return the enthalpy of mixing of the alloys of a batch where a vanishing value is replaced by 1e-6,
+    as in EmpiricalParams.omega_enthalpy"""
+    enthalpy = batch.pairwise_mean('mixing_enthalpy')
+    return np.where(np.abs(enthalpy) < 1e-6, 1e-6, enthalpy)
+
+
+def _omega(batch):
+    """function to return the omega value of the alloys of a batch"""
+    return batch['Tm'] * batch['mix_entropy'] / (np.abs(batch['mix_enthalpy']) * 1000)
+
+
+def _density(batch):
+    """function to return the density (g/cm^3) of the alloys of a batch"""
+    return batch.mean('atomic_mass') / batch.mean('molar_volume')
+
+
+def _price(batch):
+    """function to return the price (USD/kg) of the alloys of a batch, nan if an element has no known price"""
+    masses = batch.values('atomic_mass')
+    return _weighted_sum(batch.fractions, masses * batch.values('price')) / batch.mean('atomic_mass')
+
+
+def _price_text(prices):
+    """function to format prices as in EmpiricalParams.calc_price"""
+    return ['unknown' if np.isnan(price) else format(price, '.2f') for price in prices]
+
+
+register_parameter('a', 'mean', 'radius', label='average_atomic_radius')
+register_parameter('delta', 'relative_std', 'radius', label='Delta(%)', scale=100)
+register_parameter('Tm', 'mean', 'melting_point', label='Tm(K)')
+register_parameter('std_Tm', 'relative_std', 'melting_point', label='std_Tm (%)', scale=100)
+register_parameter('mix_entropy', 'derived', function=_mixing_entropy, label='Entropy(J/K*mol)')
+register_parameter('mix_enthalpy', 'derived', function=_omega_enthalpy, label='Enthalpy(kJ/mol)')
+register_parameter('std_enthalpy', 'pairwise_std', 'mixing_enthalpy', label='std_enthalpy(kJ/mol)')
+register_parameter('omega', 'derived', function=_omega, label='Omega')
+register_parameter('x', 'mean', 'electronegativity', label='X')
+register_parameter('std_x', 'relative_std', 'electronegativity', label='std_X(%)', scale=100)
+register_parameter('vec', 'mean', 'valence_electrons', label='VEC')
+register_parameter('vec_std', 'std', 'valence_electrons', label='std_VEC')
+register_parameter('density', 'derived', function=_density, label='Density(g/com^3)')
+register_parameter('price', 'derived', function=_price, label='Price(USD/kg)', text=_price_text)
+register_parameter('k', 'mean', 'bulk_modulus', label='K(GPa)')
+register_parameter('std_k', 'std', 'bulk_modulus', label='std_K(GPa)')
+
+# the parameters returned by compute_batch unless others are selected, named after the matching EmpiricalParams
+# attributes
+PARAMETER_NAMES = ('a', 'delta', 'Tm', 'std_Tm', 'mix_entropy', 'mix_enthalpy', 'std_enthalpy', 'omega', 'x', 'std_x',
+                   'vec', 'vec_std', 'density', 'price')
+
+
+def parameter_dtype(names=PARAMETER_NAMES):
+    """function to return the structured dtype of the named parameters, one float64 field each"""
+    for name in names:
+        if name not in parameter_registry:
+            raise ValueError('unknown parameter {}, choose from {}'.format(name, ', '.join(parameter_registry)))
+    return np.dtype([(name, np.float64) for name in names])
+
+
+PARAMETER_DTYPE = parameter_dtype(PARAMETER_NAMES)
+
+
+def compute_batch_matrix(fractions, index, names=PARAMETER_NAMES):
+    """function to return the named empirical parameters (see parameter_registry) of N alloys given as an N x E matrix
+    of mole ratios over the elements at the table positions index, either shared by all alloys (a vector of E
+    positions, see composition_matrix) or given for every alloy (an N x E matrix, see slot_matrix). The result is a
+    structured array with one field per name, only the selected parameters and those they use are computed. The
+    temporaries are N x E, so very large batches should be passed in chunks"""
+    result = np.empty(len(np.atleast_2d(fractions)), dtype=parameter_dtype(names))
+    batch = ParameterBatch(fractions, index)
+    for name in names:
+        result[name] = batch[name]
+    return result
+
+
+def compute_batch(compositions, names=PARAMETER_NAMES):
+    """function to return the named empirical parameters for an iterable of (element_list, mol_ratio) pairs as a
+    structured array, see compute_batch_matrix"""
+    # one slot per element of every alloy, rather than the elements of the whole batch, keeps the temporaries small
+    # and makes the result of an alloy independent of the other alloys it is evaluated with
+    with instrumentation.stage('slot_matrix'):
+        fractions, index = slot_matrix(*composition_arrays(compositions))
+    return compute_batch_matrix(fractions, index, names)
+
+
+def _parse_assignments(assignments, convert):
+    """function to turn command line 'NAME=VALUE' arguments into a dictionary, converting every value"""
+    result = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition('=')
+        result[name.strip()] = convert(value)
+    return result
+
+
+def _parse_names(value):
+    """function to turn a comma separated command line list of parameter names into a tuple"""
+    return tuple(name.strip() for name in value.split(',') if len(name.strip()) > 0)
+
+
+def _parse_bounds(value):
+    """function to turn a command line 'MIN:MAX' argument into a (minimum, maximum) pair of molar fractions"""
+    minimum, _, maximum = value.partition(':')
+    return float(minimum), float(maximum)
+
+
+def main(argv=None):
+    """command line entry point, e.g. 'python -m empirical_parameter_calculator batch in.csv out.csv'"""
+    import argparse
+    import sys
+    import batch_calculator
+    import composition_generator
+
+    parser = argparse.ArgumentParser(prog='empirical_parameter_calculator',
+                                     description='empirical parameter calculator for compositionally complex alloys')
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch = commands.add_parser('batch', help='calculate the empirical parameters of every alloy in a file')
+    batch.add_argument('input', help="'.csv' or '.xlsx' file in the format of 'test_dataset.xlsx'")
+    batch.add_argument('output', help="file the results are written to, its extension ('.csv', '.npy', '.parquet', "
+                                      "'.arrow' or '.feather') sets the output format unless --format is given")
+    batch.add_argument('--chunk-size', type=int, default=batch_calculator.default_chunk_size,
+                       help='number of alloys evaluated and written at a time')
+    batch.add_argument('--workers', type=int, default=1,
+                       help='number of worker processes, 0 uses every available core')
+    batch.add_argument('--format', choices=sorted(batch_calculator.output_formats),
+                       help='output format, columnar formats store the parameters as typed float64 columns')
+    batch.add_argument('--cache', metavar='PATH',
+                       help='SQLite file caching the parameters of already calculated compositions across runs')
+    batch.add_argument('--profile', action='store_true',
+                       help='time the stages of the run and the parameters, and print a summary table at the end')
+    batch.add_argument('--profile-json', metavar='PATH', help='file the profiling summary is written to as JSON')
+    batch.add_argument('--profile-sample', type=float, default=0.0, metavar='RATE',
+                       help='fraction of the alloys timed one by one through EmpiricalParams to find slow rows')
+    batch.add_argument('--index', metavar='DIRECTORY',
+                       help='also build a similarity index of the alloys in DIRECTORY, queried with nearest')
+    batch.add_argument('--resume', action='store_true',
+                       help="continue an interrupted run from the checkpoint next to the output ('.csv' and '.npy' "
+                            "outputs), rather than starting over")
+    batch.add_argument('--parameters',
+                       help='comma separated parameters written, e.g. delta,omega,vec,k (see the parameters command), '
+                            'only these are calculated')
+    batch.add_argument('--npy-width', type=int, metavar='CHARACTERS',
+                       help="number of characters the element and ratio names of a '.npy' output and of the --index "
+                            "library can have (default {})".format(batch_calculator.default_npy_width))
+    screen = commands.add_parser('screen', help='enumerate a composition space and keep the alloys passing thresholds')
+    screen.add_argument('output', help="'.csv' file the passing alloys are written to")
+    screen.add_argument('--elements', required=True, help='comma separated element palette, e.g. Al,Co,Cr,Fe,Ni')
+    screen.add_argument('--size', type=int, required=True, help='number of elements in every alloy')
+    screen.add_argument('--step', type=float, default=0.05, help='molar fraction step of the simplex lattice')
+    screen.add_argument('--bound', action='append', default=[], metavar='ELEMENT=MIN:MAX',
+                        help='molar fraction bounds of an element')
+    screen.add_argument('--min', action='append', default=[], metavar='PARAMETER=VALUE',
+                        help="lower threshold of a parameter, named as in PARAMETER_NAMES (e.g. omega=1.1)")
+    screen.add_argument('--max', action='append', default=[], metavar='PARAMETER=VALUE',
+                        help="upper threshold of a parameter, named as in PARAMETER_NAMES (e.g. delta=0.066)")
+    index = commands.add_parser('index', help="build a similarity index from a '.npy' batch output")
+    index.add_argument('library', help="'.npy' output of a batch run")
+    index.add_argument('directory', help='directory the index is written to')
+    index.add_argument('--parameters',
+                       help='comma separated parameters the alloys are compared by, all those of the library by default')
+    nearest = commands.add_parser('nearest', help='find the alloys of a similarity index closest to given alloys')
+    nearest.add_argument('directory', help='directory of the index')
+    nearest.add_argument('alloys', nargs='+', help="alloy formulas, e.g. 'AlCoCrFeNi2.1'")
+    nearest.add_argument('-k', type=int, default=5, help='number of nearest alloys listed')
+    nearest.add_argument('--radius', type=float,
+                         help='list every alloy within this distance instead, in units of the scale of the parameters '
+                              '(see similarity_index.robust_scale)')
+    optimize = commands.add_parser('optimize', help='search the molar fractions of an element palette for the '
+                                                    'Pareto-optimal alloys satisfying thresholds')
+    optimize.add_argument('output', help="'.csv' file the Pareto-optimal alloys are written to")
+    optimize.add_argument('--elements', required=True, help='comma separated element palette, e.g. Al,Co,Cr,Fe,Ni')
+    optimize.add_argument('--minimize', action='append', default=[], metavar='PARAMETER',
+                          help='parameter to minimize, e.g. price')
+    optimize.add_argument('--maximize', action='append', default=[], metavar='PARAMETER',
+                          help='parameter to maximize, e.g. omega')
+    optimize.add_argument('--bound', action='append', default=[], metavar='ELEMENT=MIN:MAX',
+                          help='molar fraction bounds of an element, 0:1 by default')
+    optimize.add_argument('--min', action='append', default=[], metavar='PARAMETER=VALUE',
+                          help='lower threshold of a parameter (e.g. vec=7.5)')
+    optimize.add_argument('--max', action='append', default=[], metavar='PARAMETER=VALUE',
+                          help='upper threshold of a parameter (e.g. delta=0.05)')
+    optimize.add_argument('--starts', type=int, default=256, help='number of compositions moved at the same time')
+    optimize.add_argument('--iterations', type=int, default=200, help='number of gradient steps')
+    optimize.add_argument('--decimals', type=int, default=3, help='decimals the molar fractions are rounded to')
+    optimize.add_argument('--seed', type=int, default=0, help='seed of the random starting compositions')
+    uncertainty = commands.add_parser('uncertainty', help='propagate molar fraction tolerances of every alloy in a '
+                                                          'file to the parameters by Monte Carlo sampling')
+    uncertainty.add_argument('input', help="'.csv' or '.xlsx' file in the format of 'test_dataset.xlsx'")
+    uncertainty.add_argument('output', help="'.csv' file the mean, standard deviation and percentiles are written to")
+    uncertainty.add_argument('--tolerance', type=float, default=0.01,
+                             help='absolute tolerance of every molar fraction, e.g. 0.01 for +-1 at.%%')
+    uncertainty.add_argument('--samples', type=int, default=1000, help='number of perturbed compositions per alloy')
+    uncertainty.add_argument('--method', choices=['uniform', 'dirichlet'], default='uniform',
+                             help='bounded uniform noise on every fraction, or a Dirichlet distribution around the '
+                                  'nominal composition')
+    uncertainty.add_argument('--percentiles', default='5,50,95', help='comma separated percentiles reported')
+    uncertainty.add_argument('--parameters', default=','.join(PARAMETER_NAMES),
+                             help='comma separated parameters reported, all 14 by default')
+    uncertainty.add_argument('--seed', type=int, default=0, help='seed of the perturbations')
+    uncertainty.add_argument('--chunk-size', type=int, default=batch_calculator.default_chunk_size,
+                             help='number of alloys read and written at a time')
+    uncertainty.add_argument('--workers', type=int, default=1,
+                             help='number of worker processes, 0 uses every available core')
+    serve = commands.add_parser('serve', help='run a local JSON over HTTP calculation service')
+    serve.add_argument('--host', default='127.0.0.1', help='address the service listens on')
+    serve.add_argument('--port', type=int, default=8000, help='port the service listens on')
+    serve.add_argument('--max-batch', type=int, default=4096,
+                       help='number of alloys of concurrent requests evaluated together at most')
+    serve.add_argument('--max-delay', type=float, default=0.0005,
+                       help='seconds a micro-batch waits for more requests when it is not full')
+    shard = commands.add_parser('shard', help='split a batch run into independent shard jobs and merge their outputs')
+    shard_commands = shard.add_subparsers(dest='shard_command', required=True)
+    shard_plan = shard_commands.add_parser('plan', help='split an input file into shards and write the manifest')
+    shard_plan.add_argument('input', help="'.csv' or '.xlsx' file in the format of 'test_dataset.xlsx'")
+    shard_plan.add_argument('output', help='file the merged results are written to, as for batch')
+    shard_plan.add_argument('--shards', type=int, required=True, help='number of shard jobs')
+    shard_plan.add_argument('--by', choices=['bytes', 'rows'],
+                            help="split by byte range (the default for '.csv' inputs) or by row range")
+    shard_plan.add_argument('--format', choices=sorted(batch_calculator.output_formats),
+                            help='output format, the extension of the output by default')
+    shard_plan.add_argument('--parameters', help='comma separated parameters written, as for batch')
+    shard_plan.add_argument('--chunk-size', type=int, default=batch_calculator.default_chunk_size,
+                            help='number of alloys evaluated and written at a time')
+    shard_plan.add_argument('--npy-width', type=int, metavar='CHARACTERS',
+                            help="number of characters the names of a '.npy' output can have, as for batch")
+    shard_run = shard_commands.add_parser('run', help='process one shard of a planned run')
+    shard_run.add_argument('output', help='output of the planned run')
+    shard_run.add_argument('shard', type=int, help='number of the shard, from 0')
+    shard_run.add_argument('--workers', type=int, default=1,
+                           help='number of worker processes, 0 uses every available core')
+    shard_run.add_argument('--cache', metavar='PATH', help='SQLite parameter cache, as for batch')
+    shard_run.add_argument('--resume', action='store_true',
+                           help="continue an interrupted '.csv' or '.npy' shard from its checkpoint")
+    shard_status = shard_commands.add_parser('status', help='list the shards of a planned run that are done')
+    shard_status.add_argument('output', help='output of the planned run')
+    shard_merge = shard_commands.add_parser('merge', help='check that every shard is done and join their outputs')
+    shard_merge.add_argument('output', help='output of the planned run')
+    shard_merge.add_argument('--clean', action='store_true', help='remove the shard outputs once they are merged')
+    commands.add_parser('parameters', help='list the parameters that can be calculated')
+    snapshot = commands.add_parser('snapshot', help='rebuild the element data snapshot from pymatgen and matminer')
+    snapshot.add_argument('output', nargs='?', default=default_snapshot_path,
+                          help="'.npz' file the snapshot is written to, the bundled snapshot if omitted")
+    args = parser.parse_args(argv)
+
+    if args.command == 'batch':
+        names = None if args.parameters is None else _parse_names(args.parameters)
+        if args.resume and batch_calculator.resumable(args.input, args.output, args.format, names):
+            print('resuming after {} input rows'.format(batch_calculator.read_checkpoint(args.output)['rows']))
+        profiling = args.profile or args.profile_json is not None or args.profile_sample > 0
+        if profiling:
+            instrumentation.enable(sample_rate=args.profile_sample)
+        cache_stats = {}
+        try:
+            with instrumentation.stage('batch.run'):
+                count = batch_calculator.run_batch(args.input, args.output, chunk_size=args.chunk_size,
+                                                   workers=args.workers, cache_path=args.cache,
+                                                   output_format=args.format, resume=args.resume,
+                                                   index_path=args.index, names=names, cache_stats=cache_stats,
+                                                   npy_width=args.npy_width)
+        except ValueError as error:
+            parser.error(str(error))
+        if profiling:
+            profiler = instrumentation.disable()
+            print(profiler.table(), file=sys.stderr)
+            if args.profile_json is not None:
+                profiler.write_json(args.profile_json)
+        print('{} alloys written to {}'.format(count, args.output))
+        if args.cache is not None:
+            print('cache: {hits} memory hits, {disk_hits} disk hits, {misses} misses'.format(
+                **dict(dict.fromkeys(batch_calculator.cache_counters, 0), **cache_stats)))
+
+    if args.command == 'shard':
+        import sharding
+
+        try:
+            if args.shard_command == 'plan':
+                names = None if args.parameters is None else _parse_names(args.parameters)
+                manifest = sharding.plan(args.input, args.output, args.shards, method=args.by,
+                                         output_format=args.format, names=names, chunk_size=args.chunk_size,
+                                         npy_width=args.npy_width)
+                print('{} shards by {} planned in {}, run each with'.format(
+                    len(manifest['shards']), manifest['method'], sharding.manifest_path(args.output)))
+                print('  python -m empirical_parameter_calculator shard run {} SHARD'.format(args.output))
+            if args.shard_command == 'run':
+                count = sharding.run_shard(args.output, args.shard, workers=args.workers, cache_path=args.cache,
+                                           resume=args.resume)
+                print('shard {}: {} alloys written'.format(args.shard, count))
+            if args.shard_command == 'status':
+                states = sharding.status(args.output)
+                for shard, state in enumerate(states):
+                    print('shard {}: {}'.format(shard, state))
+                print('{} of {} shards done'.format(states.count('done'), len(states)))
+            if args.shard_command == 'merge':
+                count = sharding.merge(args.output, clean=args.clean)
+                print('{} alloys written to {}'.format(count, args.output))
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+
+    if args.command == 'index':
+        import similarity_index
+
+        names = None if args.parameters is None else _parse_names(args.parameters)
+        try:
+            count = similarity_index.build_index(args.directory, args.library, names)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        print('{} alloys indexed in {}'.format(count, args.directory))
+
+    if args.command == 'nearest':
+        import similarity_index
+
+        try:
+            library = similarity_index.SimilarityIndex(args.directory)
+        except (OSError, KeyError, ValueError) as error:
+            parser.error(str(error))
+        try:
+            parameters = compute_batch([batch_calculator.parse_composition(alloy) for alloy in args.alloys],
+                                       library.names)
+            if args.radius is None:
+                results = zip(*library.query(parameters, args.k))
+            else:
+                results = library.query_radius(parameters, args.radius)
+        except (KeyError, ValueError) as error:
+            parser.error('invalid alloy: {}'.format(error))
+        for alloy, (distances, rows) in zip(args.alloys, results):
+            print(alloy)
+            for distance, row in zip(distances.tolist(), rows.tolist()):
+                if row >= 0:
+                    record = library.library[row]
+                    print('  {:10.4f}  {} ({})  row {}'.format(distance, record['elements'].decode(),
+                                                                record['ratios'].decode(), row))
+
+    if args.command in ('screen', 'optimize'):
+        try:
+            minimums = _parse_assignments(args.min, float)
+            maximums = _parse_assignments(args.max, float)
+            bounds = _parse_assignments(args.bound, _parse_bounds)
+        except ValueError as error:
+            parser.error('invalid threshold or bound: {}'.format(error))
+        for name in itertools.chain(minimums, maximums):
+            if name not in parameter_registry:
+                parser.error('unknown parameter {}, choose from {}'.format(name, ', '.join(parameter_registry)))
+        thresholds = {name: (minimums.get(name), maximums.get(name)) for name in set(minimums) | set(maximums)}
+        elements = [element.strip() for element in args.elements.split(',') if len(element.strip()) > 0]
+
+    if args.command == 'screen':
+        try:
+            count = composition_generator.screen_to_csv(args.output, elements, args.size, args.step, bounds=bounds,
+                                                        thresholds=thresholds)
+        except KeyError as error:
+            parser.error('unknown element {}'.format(error))
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        print('{} alloys written to {}'.format(count, args.output))
+
+    if args.command == 'optimize':
+        import composition_optimizer
+
+        objectives = dict([(name, 'min') for name in args.minimize] + [(name, 'max') for name in args.maximize])
+        if len(objectives) == 0:
+            parser.error('give at least one --minimize or --maximize parameter')
+        for name in itertools.chain(objectives, thresholds):
+            if name not in composition_optimizer.gradient_names:
+                parser.error('{} cannot be optimized, only the parameters with gradients can: {}'.format(
+                    name, ', '.join(composition_optimizer.gradient_names)))
+        try:
+            count = composition_optimizer.optimize_to_csv(args.output, elements, objectives, thresholds, bounds,
+                                                          starts=args.starts, iterations=args.iterations,
+                                                          decimals=args.decimals, seed=args.seed)
+        except KeyError as error:
+            parser.error('unknown element {}'.format(error))
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        print('{} Pareto-optimal alloys written to {}'.format(count, args.output))
+
+    if args.command == 'uncertainty':
+        import uncertainty
+
+        names = _parse_names(args.parameters)
+        try:
+            percentiles = [float(q) for q in args.percentiles.split(',') if len(q.strip()) > 0]
+            count = uncertainty.run_uncertainty(args.input, args.output, samples=args.samples,
+                                                tolerance=args.tolerance, method=args.method,
+                                                percentiles=percentiles, names=names, seed=args.seed,
+                                                chunk_size=args.chunk_size, workers=args.workers)
+        except ValueError as error:
+            parser.error(str(error))
+        print('{} alloys written to {}'.format(count, args.output))
+
+    if args.command == 'serve':
+        import calculation_server
+        calculation_server.serve(args.host, args.port, max_batch=args.max_batch, max_delay=args.max_delay)
+
+    if args.command == 'parameters':
+        for name, parameter in parameter_registry.items():
+            source = parameter.function.__name__ if parameter.kind == 'derived' else parameter.source
+            print('{:<14} {:<22} {:<14} {}{}'.format(name, parameter.label, parameter.kind, source,
+                                                     '' if name in PARAMETER_NAMES else '  (not calculated by default)'))
+
+    if args.command == 'snapshot':
+        ElementPropertyTable.from_pymatgen().save_snapshot(args.output)
+        print('element data snapshot (version {}) written to {}'.format(snapshot_version, args.output))
+
+
+if __name__ == '__main__':
+    import sys
+    # let modules importing empirical_parameter_calculator share this instance instead of building a second one
+    sys.modules.setdefault('empirical_parameter_calculator', sys.modules[__name__])
+    main()
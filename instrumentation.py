@@ -0,0 +1,217 @@
+"""opt-in instrumentation of the calculator. While a profiler is enabled, the stages of the batch pipeline (reading,
+parsing, computing, formatting, writing), the parameters of the vectorized engine and every EmpiricalParams method
+record their call counts and wall times, and a sample of the alloys can be timed one by one to find slow rows. When
+it is off the hooks are a None check per chunk and EmpiricalParams runs its original, unwrapped methods.
+e.g.
+    profiler = instrumentation.enable(sample_rate=0.001)
+    batch_calculator.run_batch('in.csv', 'out.csv')
+    print(instrumentation.disable().table())"""
+
+import collections
+import contextlib
+import functools
+import heapq
+import json
+import random
+import time
+
+# the EmpiricalParams methods wrapped while instrumentation is enabled
+instrumented_methods = ('__init__', 'pair_enthalpies', 'mean_atomic_radius', 'atomic_size_difference',
+                        'average_melting_point', 'std_melting_point', 'entropy_mixing', 'enthalpy_mixing',
+                        'std_enthalpy_mixing', 'omega_enthalpy', 'calc_omega', 'mean_electronegativity',
+                        'std_electronegativity', 'average_vec', 'std_vec', 'mean_bulk_modulus', 'std_bulk_modulus',
+                        'calc_density', 'calc_price')
+
+# the profiler recording at the moment, None while instrumentation is off
+active = None
+
+# the original EmpiricalParams methods (and cached property methods) replaced by enable, by attribute name
+_originals = {}
+
+
+class Profiler(object):
+    """call counts and wall times by stage name, plus the slowest of a random sample of alloys timed one by one.
+    sample_rate is the fraction of the alloys of every chunk that are timed individually through EmpiricalParams,
+    slowest the number of slow rows kept. Times of nested stages (e.g. an EmpiricalParams method reading another
+    parameter) are inclusive"""
+
+    def __init__(self, sample_rate=0.0, slowest=10, seed=0):
+        self.sample_rate = sample_rate
+        self.slowest = slowest
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        """function to clear everything recorded so far"""
+        self.calls = collections.Counter()
+        self.seconds = collections.defaultdict(float)
+        self.max_seconds = collections.defaultdict(float)
+        self.sampled_rows = 0
+        self.slow_rows = []
+
+    def record(self, name, seconds):
+        """function to add a call of a stage that took seconds"""
+        self.calls[name] += 1
+        self.seconds[name] += seconds
+        self.max_seconds[name] = max(self.max_seconds[name], seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """context manager timing its block as one call of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def iterate(self, name, iterable):
+        """generator that yields the items of iterable, timing the production of every item as a call of name"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, time.perf_counter() - start)
+            yield item
+
+    def sample_rows(self, compositions, start=1):
+        """function to time a random sample of sample_rate of the compositions one by one through EmpiricalParams,
+        keeping the slowest. start is the line number of the chunk the compositions came from"""
+        import empirical_parameter_calculator as calculator
+
+        count = sum(1 for _ in compositions if self.random.random() < self.sample_rate)
+        for element_list, mol_ratio in self.random.sample(compositions, count):
+            begin = time.perf_counter()
+            alloy = calculator.EmpiricalParams(element_list, mol_ratio)
+            for name in calculator.PARAMETER_NAMES:
+                getattr(alloy, name)
+            seconds = time.perf_counter() - begin
+            row = (seconds, start, '-'.join([calculator.element_data.symbol_of(element) for element in element_list]),
+                   calculator.ratio_text(mol_ratio))
+            self.sampled_rows += 1
+            if len(self.slow_rows) < self.slowest:
+                heapq.heappush(self.slow_rows, row)
+            else:
+                heapq.heappushpop(self.slow_rows, row)
+
+    def export(self):
+        """function to return everything recorded as plain data, to be merged into another profiler"""
+        return {'calls': dict(self.calls), 'seconds': dict(self.seconds), 'max_seconds': dict(self.max_seconds),
+                'sampled_rows': self.sampled_rows, 'slow_rows': list(self.slow_rows)}
+
+    def merge(self, data):
+        """function to add the data exported by another profiler (e.g. of a worker process)"""
+        self.calls.update(data['calls'])
+        for name, seconds in data['seconds'].items():
+            self.seconds[name] += seconds
+        for name, seconds in data['max_seconds'].items():
+            self.max_seconds[name] = max(self.max_seconds[name], seconds)
+        self.sampled_rows += data['sampled_rows']
+        for row in data['slow_rows']:
+            if len(self.slow_rows) < self.slowest:
+                heapq.heappush(self.slow_rows, tuple(row))
+            else:
+                heapq.heappushpop(self.slow_rows, tuple(row))
+
+    def summary(self):
+        """function to return the recorded stages, sorted by total time, and the slowest sampled rows as a
+        dictionary"""
+        stages = {}
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            stages[name] = {'calls': self.calls[name], 'seconds': self.seconds[name],
+                            'mean_seconds': self.seconds[name] / self.calls[name],
+                            'max_seconds': self.max_seconds[name]}
+        slow_rows = [{'seconds': seconds, 'chunk_start_line': start, 'elements': elements, 'ratios': ratios}
+                     for seconds, start, elements, ratios in sorted(self.slow_rows, reverse=True)]
+        return {'stages': stages, 'sampled_rows': self.sampled_rows, 'slow_rows': slow_rows}
+
+    def write_json(self, path):
+        """function to write the summary to a JSON file"""
+        with open(path, 'w') as out:
+            json.dump(self.summary(), out, indent=2)
+            out.write('\n')
+
+    def table(self):
+        """function to return the summary as a human-readable table"""
+        summary = self.summary()
+        width = max([len(name) for name in summary['stages']] + [5])
+        lines = ['{:<{w}} {:>10} {:>12} {:>12} {:>12}'.format('stage', 'calls', 'total (s)', 'mean (ms)', 'max (ms)',
+                                                               w=width)]
+        for name, stage in summary['stages'].items():
+            lines.append('{:<{w}} {:>10d} {:>12.4f} {:>12.4f} {:>12.4f}'.format(
+                name, stage['calls'], stage['seconds'], stage['mean_seconds'] * 1000, stage['max_seconds'] * 1000,
+                w=width))
+        if len(summary['slow_rows']) > 0:
+            lines.append('')
+            lines.append('slowest of {} sampled rows (EmpiricalParams, all 14 parameters):'.format(
+                summary['sampled_rows']))
+            for row in summary['slow_rows']:
+                lines.append('  {:.4f} ms  {} ({})  in the chunk starting at line {}'.format(
+                    row['seconds'] * 1000, row['elements'], row['ratios'], row['chunk_start_line']))
+        return '\n'.join(lines)
+
+
+def _timed(name, method):
+    """function to return method wrapped to record its calls as the stage name of the active profiler"""
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if active is not None:
+                active.record(name, time.perf_counter() - start)
+    return timed
+
+
+def enable(sample_rate=0.0, slowest=10, seed=0):
+    """function to start recording into a new profiler, returns the profiler"""
+    global active
+    import empirical_parameter_calculator as calculator
+
+    if active is None:
+        cls = calculator.EmpiricalParams
+        for name in instrumented_methods:
+            _originals[name] = cls.__dict__[name]
+            setattr(cls, name, _timed('EmpiricalParams.' + name, _originals[name]))
+        # the cached parameters call the methods they were created with, not the class attributes
+        for name, attribute in list(cls.__dict__.items()):
+            if isinstance(attribute, calculator._cached_property) and attribute.method.__name__ in _originals:
+                attribute.method = getattr(cls, attribute.method.__name__)
+    active = Profiler(sample_rate, slowest, seed)
+    return active
+
+
+def disable():
+    """function to stop recording and restore the uninstrumented methods, returns the profiler that was active"""
+    global active
+    import empirical_parameter_calculator as calculator
+
+    profiler = active
+    if active is not None:
+        cls = calculator.EmpiricalParams
+        for name, attribute in list(cls.__dict__.items()):
+            if isinstance(attribute, calculator._cached_property) and attribute.method.__name__ in _originals:
+                attribute.method = _originals[attribute.method.__name__]
+        for name, method in _originals.items():
+            setattr(cls, name, method)
+        _originals.clear()
+        active = None
+    return profiler
+
+
+def stage(name):
+    """function to return a context manager timing its block as a stage of the active profiler, or doing nothing
+    while instrumentation is off"""
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name)
+
+
+def iterate(name, iterable):
+    """function to return iterable, timing the production of its items while instrumentation is on"""
+    if active is None:
+        return iterable
+    return active.iterate(name, iterable)
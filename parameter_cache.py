@@ -0,0 +1,293 @@
+"""memoization of the empirical parameters by composition. Compositions are reduced to a canonical key (sorted element
+symbols with their normalized molar ratios rounded to a tolerance), the parameters of recently seen keys are kept in a
+bounded in-memory LRU and, optionally, in an SQLite file that persists across batch runs. The SQLite file has a column
+per parameter of the registry, added when the parameter is first cached, so any selection of parameters can be cached
+and only the missing ones are computed. It records the fingerprint of the element data and the definition of every
+parameter its values were computed with, and drops the values that no longer match."""
+
+import collections
+import contextlib
+import math
+import operator
+import sqlite3
+import time
+import warnings
+import numpy as np
+import empirical_parameter_calculator as calculator
+import instrumentation
+
+# the seconds a process waits for the other processes sharing an SQLite store to release it
+_timeout = 60
+
+# the number of keys looked up in a single SQLite query, kept below the default limit of host parameters
+_query_size = 500
+
+# bumped whenever the layout of the SQLite store changes, stores of another version are emptied
+cache_version = 3
+
+# the parameter values stored as text, see _sql_value
+_text_values = {'nan': float('nan'), '-nan': -float('nan'), '-zero': -0.0}
+
+
+def _column(name):
+    """function to return the quoted name of the SQLite column holding the values of the parameter name"""
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _sql_value(value):
+    """function to return a parameter value as stored in SQLite, where NULL marks a value that was not computed. SQLite
+    drops the sign of nan and -0.0 (and reads numeric text back as a number), so they are stored as the texts of
+    _text_values, keeping cached values the computed ones to the bit"""
+    if value == value and (value != 0 or math.copysign(1, value) > 0):
+        return value
+    if value != value:
+        return '-nan' if math.copysign(1, value) < 0 else 'nan'
+    return '-zero'
+
+
+def _definition(parameter):
+    """function to return a text describing how the values of a registered parameter are computed, the label and
+    output scale are left out as they do not change the values"""
+    function = None if parameter.function is None else parameter.function.__qualname__
+    return '{} {} {}'.format(parameter.kind, parameter.source, function)
+
+
+def composition_key(element_list, mol_ratio=None, decimals=6):
+    """function to return the canonical key of a composition: the element symbols in alphabetical order with their
+    normalized molar ratios rounded to the given number of decimals. Repeated elements are merged. Returns None if the
+    ratios do not add up to a positive amount, such compositions have no parameters and are not cached"""
+    if mol_ratio is None:
+        mol_ratio = [1] * len(element_list)
+    total = float(sum(mol_ratio))
+    if not 0 < total < np.inf:
+        return None
+    ratios = {}
+    for element, ratio in zip(element_list, mol_ratio):
+        symbol = calculator.element_data.symbol_of(element)
+        ratios[symbol] = ratios.get(symbol, 0) + ratio / total
+    return ','.join(['%s:%.*f' % (symbol, decimals, ratios[symbol]) for symbol in sorted(ratios)])
+
+
+class ParameterCache(object):
+    """cache of the empirical parameters of compositions, with an in-memory LRU of at most max_size keys and an
+    optional persistent SQLite store at path. hits, disk_hits and misses count the lookups answered from memory, from
+    the SQLite store and by computation"""
+
+    def __init__(self, max_size=100000, path=None, decimals=6):
+        self.max_size = max_size
+        self.decimals = decimals
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._connection = None
+        self._fingerprint = None
+        self._definitions = {}
+        if path is not None:
+            self._connection = sqlite3.connect(path, timeout=_timeout)
+            self._use_wal()
+            self._connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+            self._connection.commit()
+        self._check_fingerprint()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _use_wal(self):
+        """function to switch the SQLite store to write-ahead logging, so that reading does not block writing. The
+        switch needs the file to itself and SQLite does not wait for it, so it is retried while other processes (e.g.
+        the batch workers opening a new store together) use the file"""
+        deadline = time.monotonic() + _timeout
+        while True:
+            try:
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                return
+            except sqlite3.OperationalError as error:
+                if 'locked' not in str(error) or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def _metadata(self, name):
+        """function to return a value of the metadata table of the SQLite store, None if it is not set"""
+        row = self._connection.execute('SELECT value FROM metadata WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """context in which the SQLite store is written in one transaction that holds the write lock from its start,
+        so that what is read in it cannot be changed by the other processes sharing the file (e.g. the batch workers)
+        before it is committed"""
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.rollback()
+            raise
+        self._connection.commit()
+
+    def _check_fingerprint(self):
+        """function to empty the cache if the element data differ from those its parameters were computed with, e.g.
+        after a snapshot rebuild or a change of price_dic"""
+        fingerprint = calculator.element_data.fingerprint()
+        if fingerprint == self._fingerprint:
+            return
+        self._memory.clear()
+        self._definitions.clear()
+        if self._connection is not None:
+            state = '{}:{}'.format(cache_version, fingerprint)
+            with self._locked():
+                if self._metadata('fingerprint') != state:
+                    tables = [row[0] for row in self._connection.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table' AND name != 'metadata'")]
+                    if len(tables) > 0:
+                        warnings.warn('the parameter cache {} was computed with other element data or by another '
+                                      'version, emptying it'.format(self.path))
+                    for table in tables:
+                        self._connection.execute('DROP TABLE {}'.format(_column(table)))
+                    self._connection.execute('DELETE FROM metadata')
+                    self._connection.execute("INSERT INTO metadata VALUES ('fingerprint', ?)", (state,))
+                self._connection.execute('CREATE TABLE IF NOT EXISTS parameters (key TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._fingerprint = fingerprint
+
+    def _column_state(self, name, definition):
+        """function to return whether the SQLite store has a column for the parameter name whose values were computed
+        by definition, 'missing' if it has no column and 'outdated' if its values were computed by another definition"""
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(parameters)')]
+        if name not in columns:
+            return 'missing'
+        return 'current' if self._metadata('parameter:' + name) == definition else 'outdated'
+
+    def _check_definitions(self, names):
+        """function to make sure the cached values of the named parameters were computed by their current
+        definitions, dropping those of a parameter that was registered anew with another definition"""
+        for name in names:
+            definition = _definition(calculator.parameter_registry[name])
+            if self._definitions.get(name) == definition:
+                continue
+            if name in self._definitions:
+                for values in self._memory.values():
+                    values.pop(name, None)
+            if self._connection is not None and self._column_state(name, definition) != 'current':
+                with self._locked():
+                    # checked again, another process may have added or cleared the column in the meantime
+                    state = self._column_state(name, definition)
+                    if state == 'missing':
+                        self._connection.execute('ALTER TABLE parameters ADD COLUMN {} REAL'.format(_column(name)))
+                    elif state == 'outdated':
+                        self._connection.execute('UPDATE parameters SET {} = NULL'.format(_column(name)))
+                    self._connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                                             ('parameter:' + name, definition))
+            self._definitions[name] = definition
+
+    def _remember(self, key, values):
+        """function to add the parameters of a key to the in-memory LRU, evicting the least recently used keys"""
+        self._memory[key] = values
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _load(self, keys, names):
+        """function to return a dictionary of the named parameters stored on disk for the given keys, by key and then
+        by name. Keys missing some of the parameters have only those that are stored"""
+        found = {}
+        columns = ', '.join([_column(name) for name in names])
+        for i in range(0, len(keys), _query_size):
+            batch = keys[i:i + _query_size]
+            query = 'SELECT key, {} FROM parameters WHERE key IN ({})'.format(columns, ', '.join('?' * len(batch)))
+            for row in self._connection.execute(query, batch):
+                values = dict(zip(names, row[1:]))
+                if None in row or any(text in row for text in _text_values):
+                    values = {name: _text_values[value] if isinstance(value, str) else value
+                              for name, value in values.items() if value is not None}
+                found[row[0]] = values
+        return found
+
+    def _store(self, items, names):
+        """function to write the named parameters of (key, parameters) pairs to disk, keeping the other parameters
+        stored for the keys"""
+        columns = [_column(name) for name in names]
+        query = 'INSERT INTO parameters (key, {}) VALUES (?, {}) ON CONFLICT (key) DO UPDATE SET {}'.format(
+            ', '.join(columns), ', '.join('?' * len(columns)),
+            ', '.join(['{0} = excluded.{0}'.format(column) for column in columns]))
+        self._connection.executemany(query, [(key,) + tuple([_sql_value(values[name]) for name in names])
+                                             for key, values in items])
+        self._connection.commit()
+
+    def compute_batch(self, compositions, names=calculator.PARAMETER_NAMES):
+        """function to return the named parameters of a sequence of (element_list, mol_ratio) pairs as compute_batch
+        does, computing only the parameters of a composition that are neither in memory nor on disk"""
+        compositions = list(compositions)
+        names = tuple(names)
+        dtype = calculator.parameter_dtype(names)
+        self._check_fingerprint()
+        self._check_definitions(names)
+        with instrumentation.stage('cache.keys'):
+            keys = [composition_key(element_list, mol_ratio, self.decimals)
+                    for element_list, mol_ratio in compositions]
+
+        rows = [None] * len(compositions)
+        missing = collections.OrderedDict()
+        uncached = []
+        for i, key in enumerate(keys):
+            if key is None:
+                uncached.append(i)
+                continue
+            values = self._memory.get(key)
+            if values is not None and all(name in values for name in names):
+                self._memory.move_to_end(key)
+                rows[i] = values
+                self.hits += 1
+            else:
+                missing.setdefault(key, []).append(i)
+
+        if self._connection is not None and len(missing) > 0:
+            with instrumentation.stage('cache.load'):
+                found = self._load(list(missing), names)
+            for key, stored in found.items():
+                values = self._memory.get(key, {})
+                values.update(stored)
+                self._remember(key, values)
+                if all(name in values for name in names):
+                    for i in missing.pop(key):
+                        rows[i] = values
+                        self.disk_hits += 1
+
+        if len(missing) > 0:
+            known = [self._memory.get(key, {}) for key in missing]
+            needed = [name for name in names if not all(name in values for values in known)]
+            computed = calculator.compute_batch([compositions[indices[0]] for indices in missing.values()], needed)
+            items = []
+            for (key, indices), values, new in zip(missing.items(), known, computed.tolist()):
+                values = dict(values)
+                values.update(zip(needed, new))
+                for i in indices:
+                    rows[i] = values
+                self.misses += len(indices)
+                self._remember(key, values)
+                items.append((key, values))
+            if self._connection is not None:
+                with instrumentation.stage('cache.store'):
+                    self._store(items, needed)
+
+        result = np.empty(len(compositions), dtype=dtype)
+        cached = [i for i in range(len(compositions)) if rows[i] is not None]
+        getter = operator.itemgetter(*names)
+        if len(names) == 1:
+            result[names[0]][cached] = [getter(rows[i]) for i in cached]
+        else:
+            result[cached] = [getter(rows[i]) for i in cached]
+        if len(uncached) > 0:
+            result[uncached] = calculator.compute_batch([compositions[i] for i in uncached], names)
+            self.misses += len(uncached)
+        return result
+
+    def stats(self):
+        """function to return the lookup counters as a dictionary"""
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'size': len(self._memory)}
+
+    def close(self):
+        """function to close the SQLite store"""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
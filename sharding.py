@@ -0,0 +1,269 @@
+"""sharded batch runs, for spreading a large input file over several machines that share a filesystem. A run is
+planned once: the input is split into N shards by byte range ('.csv' files) or by row range, recorded in a manifest
+in the directory 'OUTPUT.shards'. Every shard is then an independent job (e.g. one per cluster node) writing its own
+output and, once it is done, a completion marker next to it. The merge step checks that the completed shards cover
+the whole input and joins their outputs in input order into OUTPUT.
+e.g. 'python -m empirical_parameter_calculator shard plan in.csv out.csv --shards 8'
+     'python -m empirical_parameter_calculator shard run out.csv 3'      (for every shard 0-7, anywhere)
+     'python -m empirical_parameter_calculator shard merge out.csv'"""
+
+import json
+import os
+import shutil
+import numpy as np
+import empirical_parameter_calculator as calculator
+import batch_calculator
+
+# bumped whenever the manifest or the completion markers change meaning
+manifest_version = 1
+
+# the ways an input file can be split
+shard_methods = ('bytes', 'rows')
+
+
+def shard_directory(out_path):
+    """function to return the directory holding the manifest, outputs and markers of the shards of a run"""
+    return out_path + '.shards'
+
+
+def manifest_path(out_path):
+    """function to return the path of the manifest of a sharded run"""
+    return os.path.join(shard_directory(out_path), 'manifest.json')
+
+
+def marker_path(shard_path):
+    """function to return the path of the completion marker of a shard output"""
+    return shard_path + '.done'
+
+
+def split(in_path, shards, method='bytes'):
+    """function to return the (start, end) ranges of shards parts of about the same size of an input file, byte
+    offsets for 'bytes' and row numbers for 'rows'. Byte ranges need not fall on line boundaries, see
+    batch_calculator.read_byte_range"""
+    if shards < 1:
+        raise ValueError('at least one shard is needed')
+    if method == 'bytes':
+        total = os.path.getsize(in_path)
+    elif method == 'rows':
+        total = batch_calculator.count_rows(in_path)
+        if total is None:
+            raise ValueError('the number of rows of {} is not recorded in the file'.format(in_path))
+    else:
+        raise ValueError('unknown shard method {}, choose from {}'.format(method, ', '.join(shard_methods)))
+    bounds = [total * i // shards for i in range(shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def plan(in_path, out_path, shards, method=None, output_format=None, names=None,
+         chunk_size=batch_calculator.default_chunk_size, npy_width=None):
+    """function to split in_path into shards jobs writing to out_path, returns the manifest written. method defaults
+    to 'bytes' for '.csv' inputs (a shard then reads only its own part of the file) and 'rows' otherwise. npy_width
+    is the width of the compositions of '.npy' shards (see batch_calculator.NpyWriter), the same for all of them so
+    that they can be merged. Planning the same run again returns the existing manifest, a different plan for the same
+    output raises ValueError"""
+    extension = in_path.rsplit('.', 1)[-1].lower()
+    if method is None:
+        method = 'bytes' if extension == 'csv' else 'rows'
+    if method == 'bytes' and extension != 'csv':
+        raise ValueError('only .csv inputs can be split by byte range, use rows')
+    if output_format is None:
+        output_format = out_path.rsplit('.', 1)[-1].lower()
+    if output_format not in batch_calculator.output_formats:
+        raise ValueError('unsupported output format: {}'.format(output_format))
+    if names is not None:
+        names = list(names)
+        calculator.parameter_dtype(names)
+
+    manifest = dict(batch_calculator._input_state(in_path), version=manifest_version, output=os.path.abspath(out_path),
+                    method=method, format=output_format, parameters=names, chunk_size=chunk_size,
+                    npy_width=npy_width, shards=[])
+    for shard, (start, end) in enumerate(split(in_path, shards, method)):
+        manifest['shards'].append({'shard': shard, 'start': start, 'end': end,
+                                   'output': 'shard-{:05d}.{}'.format(shard, output_format)})
+
+    existing = read_manifest(out_path) if os.path.exists(manifest_path(out_path)) else None
+    if existing is not None:
+        if existing != manifest:
+            raise ValueError('{} holds the plan of another run, remove it to plan a new one'.format(
+                shard_directory(out_path)))
+        return existing
+    os.makedirs(shard_directory(out_path), exist_ok=True)
+    batch_calculator.write_json(manifest_path(out_path), manifest)
+    return manifest
+
+
+def read_manifest(out_path):
+    """function to return the manifest of a sharded run, raises ValueError if it was written by another version"""
+    with open(manifest_path(out_path)) as description:
+        manifest = json.load(description)
+    if manifest['version'] != manifest_version:
+        raise ValueError('the manifest of {} has version {}, version {} is required, plan the run again'.format(
+            out_path, manifest['version'], manifest_version))
+    return manifest
+
+
+def _check_input(manifest):
+    """function raising ValueError if the input of a sharded run changed since it was planned"""
+    if batch_calculator._input_state(manifest['input']) != {key: manifest[key] for key in
+                                                             ('input', 'input_size', 'input_mtime_ns')}:
+        raise ValueError('{} changed since the run was planned, plan it again'.format(manifest['input']))
+
+
+def _read_marker(path):
+    """function to return the completion marker of a shard output, None if there is none"""
+    try:
+        with open(marker_path(path)) as marker:
+            return json.load(marker)
+    except FileNotFoundError:
+        return None
+
+
+def _marker_matches(marker, entry, path):
+    """function to return whether a completion marker records the shard entry of the manifest, written by the output
+    that is at path now"""
+    return (marker is not None and all(marker[key] == entry[key] for key in ('shard', 'start', 'end'))
+            and os.path.exists(path) and os.path.getsize(path) == marker['bytes'])
+
+
+def run_shard(out_path, shard, workers=1, cache_path=None, resume=False, progress=None, cancel=None):
+    """function to process one shard of a planned run, returns the number of alloys it wrote. The shard output is
+    written with batch_calculator.run_batch, so '.csv' and '.npy' shards are checkpointed and continue where they
+    stopped with resume. A completion marker is written once the shard is done, a shard that is done already is not
+    run again"""
+    manifest = read_manifest(out_path)
+    _check_input(manifest)
+    if not 0 <= shard < len(manifest['shards']):
+        raise ValueError('the run has shards 0 to {}, not {}'.format(len(manifest['shards']) - 1, shard))
+    entry = manifest['shards'][shard]
+    path = os.path.join(shard_directory(out_path), entry['output'])
+    marker = _read_marker(path)
+    if _marker_matches(marker, entry, path):
+        return marker['alloys']
+    if os.path.exists(marker_path(path)):
+        os.remove(marker_path(path))
+
+    limits = (manifest['method'], entry['start'], entry['end'])
+    resume = resume and batch_calculator.resumable(manifest['input'], path, manifest['format'],
+                                                   manifest['parameters'], limits)
+    try:
+        count = batch_calculator.run_batch(manifest['input'], path, chunk_size=manifest['chunk_size'], workers=workers,
+                                           cache_path=cache_path, output_format=manifest['format'], resume=resume,
+                                           progress=progress, cancel=cancel, names=manifest['parameters'],
+                                           shard=limits, npy_width=manifest.get('npy_width'))
+    except ValueError as error:
+        raise ValueError('shard {} ({} {} to {} of {}): {}'.format(shard, manifest['method'], entry['start'],
+                                                                   entry['end'], manifest['input'], error))
+    if cancel is None or not cancel.is_set():
+        batch_calculator.write_json(marker_path(path), dict(entry, alloys=count, bytes=os.path.getsize(path)))
+    return count
+
+
+def status(out_path):
+    """function to return the state of every shard of a planned run: 'done', 'started' (with a checkpoint, or an
+    output without one) or 'pending'"""
+    manifest = read_manifest(out_path)
+    states = []
+    for entry in manifest['shards']:
+        path = os.path.join(shard_directory(out_path), entry['output'])
+        if _marker_matches(_read_marker(path), entry, path):
+            states.append('done')
+        elif os.path.exists(path):
+            states.append('started')
+        else:
+            states.append('pending')
+    return states
+
+
+def _npy_parts(paths):
+    """function to return the record dtype and the (path, header size, count) of every '.npy' shard output"""
+    dtype = None
+    parts = []
+    for path in paths:
+        with open(path, 'rb') as part:
+            version = np.lib.format.read_magic(part)
+            if version != (1, 0):
+                raise ValueError('{} is not a .npy file written by a batch run'.format(path))
+            shape, _, part_dtype = np.lib.format.read_array_header_1_0(part)
+            parts.append((path, part.tell(), shape[0]))
+        if dtype is not None and part_dtype != dtype:
+            raise ValueError('the records of {} differ from those of the other shards'.format(path))
+        dtype = part_dtype
+    return dtype, parts
+
+
+def _merge_files(paths, target, output_format):
+    """function to join the shard outputs at paths into the file target, in order"""
+    if output_format == 'csv':
+        with open(target, 'wb') as out:
+            for i, path in enumerate(paths):
+                with open(path, 'rb') as part:
+                    if i > 0:
+                        # every shard output starts with the header
+                        part.readline()
+                    shutil.copyfileobj(part, out, 1 << 24)
+    elif output_format == 'npy':
+        dtype, parts = _npy_parts(paths)
+        count = sum(part[2] for part in parts)
+        # the header is padded like that of NpyWriter, so the result is the same as the output of a single run
+        size = 64 * ((len(batch_calculator._npy_header(dtype, 2 ** 62)) + 63) // 64)
+        with open(target, 'wb') as out:
+            out.write(batch_calculator._npy_header(dtype, count, size))
+            for path, offset, _ in parts:
+                with open(path, 'rb') as part:
+                    part.seek(offset)
+                    shutil.copyfileobj(part, out, 1 << 24)
+    elif output_format == 'parquet':
+        import pyarrow.parquet
+
+        writer = None
+        try:
+            for path in paths:
+                part = pyarrow.parquet.ParquetFile(path)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(target, part.schema_arrow)
+                for group in range(part.num_row_groups):
+                    writer.write_table(part.read_row_group(group))
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        import pyarrow
+
+        writer = None
+        try:
+            for path in paths:
+                with pyarrow.ipc.open_file(path) as part:
+                    if writer is None:
+                        writer = pyarrow.ipc.new_file(target, part.schema)
+                    for batch in range(part.num_record_batches):
+                        writer.write_batch(part.get_batch(batch))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def merge(out_path, clean=False):
+    """function to join the outputs of the shards of a planned run into out_path, in input order, returns the number
+    of alloys. Raises ValueError, writing nothing, unless every shard is done and the shards cover the whole input.
+    '.csv' and '.npy' outputs are concatenated, '.parquet' and '.arrow' outputs compacted into a single file. With
+    clean, the shard directory is removed afterwards"""
+    manifest = read_manifest(out_path)
+    _check_input(manifest)
+    entries = manifest['shards']
+    missing = [entry['shard'] for entry, state in zip(entries, status(out_path)) if state != 'done']
+    if len(missing) > 0:
+        raise ValueError('shards {} of {} are not done'.format(', '.join(map(str, missing)), len(entries)))
+    total = manifest['input_size'] if manifest['method'] == 'bytes' else batch_calculator.count_rows(manifest['input'])
+    bounds = [0] + [entry['end'] for entry in entries]
+    if [entry['start'] for entry in entries] != bounds[:-1] or bounds[-1] != total:
+        raise ValueError('the shards do not cover the {} {} of {}'.format(total, manifest['method'],
+                                                                          manifest['input']))
+
+    directory = shard_directory(out_path)
+    paths = [os.path.join(directory, entry['output']) for entry in entries]
+    _merge_files(paths, out_path + '.tmp', manifest['format'])
+    os.replace(out_path + '.tmp', out_path)
+    count = sum(_read_marker(path)['alloys'] for path in paths)
+    if clean:
+        shutil.rmtree(directory)
+    return count
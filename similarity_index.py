@@ -0,0 +1,166 @@
+"""nearest neighbour search over the empirical parameters of large alloy libraries. An index is a directory holding
+the library (the alloys and their parameters as a '.npy' structured array in the format of the batch '.npy' output),
+the normalized parameter vectors of its alloys and a small JSON description, all '.npy' files being memory-mapped on
+load. The scipy KD-tree over the vectors is built on the first query, without copying them.
+e.g. 'python -m empirical_parameter_calculator batch in.csv out.npy --index library_index', then
+     'python -m empirical_parameter_calculator nearest library_index AlCoCrFeNi2.1 -k 5'"""
+
+import json
+import os
+import shutil
+import numpy as np
+import empirical_parameter_calculator as calculator
+
+# bumped whenever the files of an index change meaning
+index_version = 2
+
+# the number of library records normalized at a time while building an index
+_build_chunk_size = 1000000
+
+# the largest number of library records the center and scale of the parameters are estimated from
+_sample_size = 1000000
+
+# the interquartile range of the standard normal distribution, so that scales are standard deviations for normally
+# distributed parameters
+_normal_iqr = 1.3489795003921634
+
+
+def _parameter_matrix(parameters, names):
+    """function to return the named fields of a structured parameter array as an N x D float64 matrix"""
+    return np.column_stack([np.asarray(parameters[name], dtype=np.float64) for name in names])
+
+
+def robust_scale(values):
+    """function to return the center (median) and scale (interquartile range over that of the normal distribution)
+    of every column of an N x D matrix. Unlike the mean and standard deviation, they are not pulled by the few
+    extreme values of heavy-tailed parameters such as omega, whose enthalpy clamp gives values up to 1e7 for a median
+    below 1. A column without spread in its quartiles is scaled by its standard deviation, or by 1 if it is constant"""
+    if len(values) == 0:
+        return np.zeros(values.shape[1]), np.ones(values.shape[1])
+    lower, center, upper = np.percentile(values, [25, 50, 75], axis=0)
+    scale = (upper - lower) / _normal_iqr
+    spread = np.std(values, axis=0)
+    scale = np.where(scale > 0, scale, np.where(spread > 0, spread, 1))
+    return center, scale
+
+
+def build_index(index_path, library_path=None, names=None):
+    """function to build the index in the directory index_path from a library of alloys in the format of the batch
+    '.npy' output, which is copied into the index unless it is index_path/library.npy already. Every parameter of
+    names (all the parameters of the library if None) is centered and scaled over the library with robust_scale,
+    alloys with a missing (nan) parameter are left out of the index. Returns the number of alloys indexed"""
+    os.makedirs(index_path, exist_ok=True)
+    target = os.path.join(index_path, 'library.npy')
+    if library_path is not None and os.path.abspath(library_path) != os.path.abspath(target):
+        shutil.copyfile(library_path, target)
+    library = np.load(target, mmap_mode='r')
+    names = list(library.dtype.names[2:] if names is None else names)
+    for name in names:
+        if name not in library.dtype.names[2:]:
+            raise ValueError('the library has no parameter {}, choose from {}'.format(
+                name, ', '.join(library.dtype.names[2:])))
+
+    # the center and scale are taken from a sample of at most _sample_size complete rows, evenly spread over the
+    # library so that it is read chunk by chunk only once
+    stride = max(1, -(-len(library) // _sample_size))
+    count = 0
+    sample = []
+    for start in range(0, len(library), _build_chunk_size):
+        values = _parameter_matrix(library[start:start + _build_chunk_size], names)
+        complete = ~np.isnan(values).any(axis=1)
+        count += int(np.count_nonzero(complete))
+        sample.append(values[complete & (np.arange(start, start + len(values)) % stride == 0)])
+    center, scale = robust_scale(np.concatenate(sample) if len(sample) > 0 else np.empty((0, len(names))))
+
+    vectors = np.lib.format.open_memmap(os.path.join(index_path, 'vectors.npy'), mode='w+', dtype=np.float64,
+                                        shape=(count, len(names)))
+    rows = np.lib.format.open_memmap(os.path.join(index_path, 'rows.npy'), mode='w+', dtype=np.int64,
+                                     shape=(count,))
+    offset = 0
+    for start in range(0, len(library), _build_chunk_size):
+        values = _parameter_matrix(library[start:start + _build_chunk_size], names)
+        complete = np.flatnonzero(~np.isnan(values).any(axis=1))
+        vectors[offset:offset + len(complete)] = (values[complete] - center) / scale
+        rows[offset:offset + len(complete)] = complete + start
+        offset += len(complete)
+    vectors.flush()
+    rows.flush()
+    del vectors, rows
+
+    with open(os.path.join(index_path, 'index.json'), 'w') as out:
+        json.dump({'version': index_version, 'names': names, 'center': center.tolist(), 'scale': scale.tolist(),
+                   'alloys': len(library), 'indexed': count}, out, indent=2)
+    return count
+
+
+class SimilarityIndex(object):
+    """nearest neighbour index of an alloy library built by build_index. The library, vectors and row numbers are
+    memory-mapped, so opening an index is instant and its pages are shared between processes. Queries take the
+    parameters of the query alloys as a compute_batch structured array (see query_compositions for compositions) and
+    return row numbers of the library, whose records are library[rows]"""
+
+    def __init__(self, path, leafsize=16):
+        with open(os.path.join(path, 'index.json')) as description:
+            meta = json.load(description)
+        if meta.get('version') != index_version:
+            raise ValueError('the index {} has version {}, version {} is required, rebuild it with build_index'
+                             .format(path, meta.get('version'), index_version))
+        self.path = path
+        self.names = meta['names']
+        self.center = np.array(meta['center'])
+        self.scale = np.array(meta['scale'])
+        self.leafsize = leafsize
+        self.library = np.load(os.path.join(path, 'library.npy'), mmap_mode='r')
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(path, 'rows.npy'), mmap_mode='r')
+        self._tree = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def tree(self):
+        """the KD-tree over the normalized vectors, built on first use"""
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self.vectors, leafsize=self.leafsize, copy_data=False)
+        return self._tree
+
+    def normalize(self, parameters):
+        """function to return the normalized vectors of a compute_batch parameter array, as rows of a matrix"""
+        return (_parameter_matrix(np.atleast_1d(parameters), self.names) - self.center) / self.scale
+
+    def _check(self, vectors):
+        if np.isnan(vectors).any():
+            raise ValueError('the parameters {} of a query alloy are missing'.format(
+                ', '.join(np.array(self.names)[np.isnan(vectors).any(axis=0)])))
+
+    def query(self, parameters, k=5):
+        """function to return the distances and library rows of the k nearest alloys to every query alloy, as two
+        M x k arrays sorted by distance. Where the library has fewer than k alloys the distance is inf and the row
+        is -1"""
+        vectors = self.normalize(parameters)
+        self._check(vectors)
+        distances, positions = self.tree.query(vectors, k=k)
+        distances = distances.reshape(len(vectors), k)
+        positions = positions.reshape(len(vectors), k)
+        found = positions < len(self.rows)
+        rows = np.where(found, np.asarray(self.rows)[np.where(found, positions, 0)], -1)
+        return distances, rows
+
+    def query_radius(self, parameters, radius):
+        """function to return, for every query alloy, the distances and library rows of all the alloys within radius
+        (in normalized units), sorted by distance"""
+        vectors = self.normalize(parameters)
+        self._check(vectors)
+        results = []
+        for vector, positions in zip(vectors, self.tree.query_ball_point(vectors, radius)):
+            positions = np.asarray(positions, dtype=np.intp)
+            distances = np.linalg.norm(np.asarray(self.vectors[positions]) - vector, axis=1)
+            order = np.argsort(distances, kind='stable')
+            results.append((distances[order], np.asarray(self.rows)[positions[order]]))
+        return results
+
+    def query_compositions(self, compositions, k=5):
+        """function to return the k nearest alloys of a sequence of (element_list, mol_ratio) pairs, see query"""
+        return self.query(calculator.compute_batch(compositions, self.names), k)
@@ -0,0 +1,44 @@
+"""shared fixtures of the tests, the modules of the calculator are imported from the repository root"""
+
+import csv
+import os
+import random
+import sys
+
+import pytest
+
+# the repository root, where the modules of the calculator are
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# elements with every elemental property, so the parameters of their alloys are all defined
+palette = ['Al', 'Co', 'Cr', 'Fe', 'Ni', 'Ti', 'V', 'Nb', 'Mo', 'Ta', 'W', 'Zr', 'Hf', 'Cu', 'Mn', 'Si', 'Ag', 'Au',
+           'Pd', 'Mg', 'Y', 'Zn', 'Sc', 'Li', 'Pt', 'Ru', 'Rh', 'Sn', 'Ga', 'B']
+
+
+def random_compositions(count, seed=0, max_elements=8):
+    """function to return count random (element_list, mol_ratio) pairs of element symbols and mole ratios"""
+    rng = random.Random(seed)
+    compositions = []
+    for _ in range(count):
+        elements = rng.sample(palette, rng.randint(1, max_elements))
+        ratios = [rng.choice([0.1, 0.5, 1, 1, 1, 2, 3.5]) * rng.uniform(0.5, 1.5) for _ in elements]
+        compositions.append((elements, ratios))
+    return compositions
+
+
+def alloy_compositions():
+    """function to return the compositions written to the alloy_csv input, with their ratios as read back"""
+    return [(elements, [round(ratio, 4) for ratio in ratios]) for elements, ratios in random_compositions(5000, seed=1)]
+
+
+@pytest.fixture
+def alloy_csv(tmp_path):
+    """a '.csv' batch input of 5000 random alloys, in the format of 'test_dataset.xlsx'"""
+    path = str(tmp_path / 'alloys.csv')
+    with open(path, 'w', newline='') as out:
+        csv_write = csv.writer(out)
+        csv_write.writerow(['Element', 'Ratio'])
+        for elements, ratios in alloy_compositions():
+            csv_write.writerow([','.join(elements), ','.join(map(repr, ratios))])
+    return path
@@ -0,0 +1,236 @@
+"""tests of the headless batch calculator"""
+
+import csv
+import itertools
+import signal
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+import batch_calculator
+from conftest import alloy_compositions, root
+
+chunk_size = 500
+
+
+def read_csv(path):
+    with open(path, newline='') as out:
+        return list(csv.reader(out))
+
+
+def expected_rows(compositions, names=None):
+    """function to return the '.csv' output rows of compositions calculated in one go, as read back from the file"""
+    index = calculator.element_data.index
+    compositions = [([index[symbol] for symbol in elements], ratios) for elements, ratios in compositions]
+    parameters = calculator.compute_batch(compositions, names or calculator.PARAMETER_NAMES)
+    return [list(map(str, row)) for row in batch_calculator.format_rows(compositions, parameters, names)]
+
+
+def test_ratio_text_round_trips():
+    ratios = [1.0, 0.5, 2.1, 1 / 3, 1e-7, 2.5e-12, 0.1234567891, 1e20]
+    text = calculator.ratio_text(ratios)
+    assert text.startswith('1-0.5-2.1-0.3333333333333333-0.0000001-')
+    assert [float(value) for value in text.split('-')] == ratios
+    assert calculator.ratio_text([1, 2], '-') == '1-2-'
+
+
+def symbols(index):
+    return [calculator.element_data.symbols[position] for position in index]
+
+
+@pytest.mark.parametrize('elements, ratios, expected', [
+    ('AlCoCrFeNi2.1', '', (['Al', 'Co', 'Cr', 'Fe', 'Ni'], [1, 1, 1, 1, 2.1])),
+    ('Al0.5CoCrFeNi', '', (['Al', 'Co', 'Cr', 'Fe', 'Ni'], [0.5, 1, 1, 1, 1])),
+    (' Al.25Co3 ', '', (['Al', 'Co'], [0.25, 3])),
+    ('Al, Co,Cr,', '1, 2.5,3', (['Al', 'Co', 'Cr'], [1, 2.5, 3])),
+    ('Fe', '2', (['Fe'], [2])),
+    ('AlCoAl', '', (['Al', 'Co', 'Al'], [1, 1, 1])),
+])
+def test_parse_composition(elements, ratios, expected):
+    index, mol_ratio = batch_calculator.parse_composition(elements, ratios)
+    assert (symbols(index), mol_ratio) == expected
+
+
+@pytest.mark.parametrize('elements, ratios, error', [
+    ('Al,Co', '1', ValueError), ('Al-Co', '', ValueError), ('alco', '', ValueError), ('Al2.1.3', '', ValueError),
+    ('Xx', '', KeyError), ('Al,Xx', '1,1', KeyError), ('Al,Co', '1,a', ValueError),
+])
+def test_invalid_compositions(elements, ratios, error):
+    with pytest.raises(error):
+        batch_calculator.parse_composition(elements, ratios)
+
+
+def test_parse_rows():
+    rows = [['Element', 'Ratio'], [], ['', ''], ['Al,Co', '1,1'], ['AlCoCrFeNi2.1'], ['Fe,Ni', '1']]
+    parsed = batch_calculator.parse_rows(rows)
+    first, second = itertools.islice(parsed, 2)
+    assert symbols(first[0]) == ['Al', 'Co'] and symbols(second[0]) == ['Al', 'Co', 'Cr', 'Fe', 'Ni']
+    # the line number of the row is reported
+    with pytest.raises(ValueError, match='row 6 '):
+        next(parsed)
+
+
+def test_csv_and_xlsx_inputs_give_the_same_output(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    rows = [['Element', 'Ratio'], ['Al,Co,Cr', '1,2,3'], ['AlCoCrFeNi2.1', None], ['Ti,V', '0.5,1.5'], ['Al0.5CoCr']]
+    with open(str(tmp_path / 'alloys.csv'), 'w', newline='') as out:
+        csv.writer(out).writerows([['' if cell is None else cell for cell in row] for row in rows])
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(str(tmp_path / 'alloys.xlsx'))
+    for extension in ('csv', 'xlsx'):
+        assert batch_calculator.run_batch(str(tmp_path / ('alloys.' + extension)),
+                                          str(tmp_path / (extension + '.csv'))) == 4
+    assert read_bytes(str(tmp_path / 'csv.csv')) == read_bytes(str(tmp_path / 'xlsx.csv'))
+
+
+def test_csv_output_matches_compute_batch(alloy_csv, tmp_path):
+    out = str(tmp_path / 'out.csv')
+    assert batch_calculator.run_batch(alloy_csv, out, chunk_size=700) == 5000
+    rows = read_csv(out)
+    assert rows[0] == batch_calculator.OUTPUT_HEADER
+    assert rows[1:] == expected_rows(alloy_compositions())
+
+
+def test_command_line_batch(tmp_path):
+    out = str(tmp_path / 'out.csv')
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'batch', 'test_dataset.xlsx', out]
+    subprocess.run(command, cwd=root, check=True, stdout=subprocess.DEVNULL)
+    rows = read_csv(out)
+    assert rows[0] == batch_calculator.OUTPUT_HEADER
+    first = calculator.EmpiricalParams(rows[1][0].strip('-').split('-'),
+                                       [float(ratio) for ratio in rows[1][1].strip('-').split('-')])
+    assert [float(value) for value in rows[1][2:4]] == pytest.approx([first.mix_enthalpy, first.std_enthalpy])
+    # the input has no header row
+    assert len(rows) == 1 + batch_calculator.count_rows('test_dataset.xlsx')
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(chunks):
+    """function to return a progress callback raising Crash once chunks chunks are written"""
+    def progress(done):
+        if done >= chunks * chunk_size:
+            raise Crash()
+    return progress
+
+
+def read_bytes(path):
+    with open(path, 'rb') as out:
+        return out.read()
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npy'])
+def test_resumed_run_matches_uninterrupted_run(alloy_csv, tmp_path, output_format):
+    expected = str(tmp_path / ('expected.' + output_format))
+    out = str(tmp_path / ('resumed.' + output_format))
+    assert batch_calculator.run_batch(alloy_csv, expected, chunk_size=chunk_size) == 5000
+
+    with pytest.raises(Crash):
+        batch_calculator.run_batch(alloy_csv, out, chunk_size=chunk_size, progress=crash_after(2))
+    # a chunk torn by the crash, written after the last checkpoint
+    with open(out, 'ab') as torn:
+        torn.write(b'\x00Al,Co,1-1-' * 10)
+    assert batch_calculator.resumable(alloy_csv, out, output_format)
+    assert batch_calculator.run_batch(alloy_csv, out, chunk_size=chunk_size, resume=True) == 5000
+    assert not batch_calculator.resumable(alloy_csv, out, output_format)
+    assert read_bytes(out) == read_bytes(expected)
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason='needs SIGKILL')
+def test_killed_run_resumes(alloy_csv, tmp_path):
+    expected = str(tmp_path / 'expected.csv')
+    out = str(tmp_path / 'killed.csv')
+    batch_calculator.run_batch(alloy_csv, expected, chunk_size=chunk_size)
+
+    script = ('import os, signal, batch_calculator\n'
+              'def progress(done):\n'
+              '    if done >= {}:\n'
+              '        os.kill(os.getpid(), signal.SIGKILL)\n'
+              'batch_calculator.run_batch({!r}, {!r}, chunk_size={}, progress=progress)\n').format(
+        3 * chunk_size, alloy_csv, out, chunk_size)
+    killed = subprocess.run([sys.executable, '-c', script], cwd=root)
+    assert killed.returncode == -signal.SIGKILL
+
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'batch', alloy_csv, out,
+               '--chunk-size', str(chunk_size), '--resume']
+    subprocess.run(command, cwd=root, check=True, stdout=subprocess.DEVNULL)
+    assert read_bytes(out) == read_bytes(expected)
+
+
+def test_resume_needs_the_same_run(alloy_csv, tmp_path):
+    out = str(tmp_path / 'out.csv')
+    with pytest.raises(Crash):
+        batch_calculator.run_batch(alloy_csv, out, chunk_size=chunk_size, progress=crash_after(1))
+    assert not batch_calculator.resumable(alloy_csv, out, names=['delta'])
+    with pytest.raises(ValueError):
+        batch_calculator.run_batch(alloy_csv, out, chunk_size=chunk_size, resume=True, names=['delta'])
+    with open(alloy_csv, 'a') as changed:
+        changed.write('Al,Co,1,1\n')
+    assert not batch_calculator.resumable(alloy_csv, out)
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npy'])
+def test_parallel_run_matches_serial_run(alloy_csv, tmp_path, output_format):
+    serial = str(tmp_path / ('serial.' + output_format))
+    parallel = str(tmp_path / ('parallel.' + output_format))
+    batch_calculator.run_batch(alloy_csv, serial, chunk_size=chunk_size)
+    assert batch_calculator.run_batch(alloy_csv, parallel, chunk_size=chunk_size, workers=3) == 5000
+    assert read_bytes(parallel) == read_bytes(serial)
+
+
+def test_parallel_runs_with_a_cache(alloy_csv, tmp_path):
+    expected = str(tmp_path / 'expected.csv')
+    out = str(tmp_path / 'out.csv')
+    cache = str(tmp_path / 'cache.sqlite')
+    batch_calculator.run_batch(alloy_csv, expected, chunk_size=chunk_size)
+    for run in range(2):
+        cache_stats = {}
+        batch_calculator.run_batch(alloy_csv, out, chunk_size=chunk_size, workers=3, cache_path=cache,
+                                   cache_stats=cache_stats)
+        assert read_bytes(out) == read_bytes(expected)
+        # the lookups made in the worker processes are added up
+        assert sum(cache_stats.values()) == 5000
+    assert cache_stats['misses'] == 0
+
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'batch', alloy_csv, out,
+               '--workers', '2', '--cache', cache]
+    lines = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True).stdout.splitlines()
+    assert lines[-1].startswith('cache: ') and lines[-1].endswith(' 0 misses')
+
+
+def test_npy_width(tmp_path):
+    # 15 elements with 4 decimal ratios do not fit the default width
+    elements = ['Al', 'Co', 'Cr', 'Fe', 'Ni', 'Cu', 'Mn', 'Ti', 'V', 'Nb', 'Mo', 'Ta', 'W', 'Zr', 'Hf']
+    ratios = [round(0.0137 + i * 0.0613, 4) for i in range(15)]
+    in_path = str(tmp_path / 'alloys.csv')
+    with open(in_path, 'w', newline='') as out:
+        csv_write = csv.writer(out)
+        csv_write.writerow(['Element', 'Ratio'])
+        for row in range(1200):
+            size = 15 if row >= 1000 else 2 + row % 3
+            csv_write.writerow([','.join(elements[:size]), ','.join(map(repr, ratios[:size]))])
+    out = str(tmp_path / 'out.npy')
+    with pytest.raises(ValueError, match='--npy-width'):
+        batch_calculator.run_batch(in_path, out, chunk_size=chunk_size, index_path=str(tmp_path / 'index'))
+    # the run failed in its third chunk and removed what it had written
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['alloys.csv', 'index']
+    assert list((tmp_path / 'index').iterdir()) == []
+
+    expected = str(tmp_path / 'expected.npy')
+    assert batch_calculator.run_batch(in_path, expected, chunk_size=chunk_size, npy_width=128) == 1200
+    records = np.load(expected)
+    assert records.dtype['elements'].itemsize == 128
+    assert records['ratios'][-1].decode() == calculator.ratio_text(ratios)
+
+    # a resumed run keeps the width it was started with
+    with pytest.raises(Crash):
+        batch_calculator.run_batch(in_path, out, chunk_size=chunk_size, npy_width=128, progress=crash_after(1))
+    assert batch_calculator.run_batch(in_path, out, chunk_size=chunk_size, resume=True) == 1200
+    assert read_bytes(out) == read_bytes(expected)
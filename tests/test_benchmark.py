@@ -0,0 +1,23 @@
+"""tests of the benchmark suite"""
+
+import numpy as np
+import pytest
+
+import benchmark
+
+
+@pytest.mark.skipif(benchmark._memory_status() is None, reason='needs /proc')
+def test_throughput_memory_is_that_of_the_run(tmp_path):
+    # memory held by the parent must not show up in the figures of the runs
+    held = np.ones(50000000)
+    results = benchmark.bench_throughput([200, 20000], ['csv'], str(tmp_path))
+    small, large = results['csv_200'], results['csv_20000']
+    assert small['rows'] == 200 and large['rows'] == 20000
+    for result in (small, large):
+        assert result['baseline_memory_bytes'] <= result['peak_memory_bytes'] < held.nbytes
+    assert large['peak_memory_bytes'] > small['peak_memory_bytes']
+
+
+def test_synthetic_alloys_are_reproducible():
+    assert benchmark.synthetic_alloys(50, 5, seed=3) == benchmark.synthetic_alloys(50, 5, seed=3)
+    assert all(len(elements) == 5 for elements, _ in benchmark.synthetic_alloys(50, 5))
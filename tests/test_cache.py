@@ -0,0 +1,144 @@
+"""tests of the parameter cache, whose results must be those of compute_batch"""
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+import parameter_cache
+from conftest import random_compositions
+
+
+def assert_parameters_equal(actual, expected):
+    # to the bit, including the sign of zeros and nan
+    assert actual.dtype == expected.dtype
+    for name in expected.dtype.names:
+        np.testing.assert_array_equal(actual[name], expected[name], err_msg=name)
+        assert actual[name].tobytes() == expected[name].tobytes(), name
+
+
+def test_cached_parameters_match_compute_batch(tmp_path):
+    compositions = random_compositions(400, seed=4)
+    # a composition without a positive ratio sum, a repeated one and one with -0.0 parameters
+    compositions += [(['Al', 'Co'], [0, 0]), compositions[0], (['Fe'], [2])]
+    expected = calculator.compute_batch(compositions)
+    path = str(tmp_path / 'cache.sqlite')
+
+    cache = parameter_cache.ParameterCache(path=path)
+    assert cache.compute_batch(compositions[:200]).tobytes() == expected[:200].tobytes()
+    assert cache.compute_batch(compositions).tobytes() == expected.tobytes()
+    assert cache.hits + cache.misses == 603
+    cache.close()
+
+    # the values are read back from the SQLite file
+    cache = parameter_cache.ParameterCache(path=path)
+    assert_parameters_equal(cache.compute_batch(compositions), expected)
+    # the composition without a positive ratio sum is computed on every call
+    assert cache.disk_hits == 402 and cache.misses == 1
+    cache.close()
+
+
+def test_changed_element_data_empties_the_cache(tmp_path):
+    compositions = [(['Fe', 'Ni'], [1, 1])]
+    path = str(tmp_path / 'cache.sqlite')
+    cache = parameter_cache.ParameterCache(path=path)
+    before = cache.compute_batch(compositions)['price'][0]
+    price = calculator.price_dic['Fe']
+    try:
+        calculator.price_dic['Fe'] = price * 10
+        with pytest.warns(UserWarning):
+            assert cache.compute_batch(compositions)['price'][0] > before
+        assert len(cache) == 1
+    finally:
+        calculator.price_dic['Fe'] = price
+    cache.close()
+
+    with pytest.warns(UserWarning):
+        cache = parameter_cache.ParameterCache(path=path)
+    np.testing.assert_equal(cache.compute_batch(compositions)['price'][0], before)
+    assert cache.misses == 1
+    cache.close()
+
+
+def test_composition_key():
+    key = parameter_cache.composition_key(['Co', 'Al', 'Co'], [1, 2, 1])
+    assert key == parameter_cache.composition_key(['Al', 'Co'], [0.5, 0.5]) == 'Al:0.500000,Co:0.500000'
+    for ratios in ([0, 0], [1, -1], [1e308, 1e308]):
+        assert parameter_cache.composition_key(['Al', 'Co'], ratios) is None
+
+
+def test_memory_is_bounded():
+    compositions = [(['Al', 'Co'], [1, ratio]) for ratio in range(1, 51)]
+    cache = parameter_cache.ParameterCache(max_size=10)
+    cache.compute_batch(compositions)
+    assert len(cache) == 10
+    # the most recently used compositions are kept
+    cache.compute_batch(compositions[-5:])
+    assert cache.hits == 5
+
+
+@pytest.mark.parametrize('names', [('delta', 'k', 'std_k'), ('omega', 'price')])
+def test_cached_selection_matches_compute_batch(tmp_path, names):
+    compositions = random_compositions(300, seed=6)
+    path = str(tmp_path / 'cache.sqlite')
+    cache = parameter_cache.ParameterCache(path=path)
+    assert_parameters_equal(cache.compute_batch(compositions, names), calculator.compute_batch(compositions, names))
+    cache.close()
+
+    # a wider selection computes only the parameters that are missing
+    cache = parameter_cache.ParameterCache(path=path)
+    wider = tuple(calculator.PARAMETER_NAMES) + ('k',)
+    assert_parameters_equal(cache.compute_batch(compositions, wider), calculator.compute_batch(compositions, wider))
+    cache.close()
+
+
+def test_redefined_parameter_is_recomputed(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    compositions = [(['Al', 'Co'], [1, 3])]
+    try:
+        calculator.register_parameter('mass', 'mean', 'atomic_mass')
+        parameter_cache.ParameterCache(path=path).compute_batch(compositions, ['mass'])
+        calculator.register_parameter('mass', 'std', 'atomic_mass')
+        cache = parameter_cache.ParameterCache(path=path)
+        assert_parameters_equal(cache.compute_batch(compositions, ['mass']),
+                                calculator.compute_batch(compositions, ['mass']))
+        assert cache.misses == 1
+    finally:
+        del calculator.parameter_registry['mass']
+
+
+def _share_cache(path, names, barrier, errors):
+    """function run by the processes of test_processes_share_a_cache: they open the cache together and fill it with
+    the parameters of names"""
+    try:
+        barrier.wait()
+        cache = parameter_cache.ParameterCache(path=path)
+        cache.compute_batch(random_compositions(200, seed=7), names)
+        cache.close()
+    except Exception as error:
+        errors.put(repr(error))
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_processes_share_a_cache(tmp_path):
+    context = multiprocessing.get_context('fork')
+    selections = [calculator.PARAMETER_NAMES, ('delta', 'k'), ('omega', 'price', 'std_k'), ('vec', 'a')]
+    for run in range(3):
+        path = str(tmp_path / 'cache{}.sqlite'.format(run))
+        barrier = context.Barrier(8)
+        errors = context.Queue()
+        processes = [context.Process(target=_share_cache, args=(path, selections[i % 4], barrier, errors))
+                     for i in range(8)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert errors.empty(), errors.get()
+
+        compositions = random_compositions(200, seed=7)
+        names = tuple(calculator.PARAMETER_NAMES) + ('k', 'std_k')
+        cache = parameter_cache.ParameterCache(path=path)
+        assert_parameters_equal(cache.compute_batch(compositions, names), calculator.compute_batch(compositions, names))
+        assert cache.misses == 0
+        cache.close()
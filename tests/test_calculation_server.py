@@ -0,0 +1,119 @@
+"""tests of the JSON over HTTP calculation service"""
+
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import threading
+
+import pytest
+
+import empirical_parameter_calculator as calculator
+import batch_calculator
+import calculation_server
+
+
+@pytest.fixture
+def server():
+    """a calculation server on a free local port, run by an event loop in a background thread"""
+    loop = asyncio.new_event_loop()
+    service = calculation_server.CalculationServer(max_delay=0.002)
+    listener = loop.run_until_complete(service.start('127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield service, listener.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    listener.close()
+    loop.run_until_complete(listener.wait_closed())
+    loop.run_until_complete(service.batcher.stop())
+    loop.close()
+
+
+def request(port, method, path, body=None, connection=None):
+    """function to return the status and JSON response of a request to the server"""
+    connection = connection or http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request(method, path, body=None if body is None else json.dumps(body))
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def expected_parameters(*formulas):
+    compositions = [batch_calculator.parse_composition(formula) for formula in formulas]
+    return calculation_server.parameter_dicts(calculator.compute_batch(compositions))
+
+
+def test_single_and_bulk_requests(server):
+    _, port = server
+    status, response = request(port, 'POST', '/parameters', {'formula': 'AlCoCrFeNi2.1'})
+    assert status == 200 and response['parameters'] == expected_parameters('AlCoCrFeNi2.1')[0]
+
+    alloys = [{'formula': 'AlCoCrFeNi'}, {'elements': 'Ti,V', 'ratios': '1,2'}, 'AlPm',
+              {'elements': ['Al', 'Co', 'Cr'], 'ratios': [0.5, 1, 1]}, {'elements': ['Fe', 'Ni']}]
+    status, response = request(port, 'POST', '/parameters', {'alloys': alloys})
+    assert status == 200
+    assert response['results'] == expected_parameters('AlCoCrFeNi', 'TiV2', 'AlPm', 'Al0.5CoCr', 'FeNi')
+    # Pm has no price, which JSON has no nan for
+    assert response['results'][2]['price'] is None
+
+    status, response = request(port, 'POST', '/parameters', {'alloys': []})
+    assert status == 200 and response['results'] == []
+
+
+@pytest.mark.parametrize('method, path, body, status', [
+    ('POST', '/parameters', {'formula': 'AlXx'}, 400),
+    ('POST', '/parameters', {'elements': 'Al,Co', 'ratios': '1'}, 400),
+    ('POST', '/parameters', {'alloys': 'AlCo'}, 400),
+    ('POST', '/parameters', [1], 400),
+    ('GET', '/parameters', None, 405),
+    ('POST', '/metrics', None, 405),
+    ('GET', '/unknown', None, 404),
+])
+def test_invalid_requests(server, method, path, body, status):
+    assert request(server[1], method, path, body)[0] == status
+
+
+def test_malformed_json(server):
+    connection = http.client.HTTPConnection('127.0.0.1', server[1], timeout=10)
+    connection.request('POST', '/parameters', body=b'{"formula": ')
+    response = connection.getresponse()
+    assert response.status == 400 and 'error' in json.loads(response.read())
+
+
+def test_concurrent_requests(server):
+    _, port = server
+    formulas = ['Al{}CoCrFeNi'.format(0.1 * i) for i in range(1, 41)]
+
+    def calculate(formula):
+        # every client keeps its connection alive for two requests
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        first = request(port, 'POST', '/parameters', {'formula': formula}, connection)[1]['parameters']
+        second = request(port, 'POST', '/parameters', {'alloys': [formula]}, connection)[1]['results'][0]
+        connection.close()
+        return first, second
+
+    with concurrent.futures.ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(calculate, formulas))
+    for (first, second), expected in zip(results, expected_parameters(*formulas)):
+        assert first == second == expected
+
+    status, metrics = request(port, 'GET', '/metrics')
+    assert status == 200 and metrics['requests'] == 80 and metrics['alloys'] == 80 and metrics['errors'] == 0
+    assert metrics['mean_batch_size'] * metrics['batches'] == pytest.approx(80)
+    assert metrics['latency_seconds']['p50'] <= metrics['latency_seconds']['max']
+    assert request(port, 'GET', '/health') == (200, {'status': 'ok'})
+
+
+def test_concurrent_submissions_are_batched_together():
+    async def run():
+        batcher = calculation_server.MicroBatcher(max_delay=0)
+        batcher.start()
+        compositions = [[batch_calculator.parse_composition(formula)] for formula in ('AlCo', 'FeNi', 'TiV2')]
+        results = await asyncio.gather(*[batcher.submit(items) for items in compositions])
+        await batcher.stop()
+        return batcher.metrics, results
+
+    metrics, results = asyncio.run(run())
+    assert metrics.batches == 1 and metrics.batched_alloys == 3
+    assert [calculation_server.parameter_dicts(parameters)[0] for parameters in results] == expected_parameters(
+        'AlCo', 'FeNi', 'TiV2')
@@ -0,0 +1,99 @@
+"""tests of the composition space enumeration and screening"""
+
+import csv
+import itertools
+import math
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+import batch_calculator
+import composition_generator
+from conftest import root
+
+
+def full_lattice(num_elements, units):
+    """function to return every molar fraction vector of the simplex lattice, enumerated one by one"""
+    points = [point for point in itertools.product(range(units + 1), repeat=num_elements) if sum(point) == units]
+    return np.array(points) / units
+
+
+def test_simplex_lattice():
+    lattice = np.concatenate(list(composition_generator.simplex_lattice(4, 0.1)))
+    assert len(lattice) == math.comb(13, 3)
+    np.testing.assert_allclose(lattice.sum(axis=1), 1)
+    assert len(np.unique(lattice, axis=0)) == len(lattice)
+
+    lower = [0.1, 0, 0.2, 0]
+    upper = [0.5, 0.3, 1, 1]
+    bounded = np.concatenate(list(composition_generator.simplex_lattice(4, 0.1, lower, upper)))
+    expected = full_lattice(4, 10)
+    expected = expected[np.all((expected >= np.array(lower) - 1e-9) & (expected <= np.array(upper) + 1e-9), axis=1)]
+    assert sorted(map(tuple, np.round(bounded, 9))) == sorted(map(tuple, np.round(expected, 9)))
+
+
+@pytest.mark.parametrize('step', [0, 1.5, 0.3])
+def test_invalid_step(step):
+    with pytest.raises(ValueError):
+        list(composition_generator.simplex_lattice(3, step))
+
+
+def test_screen_matches_evaluating_every_alloy():
+    elements = ['Al', 'Co', 'Cr', 'Fe', 'Ni', 'Ti']
+    thresholds = {'delta': (None, 0.066), 'omega': (1.1, None), 'vec': (7.5, 8.5)}
+    bounds = {'Al': (0.05, 0.2)}
+    screened = set()
+    for index, fractions, parameters in composition_generator.screen_compositions(elements, 4, 0.05, bounds,
+                                                                                  thresholds, ['vec', 'price']):
+        assert parameters.dtype.names == ('vec', 'price')
+        np.testing.assert_array_equal(parameters['vec'], calculator.compute_batch_matrix(fractions, index)['vec'])
+        screened.update((tuple(index), tuple(row)) for row in np.round(fractions, 9).tolist())
+
+    expected = set()
+    for combination in itertools.combinations(elements, 4):
+        index = calculator.element_data.indices(combination)
+        # elements without bounds range from one step to 1
+        lower, upper = np.transpose([bounds.get(element, (0.05, 1)) for element in combination])
+        fractions = full_lattice(4, 20)
+        fractions = fractions[np.all((fractions >= lower - 1e-9) & (fractions <= upper + 1e-9), axis=1)]
+        parameters = calculator.compute_batch_matrix(fractions, index)
+        passing = np.ones(len(fractions), dtype=bool)
+        for name, (minimum, maximum) in thresholds.items():
+            passing &= ~np.isnan(parameters[name])
+            if minimum is not None:
+                passing &= parameters[name] >= minimum
+            if maximum is not None:
+                passing &= parameters[name] <= maximum
+        expected.update((tuple(index.tolist()), tuple(row)) for row in np.round(fractions[passing], 9).tolist())
+    assert len(expected) > 0 and screened == expected
+
+
+def test_missing_parameters_do_not_pass():
+    # Db has no melting point, so no omega
+    parameters = calculator.compute_batch([(['Al', 'Db'], [1, 1]), (['Al', 'Co'], [1, 1])])
+    mask = composition_generator.passes_thresholds(parameters, {'omega': (None, None), 'vec': (None, 10)})
+    assert mask.tolist() == [False, True]
+
+
+def test_screen_command(tmp_path):
+    out = str(tmp_path / 'survivors.csv')
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'screen', out, '--elements',
+               'Al,Co,Cr,Fe,Ni', '--size', '3', '--step', '0.1', '--bound', 'Al=0:0.2', '--max', 'delta=0.05']
+    lines = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True).stdout.splitlines()
+    with open(out, newline='') as survivors:
+        rows = list(csv.reader(survivors))
+    assert rows[0] == batch_calculator.OUTPUT_HEADER
+    assert lines[-1] == '{} alloys written to {}'.format(len(rows) - 1, out)
+    for row in rows[1:]:
+        elements = row[0].strip('-').split('-')
+        ratios = [float(ratio) for ratio in row[1].strip('-').split('-')]
+        assert len(elements) == 3 and float(row[4]) < 5
+        if 'Al' in elements:
+            assert ratios[elements.index('Al')] <= 0.2
+
+    command[-2:] = ['--max', 'unknown=1']
+    failed = subprocess.run(command, cwd=root, capture_output=True, text=True)
+    assert failed.returncode == 2 and 'unknown parameter unknown' in failed.stderr
@@ -0,0 +1,82 @@
+"""tests of the composition optimizer and its analytic gradients"""
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+import composition_generator
+import composition_optimizer
+from conftest import root
+
+elements = ['Al', 'Co', 'Cr', 'Fe', 'Ni']
+
+
+def test_gradients_match_finite_differences():
+    index = calculator.element_data.indices(elements)
+    rng = np.random.default_rng(8)
+    fractions = rng.dirichlet(np.ones(len(index)), 20)
+    gradients = composition_optimizer.parameter_gradients(fractions, index)
+    step = 1e-6
+    for direction in rng.dirichlet(np.ones(len(index)), 3) - 1 / len(index):
+        forward = calculator.compute_batch_matrix(fractions + step * direction, index)
+        backward = calculator.compute_batch_matrix(fractions - step * direction, index)
+        for name in composition_optimizer.gradient_names:
+            numeric = (forward[name] - backward[name]) / (2 * step)
+            np.testing.assert_allclose(gradients[name] @ direction, numeric, rtol=1e-4, atol=1e-6, err_msg=name)
+
+
+def test_projection_onto_the_bounded_simplex():
+    points = np.random.default_rng(9).normal(size=(100, 4))
+    lower = np.array([0, 0.1, 0, 0.2])
+    upper = np.array([1, 0.3, 0.5, 1])
+    projected = composition_optimizer.project_simplex(points, lower, upper)
+    np.testing.assert_allclose(projected.sum(axis=1), 1)
+    assert (projected >= lower - 1e-12).all() and (projected <= upper + 1e-12).all()
+
+
+def test_pareto_mask():
+    objectives = np.array([[1, 3], [2, 2], [3, 1], [2, 3], [3, 3], [1, 3]])
+    assert composition_optimizer.pareto_mask(objectives).tolist() == [True, True, True, False, False, True]
+
+
+def test_optimized_alloys_satisfy_the_constraints():
+    constraints = {'vec': (7.5, 8.5), 'delta': (None, 0.05)}
+    bounds = {'Al': (0, 0.2)}
+    index, fractions, parameters = composition_optimizer.optimize_compositions(
+        elements, {'price': 'min', 'omega': 'max'}, constraints, bounds, starts=64, iterations=100, decimals=3)
+    assert len(fractions) > 0
+    np.testing.assert_allclose(fractions.sum(axis=1), 1, atol=1e-9)
+    assert (fractions[:, elements.index('Al')] <= 0.2).all()
+    assert composition_generator.passes_thresholds(parameters, constraints).all()
+    objectives = np.column_stack([parameters['price'], -parameters['omega']])
+    assert composition_optimizer.pareto_mask(objectives).all()
+    assert np.all(np.diff(parameters['price']) >= 0)
+
+
+def test_optimum_is_not_worse_than_a_lattice():
+    constraints = {'vec': (7.5, 8.5), 'delta': (None, 0.05)}
+    bounds = {element: (0, 0.2 if element == 'Al' else 1) for element in elements}
+    _, _, parameters = composition_optimizer.optimize_compositions(elements, {'price': 'min'}, constraints, bounds)
+    cheapest = min(lattice['price'].min() for _, _, lattice in composition_generator.screen_compositions(
+        elements, len(elements), 0.05, bounds=bounds, thresholds=constraints, names=['price']))
+    assert parameters['price'][0] <= cheapest * 1.01
+
+
+def test_only_parameters_with_gradients_are_optimized(tmp_path):
+    with pytest.raises(ValueError, match='cannot be optimized'):
+        composition_optimizer.optimize_compositions(elements, {'k': 'min'})
+    with pytest.raises(ValueError, match='cannot be optimized'):
+        composition_optimizer.optimize_compositions(elements, {'price': 'min'}, {'k': (None, 100)})
+
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'optimize', str(tmp_path / 'out.csv'),
+               '--elements', ','.join(elements), '--minimize', 'k']
+    failed = subprocess.run(command, cwd=root, capture_output=True, text=True)
+    assert failed.returncode == 2
+    assert 'k cannot be optimized, only the parameters with gradients can: ' in failed.stderr
+
+    command[-2:] = ['--minimize', 'price', '--max', 'k=100']
+    failed = subprocess.run(command, cwd=root, capture_output=True, text=True)
+    assert failed.returncode == 2 and 'k cannot be optimized' in failed.stderr
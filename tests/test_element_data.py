@@ -0,0 +1,45 @@
+"""tests of the shared element property table"""
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import empirical_parameter_calculator as calculator
+
+
+def test_valence_electrons_of_transition_metals():
+    valence = calculator.element_data.valence_electrons
+    for symbol, expected in [('Pd', 10), ('Ni', 10), ('Pt', 10), ('Cu', 11), ('Fe', 8), ('Zn', 12), ('Al', 3)]:
+        assert valence[calculator.element_data.index[symbol]] == expected
+    np.testing.assert_allclose(calculator.EmpiricalParams(['Ag', 'Au', 'Cu', 'Pd', 'Si']).vec, 9.4)
+
+
+def test_import_does_not_load_pymatgen():
+    script = 'import sys, empirical_parameter_calculator; print(sorted({"pymatgen", "matminer"} & set(sys.modules)))'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True,
+                          check=True).stdout.strip() == '[]'
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'element_data.npz')
+    calculator.element_data.save_snapshot(path)
+    table = calculator.ElementPropertyTable.from_snapshot(path)
+    assert table.symbols == calculator.element_data.symbols
+    assert table.fingerprint() == calculator.element_data.fingerprint()
+
+
+def test_price_dic_changes_take_effect():
+    fingerprint = calculator.element_data.fingerprint()
+    price = calculator.price_dic['Fe']
+    try:
+        calculator.price_dic['Fe'] = 1000
+        assert calculator.EmpiricalParams(['Fe'], [1]).price == '1000.00'
+        assert calculator.compute_batch([(['Fe'], [1])])['price'][0] == 1000
+        assert calculator.element_data.fingerprint() != fingerprint
+    finally:
+        calculator.price_dic['Fe'] = price
+    assert calculator.EmpiricalParams(['Fe'], [1]).price == '0.08'
+    assert calculator.element_data.fingerprint() == fingerprint
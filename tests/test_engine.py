@@ -0,0 +1,74 @@
+"""tests of the vectorized engine against EmpiricalParams"""
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+from conftest import random_compositions
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_compute_batch_matches_empirical_params(seed):
+    compositions = random_compositions(300, seed=seed)
+    names = calculator.PARAMETER_NAMES
+    parameters = calculator.compute_batch(compositions)
+    for i, (elements, ratios) in enumerate(compositions):
+        alloy = calculator.EmpiricalParams(elements, ratios)
+        for name in names:
+            if name == 'price':
+                assert format(parameters[name][i], '.2f') == alloy.price
+            else:
+                np.testing.assert_allclose(parameters[name][i], getattr(alloy, name), rtol=1e-9, atol=1e-9,
+                                           err_msg='{} of {}'.format(name, elements))
+
+
+def test_repeated_elements_are_merged():
+    merged = calculator.compute_batch([(['Al', 'Co', 'Al'], [1, 2, 1])])
+    single = calculator.compute_batch([(['Al', 'Co'], [2, 2])])
+    for name in calculator.PARAMETER_NAMES:
+        np.testing.assert_allclose(merged[name], single[name], rtol=1e-12)
+
+
+@pytest.mark.parametrize('ratios', [[0, 0], [1, -1], [-1, -2], [1e308, 1e308], [np.inf, 1], [np.nan, 1]])
+def test_ratios_without_a_positive_finite_sum_give_nan(ratios):
+    parameters = calculator.compute_batch([(['Al', 'Co'], ratios), (['Fe', 'Ni'], [1, 1])])
+    for name in calculator.PARAMETER_NAMES:
+        assert np.isnan(parameters[name][0])
+        assert not np.isnan(parameters[name][1])
+
+
+def test_missing_elemental_data_gives_nan():
+    # Db has no melting point, Pm no price
+    parameters = calculator.compute_batch([(['Al', 'Db'], [1, 1]), (['Al', 'Pm'], [1, 1])])
+    assert np.isnan(parameters['Tm'][0]) and np.isnan(parameters['omega'][0])
+    assert np.isnan(parameters['price'][1]) and not np.isnan(parameters['Tm'][1])
+    assert calculator.EmpiricalParams(['Al', 'Pm'], [1, 1]).price == 'unknown'
+
+
+def test_result_does_not_depend_on_the_batch():
+    # the alloys computed alone have no zero padded slots, those of the batch up to 7
+    compositions = random_compositions(500, seed=3)
+    together = calculator.compute_batch(compositions)
+    alone = np.concatenate([calculator.compute_batch([composition]) for composition in compositions[:50]])
+    assert together[:50].tobytes() == alone.tobytes()
+
+
+def test_registered_parameter():
+    try:
+        calculator.register_parameter('mass', 'mean', 'atomic_mass')
+        parameters = calculator.compute_batch([(['Al', 'Co'], [1, 3])], names=['mass', 'vec'])
+        expected = (calculator.element_data.atomic_mass[12] + 3 * calculator.element_data.atomic_mass[26]) / 4
+        np.testing.assert_allclose(parameters['mass'][0], expected, rtol=1e-12)
+        np.testing.assert_allclose(calculator.EmpiricalParams(['Al', 'Co'], [1, 3]).mass, expected, rtol=1e-12)
+    finally:
+        del calculator.parameter_registry['mass']
+    with pytest.raises(ValueError):
+        calculator.compute_batch([(['Al'], [1])], names=['mass'])
+
+
+def test_bulk_modulus_matches_empirical_params():
+    compositions = random_compositions(100, seed=8)
+    parameters = calculator.compute_batch(compositions, ['k', 'std_k'])
+    for i, (elements, ratios) in enumerate(compositions):
+        alloy = calculator.EmpiricalParams(elements, ratios)
+        np.testing.assert_allclose([parameters['k'][i], parameters['std_k'][i]], [alloy.k, alloy.std_k], rtol=1e-9)
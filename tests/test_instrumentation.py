@@ -0,0 +1,99 @@
+"""tests of the opt-in instrumentation of the calculator and the batch pipeline"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+import empirical_parameter_calculator as calculator
+import batch_calculator
+import instrumentation
+from conftest import root
+from test_batch_calculator import read_bytes
+
+
+@pytest.fixture
+def profiling():
+    """function enabling instrumentation, which is turned off again after the test"""
+    yield instrumentation.enable
+    instrumentation.disable()
+
+
+def test_hooks_do_nothing_while_disabled():
+    methods = {name: calculator.EmpiricalParams.__dict__[name] for name in instrumentation.instrumented_methods}
+    assert instrumentation.active is None
+    rows = [1, 2]
+    assert instrumentation.iterate('stage', rows) is rows
+    with instrumentation.stage('stage'):
+        pass
+
+    instrumentation.enable()
+    assert calculator.EmpiricalParams.__dict__['calc_price'] is not methods['calc_price']
+    assert instrumentation.disable() is not None
+    assert {name: calculator.EmpiricalParams.__dict__[name] for name in methods} == methods
+    assert instrumentation.disable() is None
+
+
+def test_empirical_params_methods_are_counted(profiling):
+    expected = calculator.EmpiricalParams(['Al', 'Co', 'Cr'], [1, 2, 3])
+    expected = [getattr(expected, name) for name in calculator.PARAMETER_NAMES]
+    profiler = profiling()
+    alloy = calculator.EmpiricalParams(['Al', 'Co', 'Cr'], [1, 2, 3])
+    assert [getattr(alloy, name) for name in calculator.PARAMETER_NAMES] == expected
+    assert profiler.calls['EmpiricalParams.__init__'] == 1
+    assert set(profiler.calls) <= {'EmpiricalParams.' + name for name in instrumentation.instrumented_methods}
+    assert profiler.calls['EmpiricalParams.std_enthalpy_mixing'] > 0
+    # the cached parameters are computed once
+    alloy.omega
+    assert profiler.calls['EmpiricalParams.calc_omega'] == 1
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_stages_are_recorded(alloy_csv, tmp_path, profiling, workers):
+    expected = str(tmp_path / 'expected.csv')
+    out = str(tmp_path / 'out.csv')
+    batch_calculator.run_batch(alloy_csv, expected, chunk_size=1000)
+
+    profiler = profiling(sample_rate=0.01, slowest=5)
+    batch_calculator.run_batch(alloy_csv, out, chunk_size=1000, workers=workers)
+    assert read_bytes(out) == read_bytes(expected)
+    summary = profiler.summary()
+    # the 5000 alloys and the header row make 6 chunks, the stages of the worker processes are merged chunk by chunk
+    for name in ('batch.read', 'batch.parse', 'batch.compute', 'batch.format', 'batch.write', 'batch.checkpoint',
+                 'compute_batch_matrix.delta'):
+        assert summary['stages'][name]['calls'] == 6, name
+    assert 0 < summary['sampled_rows'] < 200 and len(summary['slow_rows']) == 5
+    seconds = [row['seconds'] for row in summary['slow_rows']]
+    assert seconds == sorted(seconds, reverse=True)
+
+    table = profiler.table()
+    assert table.splitlines()[0].split() == ['stage', 'calls', 'total', '(s)', 'mean', '(ms)', 'max', '(ms)']
+    assert 'batch.compute' in table and 'slowest of {} sampled rows'.format(summary['sampled_rows']) in table
+
+
+def test_merge_adds_up_profilers():
+    first = instrumentation.Profiler(slowest=2)
+    second = instrumentation.Profiler(slowest=2)
+    first.record('stage', 1.0)
+    second.record('stage', 3.0)
+    second.record('other', 0.5)
+    first.slow_rows = [(1.0, 1, 'Al-Co', '1-1')]
+    second.slow_rows = [(2.0, 5, 'Fe-Ni', '1-1'), (3.0, 9, 'Ti-V', '1-2')]
+    first.merge(json.loads(json.dumps(second.export())))
+    stages = first.summary()['stages']
+    assert list(stages) == ['stage', 'other']
+    assert stages['stage'] == {'calls': 2, 'seconds': 4.0, 'mean_seconds': 2.0, 'max_seconds': 3.0}
+    assert [row['chunk_start_line'] for row in first.summary()['slow_rows']] == [9, 5]
+
+
+def test_profile_command(alloy_csv, tmp_path):
+    report = str(tmp_path / 'profile.json')
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'batch', alloy_csv, str(tmp_path / 'out.csv'),
+               '--profile-json', report, '--profile-sample', '0.001']
+    finished = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True)
+    assert finished.stderr.splitlines()[0].split()[0] == 'stage'
+    with open(report) as profile:
+        summary = json.load(profile)
+    assert summary['stages']['batch.run']['calls'] == 1
+    assert 0 < len(summary['slow_rows']) <= min(10, summary['sampled_rows'])
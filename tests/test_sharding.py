@@ -0,0 +1,53 @@
+"""tests of sharded batch runs, whose merged output must be that of a single run"""
+
+import os
+
+import numpy as np
+import pytest
+
+import batch_calculator
+import sharding
+from test_batch_calculator import Crash, chunk_size, crash_after, read_bytes
+
+
+@pytest.mark.parametrize('method', ['bytes', 'rows'])
+@pytest.mark.parametrize('output_format', ['csv', 'npy'])
+def test_merged_shards_match_single_run(alloy_csv, tmp_path, method, output_format):
+    expected = str(tmp_path / ('expected.' + output_format))
+    out = str(tmp_path / ('sharded.' + output_format))
+    batch_calculator.run_batch(alloy_csv, expected, chunk_size=chunk_size)
+
+    manifest = sharding.plan(alloy_csv, out, shards=3, method=method, chunk_size=chunk_size)
+    # shards run in any order, one of them interrupted and resumed
+    with pytest.raises(Crash):
+        sharding.run_shard(out, 1, progress=crash_after(1))
+    assert sharding.status(out) == ['pending', 'started', 'pending']
+    with pytest.raises(ValueError):
+        sharding.merge(out)
+    for shard in (2, 1, 0):
+        sharding.run_shard(out, shard, resume=True)
+    assert sharding.merge(out, clean=True) == 5000
+    assert not os.path.exists(sharding.shard_directory(out))
+    assert len(manifest['shards']) == 3
+    assert read_bytes(out) == read_bytes(expected)
+
+
+def test_merged_parquet_shards_match_single_run(alloy_csv, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    expected = str(tmp_path / 'expected.parquet')
+    out = str(tmp_path / 'sharded.parquet')
+    batch_calculator.run_batch(alloy_csv, expected, chunk_size=chunk_size)
+
+    sharding.plan(alloy_csv, out, shards=4, chunk_size=chunk_size)
+    for shard in range(4):
+        sharding.run_shard(out, shard)
+    sharding.merge(out)
+    single = parquet.read_table(expected)
+    merged = parquet.read_table(out)
+    assert merged.schema == single.schema
+    for name in single.column_names:
+        values = single.column(name).to_numpy(zero_copy_only=False)
+        if values.dtype.kind == 'f':
+            np.testing.assert_array_equal(merged.column(name).to_numpy(), values)
+        else:
+            assert merged.column(name).to_pylist() == single.column(name).to_pylist()
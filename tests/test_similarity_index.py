@@ -0,0 +1,86 @@
+"""tests of the similarity index over the parameters of an alloy library"""
+
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+import batch_calculator
+import similarity_index
+from conftest import random_compositions, root
+
+pytest.importorskip('scipy')
+
+
+@pytest.fixture
+def library(alloy_csv, tmp_path):
+    """the '.npy' library of the alloy_csv alloys, with an index over all its parameters"""
+    path = str(tmp_path / 'library.npy')
+    batch_calculator.run_batch(alloy_csv, path, index_path=str(tmp_path / 'index'))
+    return path
+
+
+def test_query_finds_the_nearest_alloys(library, tmp_path):
+    index = similarity_index.SimilarityIndex(str(tmp_path / 'index'))
+    records = np.load(library)
+    complete = np.flatnonzero(~np.isnan(similarity_index._parameter_matrix(records, index.names)).any(axis=1))
+    assert len(index) == len(complete)
+
+    queries = calculator.compute_batch(random_compositions(20, seed=10))
+    distances, rows = index.query(queries, k=5)
+    vectors = index.normalize(records[complete])
+    for query, vector in enumerate(index.normalize(queries)):
+        brute = np.linalg.norm(vectors - vector, axis=1)
+        order = np.argsort(brute, kind='stable')[:5]
+        np.testing.assert_allclose(distances[query], brute[order], rtol=1e-9)
+        assert records[rows[query][0]]['elements'] == records[complete[order[0]]]['elements']
+
+    (within, found), = index.query_radius(queries[:1], distances[0][2])
+    assert len(found) >= 3 and (within <= distances[0][2]).all()
+
+
+def test_heavy_tailed_parameters_are_not_flattened(library, tmp_path):
+    # the enthalpy clamp gives omega values up to 1e7 against a median below 1
+    omega = np.load(library)['omega']
+    assert np.nanmax(omega) > 1e6 * np.nanmedian(omega)
+
+    names = ['delta', 'omega', 'vec']
+    queries = calculator.compute_batch(random_compositions(50, seed=11), names)
+    neighbours = {}
+    for subset in [names] + [[name for name in names if name != left_out] for left_out in names]:
+        path = str(tmp_path / '-'.join(subset))
+        similarity_index.build_index(path, library, subset)
+        neighbours[tuple(subset)] = similarity_index.SimilarityIndex(path).query(queries, k=5)[1]
+    # leaving out any of the parameters changes the neighbours of most query alloys
+    for subset, rows in neighbours.items():
+        if len(subset) < len(names):
+            assert (rows != neighbours[tuple(names)]).any(axis=1).mean() > 0.5, subset
+
+
+def test_scale_is_estimated_from_a_sample(library, tmp_path, monkeypatch):
+    similarity_index.build_index(str(tmp_path / 'full'), library)
+    monkeypatch.setattr(similarity_index, '_sample_size', 1000)
+    similarity_index.build_index(str(tmp_path / 'sample'), library)
+    full, sample = [similarity_index.SimilarityIndex(str(tmp_path / name)) for name in ('full', 'sample')]
+    assert len(full) == len(sample)
+    np.testing.assert_allclose(sample.scale, full.scale, rtol=0.2)
+
+
+def test_nearest_command(library, tmp_path):
+    command = [sys.executable, '-m', 'empirical_parameter_calculator', 'nearest', str(tmp_path / 'index'),
+               'AlCoCrFeNi2.1', '-k', '3']
+    lines = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True).stdout.splitlines()
+    assert lines[0] == 'AlCoCrFeNi2.1' and len(lines) == 4
+
+    description = os.path.join(str(tmp_path / 'index'), 'index.json')
+    with open(description) as meta:
+        state = json.load(meta)
+    state['version'] = 1
+    with open(description, 'w') as meta:
+        json.dump(state, meta)
+    failed = subprocess.run(command, cwd=root, capture_output=True, text=True)
+    assert failed.returncode == 2 and 'rebuild it' in failed.stderr
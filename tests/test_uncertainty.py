@@ -0,0 +1,62 @@
+"""tests of the Monte Carlo propagation of composition tolerances"""
+
+import csv
+
+import numpy as np
+import pytest
+
+import empirical_parameter_calculator as calculator
+import uncertainty
+from conftest import random_compositions
+
+
+def test_perturbed_compositions():
+    fractions = np.array([[1, 1, 0, 2], [0, 3, 1, 0]], dtype=np.float64)
+    for method in uncertainty.methods:
+        samples = uncertainty.perturb(fractions, 2000, 0.02, method, np.random.default_rng(0))
+        assert samples.shape == (4000, 4)
+        np.testing.assert_allclose(samples.sum(axis=1), 1)
+        assert ((samples > 0) == np.repeat(fractions > 0, 2000, axis=0)).all()
+        nominal = fractions / fractions.sum(axis=1, keepdims=True)
+        spread = samples.reshape(2, 2000, 4).std(axis=1)[nominal > 0]
+        assert (spread > 0.005).all() and (spread < 0.03).all()
+        np.testing.assert_allclose(samples.reshape(2, 2000, 4).mean(axis=1), nominal, atol=0.005)
+
+
+def test_zero_tolerance_gives_the_nominal_parameters():
+    compositions = random_compositions(20, seed=12)
+    statistics = uncertainty.propagate_compositions(compositions, samples=5, tolerance=0, seed=0)
+    nominal = calculator.compute_batch(compositions)
+    for name in calculator.PARAMETER_NAMES:
+        np.testing.assert_allclose(statistics['{}:mean'.format(name)], nominal[name], rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(statistics['{}:std'.format(name)], 0, atol=1e-9 * np.abs(nominal[name]).max())
+
+
+@pytest.mark.parametrize('tolerance, method', [(-0.01, 'uniform'), (np.nan, 'uniform'), (np.inf, 'dirichlet'),
+                                               (0, 'dirichlet')])
+def test_invalid_tolerance(tolerance, method, tmp_path):
+    with pytest.raises(ValueError, match='tolerance'):
+        uncertainty.propagate_compositions([(['Al', 'Co'], [1, 1])], samples=5, tolerance=tolerance, method=method)
+    with pytest.raises(ValueError, match='tolerance'):
+        uncertainty.run_uncertainty(str(tmp_path / 'missing.csv'), str(tmp_path / 'out.csv'), tolerance=tolerance,
+                                    method=method)
+    assert not (tmp_path / 'out.csv').exists()
+
+
+def test_statistics_do_not_clash_with_parameter_names():
+    fields = uncertainty.summary_dtype(['vec', 'vec_std']).names
+    assert len(set(fields)) == len(fields)
+    assert not set(fields) & set(calculator.parameter_registry)
+    assert fields[:3] == ('vec:mean', 'vec:std', 'vec:p5')
+
+
+def test_run_does_not_depend_on_the_workers(alloy_csv, tmp_path):
+    outputs = []
+    for workers in (1, 2):
+        out = str(tmp_path / 'spread{}.csv'.format(workers))
+        assert uncertainty.run_uncertainty(alloy_csv, out, samples=20, names=['delta', 'vec', 'vec_std'],
+                                           chunk_size=1000, workers=workers) == 5000
+        with open(out, newline='') as spread:
+            outputs.append(list(csv.reader(spread)))
+    assert outputs[0] == outputs[1]
+    assert outputs[0][0][:5] == ['Elements', 'Molar_ratios', 'delta:mean', 'delta:std', 'delta:p5']
@@ -0,0 +1,159 @@
+"""Monte Carlo propagation of composition tolerances. Every alloy is sampled many times with its molar fractions
+perturbed (bounded uniform noise or a Dirichlet distribution around the nominal composition), the samples are
+evaluated together with the vectorized engine and the spread of every parameter is summarized by its mean, standard
+deviation and percentiles.
+e.g. 'python -m empirical_parameter_calculator uncertainty in.csv out.csv --tolerance 0.01 --samples 200'"""
+
+import csv
+import os
+import numpy as np
+import empirical_parameter_calculator as calculator
+import batch_calculator
+
+# the perturbations of the molar fractions
+methods = ('uniform', 'dirichlet')
+
+# the number of perturbed compositions evaluated at a time, which bounds the size of the temporaries
+_block_size = 250000
+
+
+def perturb(fractions, samples, tolerance=0.01, method='uniform', rng=None):
+    """function to return samples perturbed copies of every row of a matrix of molar fractions, as the consecutive
+    rows of a (N * samples) x E matrix normalized like mol_ratio in EmpiricalParams. Elements absent from an alloy
+    stay absent. 'uniform' adds independent noise of at most +-tolerance to every fraction (clipped at zero),
+    'dirichlet' draws from the Dirichlet distribution with the nominal fractions as its mean and a concentration
+    giving the fractions a standard deviation of about tolerance"""
+    check_tolerance(tolerance, method)
+    rng = rng or np.random.default_rng()
+    fractions = np.asarray(fractions, dtype=np.float64)
+    fractions = fractions / fractions.sum(axis=1, keepdims=True)
+    nominal = np.repeat(fractions, samples, axis=0)
+    present = nominal > 0
+
+    if method == 'uniform':
+        noise = rng.uniform(-tolerance, tolerance, nominal.shape)
+        perturbed = np.where(present, np.maximum(nominal + noise, 0), 0)
+    elif method == 'dirichlet':
+        # the variance of a Dirichlet component is c * (1 - c) / (alpha + 1), matched to tolerance^2 on average
+        spread = np.sum(fractions * (1 - fractions), axis=1) / np.maximum(np.count_nonzero(fractions, axis=1), 1)
+        concentration = np.maximum(spread / tolerance ** 2 - 1, 1)
+        perturbed = rng.standard_gamma(nominal * np.repeat(concentration, samples)[:, np.newaxis])
+    else:
+        raise ValueError('unknown perturbation {}, choose from {}'.format(method, ', '.join(methods)))
+
+    total = perturbed.sum(axis=1, keepdims=True)
+    # a sample that lost every element keeps the nominal composition
+    perturbed = np.where(total > 0, perturbed, nominal)
+    return perturbed / perturbed.sum(axis=1, keepdims=True)
+
+
+def statistic_field(name, statistic):
+    """function to return the field of propagate holding a statistic ('mean', 'std' or 'p<percentile>') of the
+    parameter name. The statistic follows a ':', which keeps the fields apart from parameter names such as vec_std"""
+    return '{}:{}'.format(name, statistic)
+
+
+def summary_dtype(names=calculator.PARAMETER_NAMES, percentiles=(5, 50, 95)):
+    """function to return the dtype of propagate: name:mean, name:std and name:p<percentile> for every name"""
+    fields = []
+    for name in names:
+        statistics = ['mean', 'std'] + ['p{:g}'.format(q) for q in percentiles]
+        fields += [(statistic_field(name, statistic), np.float64) for statistic in statistics]
+    return np.dtype(fields)
+
+
+def check_tolerance(tolerance, method='uniform'):
+    """function raising ValueError unless tolerance is a valid scatter of the molar fractions for method: finite and
+    not negative, and positive for 'dirichlet' whose concentration is inversely proportional to its square"""
+    if not 0 <= tolerance < np.inf:
+        raise ValueError('the tolerance must be a finite number of at least 0, not {}'.format(tolerance))
+    if method == 'dirichlet' and tolerance == 0:
+        raise ValueError('the dirichlet perturbation needs a tolerance above 0')
+
+
+def propagate(fractions, index, samples=1000, tolerance=0.01, method='uniform', percentiles=(5, 50, 95),
+              names=calculator.PARAMETER_NAMES, seed=None):
+    """function to return the mean, standard deviation and percentiles of the named parameters of N alloys, given as
+    an N x E matrix of molar ratios over the elements at the table positions index (shared, see composition_matrix,
+    or of every alloy, see slot_matrix), under samples perturbations of every alloy (see perturb). The result is a
+    structured array with the fields of summary_dtype, parameters that are missing (nan) for some sample have nan
+    statistics"""
+    fractions = np.atleast_2d(np.asarray(fractions, dtype=np.float64))
+    index = np.asarray(index, dtype=np.intp)
+    rng = np.random.default_rng(seed)
+    result = np.empty(len(fractions), dtype=summary_dtype(names, percentiles))
+    step = max(1, _block_size // samples)
+    for start in range(0, len(fractions), step):
+        block = fractions[start:start + step]
+        if index.ndim == 1:
+            # only the elements of the alloys of this block take part in its temporaries
+            columns = np.flatnonzero(block.any(axis=0))
+            block, block_index = block[:, columns], index[columns]
+        else:
+            block_index = np.repeat(index[start:start + step], samples, axis=0)
+        parameters = calculator.compute_batch_matrix(perturb(block, samples, tolerance, method, rng), block_index,
+                                                     names)
+        rows = result[start:start + step]
+        for name in names:
+            values = parameters[name].reshape(len(block), samples)
+            rows[statistic_field(name, 'mean')] = values.mean(axis=1)
+            rows[statistic_field(name, 'std')] = values.std(axis=1)
+            for q, percentile in zip(percentiles, np.percentile(values, percentiles, axis=1)):
+                rows[statistic_field(name, 'p{:g}'.format(q))] = percentile
+    return result
+
+
+def propagate_compositions(compositions, samples=1000, tolerance=0.01, method='uniform', percentiles=(5, 50, 95),
+                           names=calculator.PARAMETER_NAMES, seed=None):
+    """function to return the statistics of propagate for a sequence of (element_list, mol_ratio) pairs"""
+    # one slot per element of every alloy keeps the temporaries small for libraries spanning many elements
+    fractions, index = calculator.slot_matrix(*calculator.composition_arrays(compositions))
+    return propagate(fractions, index, samples, tolerance, method, percentiles, names, seed)
+
+
+def _uncertainty_chunk(rows, start, options):
+    """function run for every chunk of input rows by run_uncertainty, returns the output rows of the chunk. The seed
+    of every chunk is derived from its position, so that results do not depend on the number of workers"""
+    compositions = list(batch_calculator.parse_rows(rows, start))
+    if len(compositions) == 0:
+        return []
+    seed = None if options['seed'] is None else (options['seed'], start)
+    statistics = propagate_compositions(compositions, options['samples'], options['tolerance'], options['method'],
+                                        options['percentiles'], options['names'], seed)
+    symbols = calculator.element_data.symbols
+    columns = [statistics[name].tolist() for name in statistics.dtype.names]
+    output = []
+    for i, (elements, ratios) in enumerate(compositions):
+        output.append([''.join([symbols[element] + '-' for element in elements]),
+                       calculator.ratio_text(ratios, '-')] + [column[i] for column in columns])
+    return output
+
+
+def run_uncertainty(in_path, out_path, samples=1000, tolerance=0.01, method='uniform', percentiles=(5, 50, 95),
+                    names=calculator.PARAMETER_NAMES, seed=0, chunk_size=batch_calculator.default_chunk_size,
+                    workers=1):
+    """function to write the statistics of propagate for every alloy of a batch input file to a '.csv' file with
+    the columns 'Elements', 'Molar_ratios' and those of summary_dtype, returns the number of alloys written.
+    Parameters are in the units of EmpiricalParams (e.g. delta as a fraction)"""
+    if method not in methods:
+        raise ValueError('unknown perturbation {}, choose from {}'.format(method, ', '.join(methods)))
+    if samples < 1:
+        raise ValueError('at least one sample per alloy is needed')
+    check_tolerance(tolerance, method)
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError('percentiles must be between 0 and 100')
+    if not workers:
+        workers = os.cpu_count()
+    calculator.parameter_dtype(names)
+    options = {'samples': samples, 'tolerance': tolerance, 'method': method, 'percentiles': tuple(percentiles),
+               'names': tuple(names), 'seed': seed}
+    jobs = ((rows, 1 + i * chunk_size, options)
+            for i, rows in enumerate(batch_calculator.chunked(batch_calculator.read_rows(in_path), chunk_size)))
+    count = 0
+    with open(out_path, 'w', newline='') as out:
+        csv_write = csv.writer(out, dialect='excel')
+        csv_write.writerow(['Elements', 'Molar_ratios'] + list(summary_dtype(names, percentiles).names))
+        for rows in batch_calculator.map_chunks(_uncertainty_chunk, jobs, workers):
+            csv_write.writerows(rows)
+            count += len(rows)
+    return count